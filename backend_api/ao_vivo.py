@@ -0,0 +1,244 @@
+# backend_api/ao_vivo.py
+"""Detecção ao vivo pela câmera (WebSocket /ao_vivo)
+
+A "Câmera com Guia" do upload.html manda quadros JPEG reduzidos (mensagens
+binárias) enquanto o usuário enquadra a folha. Para cada quadro analisado o
+servidor devolve uma mensagem JSON com as caixas da detecção (normalizadas,
+em arrays por coluna, como no formato vetorial) e uma nota de qualidade do
+quadro (enquadramento no retângulo guia, nitidez e exposição) com dicas.
+
+Só o quadro mais recente é analisado: os que chegam enquanto o modelo
+trabalha ficam no buffer do WebSocket e são descartados na próxima leitura.
+Cada conexão tem um orçamento de AO_VIVO_FPS quadros por segundo e dura no
+máximo AO_VIVO_DURACAO_MAX_S; as inferências ao vivo do processo rodam uma
+por vez, e no máximo AO_VIVO_MAX_CONEXOES câmeras ficam abertas (cada
+conexão ocupa uma thread do gunicorn). Usa flask-sock, que é opcional: sem
+o pacote a rota não é registrada.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+from flask import request
+
+from codificacao import para_json
+
+AO_VIVO_ATIVO = os.environ.get("AO_VIVO_ATIVO", "1") == "1"
+AO_VIVO_FPS = float(os.environ.get("AO_VIVO_FPS", "4"))  # Quadros analisados por segundo em cada conexão
+AO_VIVO_MAX_CONEXOES = int(os.environ.get("AO_VIVO_MAX_CONEXOES", "2"))
+AO_VIVO_DURACAO_MAX_S = float(os.environ.get("AO_VIVO_DURACAO_MAX_S", "120"))
+AO_VIVO_OCIOSO_S = float(os.environ.get("AO_VIVO_OCIOSO_S", "10"))  # Sem quadros por este tempo, a conexão fecha
+AO_VIVO_QUADRO_MAX_KB = int(os.environ.get("AO_VIVO_QUADRO_MAX_KB", "256"))
+AO_VIVO_LADO_MAX = 640  # Quadros maiores são reduzidos antes da análise
+
+GUIA = (0.25, 0.25, 0.75, 0.75)  # Retângulo guia da câmera (x1, y1, x2, y2), como no upload.html
+COBERTURA_IDEAL = 0.35  # Fração do retângulo guia ocupada pela folha a partir da qual o enquadramento é pleno
+NITIDEZ_REF = 100.0  # Variância do laplaciano considerada nítida
+NOTA_PRONTO = 0.7
+
+log = logging.getLogger(__name__)
+
+_conexoes = threading.BoundedSemaphore(AO_VIVO_MAX_CONEXOES)
+# Uma inferência ao vivo por vez: as câmeras se revezam e sobra CPU para /predict e /detect_disease
+_lock_inferencia = threading.Lock()
+_lock_estatisticas = threading.Lock()
+estatisticas = {"conexoes": 0, "recusadas": 0, "ativas": 0, "quadros_analisados": 0, "quadros_descartados": 0}
+_registrado = False
+
+
+def _contar(**incrementos: int) -> None:
+    with _lock_estatisticas:
+        for nome, valor in incrementos.items():
+            estatisticas[nome] += valor
+
+
+def mascara_folha(img: np.ndarray) -> np.ndarray:
+    """Máscara aproximada da folha por cor (verde a amarelado), barata o bastante para cada quadro"""
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    # Matiz do OpenCV vai de 0 a 180: 20-95 cobre do amarelo (clorose) ao verde-azulado
+    mascara = cv2.inRange(hsv, (20, 40, 40), (95, 255, 255))
+    return cv2.morphologyEx(mascara, cv2.MORPH_OPEN, np.ones((5, 5), np.uint8))
+
+
+def qualidade_quadro(img: np.ndarray) -> Dict:
+    """Nota de 0 a 1 do quadro (enquadramento, nitidez e exposição) e dicas para o usuário"""
+    h, w = img.shape[:2]
+    cinza = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    nitidez = min(1.0, float(cv2.Laplacian(cinza, cv2.CV_64F).var()) / NITIDEZ_REF)
+    brilho = float(cinza.mean())
+    estourados = float(np.mean((cinza < 10) | (cinza > 245)))
+    exposicao = max(0.0, 1.0 - abs(brilho - 128) / 128 - estourados)
+
+    folha = mascara_folha(img) > 0
+    x1, y1, x2, y2 = int(GUIA[0] * w), int(GUIA[1] * h), int(GUIA[2] * w), int(GUIA[3] * h)
+    dentro = folha[y1:y2, x1:x2]
+    total = int(folha.sum())
+    cobertura = float(dentro.mean()) if dentro.size else 0.0
+    contida = float(dentro.sum()) / total if total else 0.0
+    enquadramento = min(1.0, cobertura / COBERTURA_IDEAL) * contida
+
+    dicas = []
+    if cobertura < COBERTURA_IDEAL / 2:
+        dicas.append("Aproxime a folha do retângulo verde")
+    elif contida < 0.6:
+        dicas.append("Centralize a folha no retângulo verde")
+    if nitidez < 0.5:
+        dicas.append("Segure o celular firme: imagem tremida ou fora de foco")
+    if brilho < 60:
+        dicas.append("Pouca luz")
+    elif brilho > 200 or estourados > 0.2:
+        dicas.append("Luz forte demais ou reflexo")
+
+    nota = 0.4 * enquadramento + 0.35 * nitidez + 0.25 * exposicao
+    return {
+        "nota": round(nota, 2),
+        "pronto": bool(nota >= NOTA_PRONTO),
+        "enquadramento": round(enquadramento, 2),
+        "nitidez": round(nitidez, 2),
+        "exposicao": round(exposicao, 2),
+        "dicas": dicas,
+    }
+
+
+def _mais_recente(ws, quadro: Union[bytes, str]) -> Tuple[Union[bytes, str], int]:
+    """Esvazia o buffer do WebSocket e fica só com o último quadro; retorna (quadro, descartados)"""
+    descartados = 0
+    while True:
+        proximo = ws.receive(timeout=0)
+        if proximo is None:
+            return quadro, descartados
+        if isinstance(proximo, (bytes, bytearray)):
+            descartados += isinstance(quadro, (bytes, bytearray))
+            quadro = proximo
+
+
+def _decodificar(quadro: bytes) -> Optional[np.ndarray]:
+    img = cv2.imdecode(np.frombuffer(quadro, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    escala = AO_VIVO_LADO_MAX / max(img.shape[:2])
+    if escala < 1:
+        img = cv2.resize(img, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA)
+    return img
+
+
+def _enviar(ws, dados: Dict) -> None:
+    # As colunas das detecções vêm como arrays numpy (formato_vetorial)
+    ws.send(json.dumps(para_json(dados), ensure_ascii=False, separators=(",", ":")))
+
+
+def sessao(ws, detectar: Callable[[np.ndarray, Dict], Dict], perfil: Dict, resumo: Dict) -> None:
+    """Laço de uma conexão: recebe quadros, analisa o mais recente dentro do orçamento e responde
+
+    resumo ("analisados", "descartados", "motivo") é atualizado durante a
+    sessão, para sobreviver ao fechamento da conexão pelo cliente.
+    """
+    inicio = time.monotonic()
+    intervalo = 1.0 / AO_VIVO_FPS
+    proxima_analise = inicio
+    while True:
+        quadro = ws.receive(timeout=AO_VIVO_OCIOSO_S)
+        if quadro is None:
+            resumo["motivo"] = "ocioso"
+            return
+        if time.monotonic() - inicio > AO_VIVO_DURACAO_MAX_S:
+            resumo["motivo"] = "duracao"
+            _enviar(ws, {"error": f"Sessão ao vivo limitada a {AO_VIVO_DURACAO_MAX_S:.0f}s", "fim": True})
+            return
+        # Orçamento da conexão: os quadros que chegam durante a espera só substituem o atual
+        espera = proxima_analise - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+
+        with _lock_inferencia:
+            quadro, descartados = _mais_recente(ws, quadro)
+            resumo["descartados"] += descartados
+            if not isinstance(quadro, (bytes, bytearray)):
+                continue  # Mensagens de texto (ping do cliente) não são quadros
+            t0 = time.perf_counter()
+            proxima_analise = time.monotonic() + intervalo
+            img = _decodificar(quadro)
+            if img is None:
+                _enviar(ws, {"error": "Quadro não é uma imagem JPEG/PNG válida"})
+                continue
+            try:
+                resultado = detectar(img, perfil)
+            except Exception as e:
+                log.exception("Erro na detecção ao vivo: %s", e)
+                resumo["motivo"] = "erro"
+                _enviar(ws, {"error": f"Erro interno no servidor: {str(e)}", "fim": True})
+                return
+
+        resumo["analisados"] += 1
+        _contar(quadros_analisados=1, quadros_descartados=descartados)
+        _enviar(ws, {
+            "quadro": resumo["analisados"],
+            **resultado,
+            "qualidade": qualidade_quadro(img),
+            "descartados": descartados,
+            "ms": round((time.perf_counter() - t0) * 1000, 1),
+        })
+
+
+def resumo() -> Dict:
+    with _lock_estatisticas:
+        return {"disponivel": _registrado, "fps": AO_VIVO_FPS, "max_conexoes": AO_VIVO_MAX_CONEXOES,
+                "duracao_max_s": AO_VIVO_DURACAO_MAX_S, **estatisticas}
+
+
+def registrar(app, detectar: Callable[[np.ndarray, Dict], Dict], obter_perfil: Callable[..., Dict],
+              disponivel: Callable[[Dict], bool]) -> None:
+    """Registra o WebSocket /ao_vivo?perfil=fast&cultura=pimenta no app Flask
+
+    detectar(img_bgr, perfil) devolve o resultado da detecção de um quadro já
+    no formato da resposta; disponivel(perfil) diz se há modelo de detecção.
+    O perfil (com a versão do modelo) é resolvido na conexão e vale para a
+    sessão inteira.
+    """
+    global _registrado
+    if not AO_VIVO_ATIVO:
+        return
+    try:
+        from flask_sock import Sock
+    except ImportError:
+        log.warning("flask-sock não instalado: detecção ao vivo (/ao_vivo) desativada")
+        return
+
+    # Quadros acima do limite derrubam a conexão no próprio simple-websocket
+    app.config.setdefault("SOCK_SERVER_OPTIONS", {"max_message_size": AO_VIVO_QUADRO_MAX_KB * 1024,
+                                                   "ping_interval": 25})
+    sock = Sock(app)
+
+    @sock.route("/ao_vivo")
+    def ao_vivo_endpoint(ws):
+        try:
+            perfil = obter_perfil(request.args.get("perfil"), cultura=request.args.get("cultura"))
+        except ValueError as e:
+            _enviar(ws, {"error": str(e), "fim": True})
+            return
+        if not disponivel(perfil):
+            _enviar(ws, {"error": "Modelo de detecção não está disponível", "fim": True})
+            return
+        if not _conexoes.acquire(blocking=False):
+            _contar(recusadas=1)
+            _enviar(ws, {"error": "Muitas câmeras ao vivo conectadas, tente novamente em instantes", "fim": True})
+            return
+        _contar(conexoes=1, ativas=1)
+        inicio = time.monotonic()
+        fim = {"analisados": 0, "descartados": 0, "motivo": "cliente"}
+        try:
+            _enviar(ws, {"pronto": True, "fps": AO_VIVO_FPS, "perfil": perfil["nome"],
+                         "quadro_max_kb": AO_VIVO_QUADRO_MAX_KB})
+            sessao(ws, detectar, perfil, fim)
+        finally:
+            _contar(ativas=-1)
+            _conexoes.release()
+            log.info("Sessão ao vivo encerrada", extra={"campos": {
+                **fim, "duracao_s": round(time.monotonic() - inicio, 1), "perfil": perfil["nome"]}})
+
+    _registrado = True
@@ -1,63 +1,479 @@
 # backend_api/app.py
+import collections
+import hashlib
+import logging
 import os
 import cv2
 import numpy as np
-import base64
 import uuid
-from typing import Dict, List
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from PIL import Image
-from rembg import remove
-from ultralytics import YOLO
+# ultralytics, rembg e torch são importados sob demanda (ver _yolo, obter_sessao_rembg
+# e inferencia_direta): juntos custam vários segundos de boot e, com artefatos
+# pré-serializados e INFERENCIA_DIRETA=1, o Ultralytics nem chega a ser carregado.
+from pipeline import Pipeline, parse_workers
+import autotune
+from perfilamento import perfilar, registrar_rotas as registrar_rotas_perfis
+import memoria
+import registro
+import formato_vetorial
+from codificacao import corpo_requisicao, ler_imagem, responder
+import idempotencia
+import ao_vivo
+import video
+import duplicatas
+import banco
+import geo
+import modelos
+from backend_openvino import SessaoOpenVINO, converter_para_ir, metadata_onnx, names_ir
 
 # --- Configuração do Flask ---
+registro.configurar()
+log = logging.getLogger(__name__)
+
 app = Flask(__name__)
 CORS(app)  # Permite que o frontend acesse a API
+registro.registrar(app)  # X-Request-ID e uma linha de log por requisição com o tempo das etapas
+registrar_rotas_perfis(app)  # GET /profiles (perfis capturados com PROFILING_TOKEN/PROFILING_AMOSTRAGEM)
+banco.registrar_rotas(app)  # GET /talhoes/... (histórico de análises por talhão)
 
 # --- Constantes e Carregamento do Modelo ---
 # Estas pastas serão usadas DENTRO do container na nuvem
 INPUT_FOLDER = "/tmp/input"
 OUTPUT_FOLDER = "/tmp/output"
 PLOTS_FOLDER = "/tmp/plots"
+# RSS por requisição e /admin/memoria (tracemalloc); as pastas entram no relatório
+# porque no Cloud Run o /tmp ocupa a memória do container
+memoria.registrar(app, [INPUT_FOLDER, OUTPUT_FOLDER, PLOTS_FOLDER])
 os.makedirs(INPUT_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 os.makedirs(PLOTS_FOLDER, exist_ok=True)
 
 # O modelo será copiado para dentro do container pelo Dockerfile
+# Os modelos são carregados sob demanda; AQUECER=1 (padrão) os carrega numa
+# thread logo após o import, sem segurar o worker do gunicorn.
 MODEL_PATH = "yolov8n-seg.pt" 
-model = YOLO(MODEL_PATH)
-print("Modelo YOLO carregado com sucesso.")
 
 # Modelo para detecção de doenças (YOLOv8 para classificação)
 DETECTION_MODEL_PATH = "modelo-deteccao.pt"
-detection_model = None
-if os.path.exists(DETECTION_MODEL_PATH):
+# Versões treinadas de novo por cultura ficam no registro (modelos.py, pasta
+# MODELOS_DIR); os dois acima são os embutidos, usados quando não há versão ativa.
+_deteccao_falhou = set()  # Caminhos de modelos de detecção que falharam ao carregar
+if not os.path.exists(DETECTION_MODEL_PATH):
+    log.warning("Modelo de detecção não encontrado em %s", DETECTION_MODEL_PATH)
+
+def deteccao_disponivel(perfil: Optional[Dict] = None) -> bool:
+    """Há modelo de detecção (o do perfil ou o embutido) e ele não falhou ao carregar"""
+    caminho = perfil["det_model"] if perfil else DETECTION_MODEL_PATH
+    return os.path.exists(caminho) and caminho not in _deteccao_falhou
+
+def _yolo(*args, **kwargs):
+    """Cria um ultralytics.YOLO, importando o Ultralytics só na primeira vez que é preciso"""
+    from ultralytics import YOLO
+    return YOLO(*args, **kwargs)
+
+# --- Perfis de velocidade/precisão ---
+# Cada perfil define juntos todos os parâmetros de qualidade do pipeline.
+# "balanced" reproduz o comportamento original do servidor.
+#   target_size: entrada da segmentação | intermediate_size: resize antes do rembg
+#   detection_size: entrada da detecção | rembg_model: modelo de remoção de fundo
+#   seg_conf / det_conf: confiança mínima | backend: "pytorch", "onnx" ou "openvino"
+#   precisao: "fp32" ou "fp16" | seg_model: variante do modelo de segmentação
+# O backend de todos os perfis pode ser trocado com a variável BACKEND
+# ("pytorch", "onnx" ou "openvino"), por exemplo em máquinas Intel só com CPU.
+PERFIS = {
+    "fast": {
+        "target_size": (480, 480),
+        "intermediate_size": 640,
+        "detection_size": (256, 256),
+        "rembg_model": "u2netp",
+        "seg_conf": 0.6,
+        "det_conf": 0.3,
+        "backend": "onnx",
+        "precisao": "fp32",
+        "seg_model": MODEL_PATH,
+    },
+    "balanced": {
+        "target_size": (640, 640),
+        "intermediate_size": 1024,
+        "detection_size": (256, 256),
+        "rembg_model": "u2net",
+        "seg_conf": 0.6,
+        "det_conf": 0.3,
+        "backend": "pytorch",
+        "precisao": "fp32",
+        "seg_model": MODEL_PATH,
+    },
+    "accurate": {
+        "target_size": (800, 800),
+        "intermediate_size": 1280,
+        "detection_size": (320, 320),
+        "rembg_model": "isnet-general-use",
+        "seg_conf": 0.5,
+        "det_conf": 0.25,
+        "backend": "pytorch",
+        "precisao": "fp32",
+        "seg_model": "yolov8s-seg.pt",  # Cai para MODEL_PATH se não existir no container
+    },
+}
+PERFIL_PADRAO = os.environ.get("PERFIL_PADRAO", "balanced")
+if PERFIL_PADRAO not in PERFIS:
+    log.warning("Perfil '%s' desconhecido, usando 'balanced'", PERFIL_PADRAO)
+    PERFIL_PADRAO = "balanced"
+BACKENDS = ("pytorch", "onnx", "openvino")
+BACKEND_FORCADO = os.environ.get("BACKEND") or None
+if BACKEND_FORCADO and BACKEND_FORCADO not in BACKENDS:
+    log.warning("Backend '%s' desconhecido, usando o de cada perfil", BACKEND_FORCADO)
+    BACKEND_FORCADO = None
+
+def obter_perfil(nome: Optional[str] = None, backend: Optional[str] = None, cultura: Optional[str] = None) -> Dict:
+    """Retorna o perfil pelo nome (ou o padrão do servidor), com o backend opcionalmente trocado
+
+    Os modelos da cultura são resolvidos aqui, uma vez por requisição: a
+    versão ativa do registro (modelos.py) ou o modelo embutido. Uma troca de
+    versão no meio da requisição não muda o modelo que ela usa.
+    """
+    nome = nome or PERFIL_PADRAO
+    if nome not in PERFIS:
+        raise ValueError(f"Perfil desconhecido: {nome}. Opções: {', '.join(PERFIS)}")
+    perfil = {"nome": nome, **PERFIS[nome]}
+    backend = backend or BACKEND_FORCADO
+    if backend:
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend desconhecido: {backend}. Opções: {', '.join(BACKENDS)}")
+        perfil["backend"] = backend
+    perfil["cultura"] = modelos.ler_cultura(cultura)
+    if not os.path.exists(perfil["seg_model"]):
+        perfil["seg_model"] = MODEL_PATH
+    perfil["det_model"] = DETECTION_MODEL_PATH
+    perfil["versoes"] = {}
+    for tarefa, campo in (("segment", "seg_model"), ("detect", "det_model")):
+        entrada = modelos.registro.ativo(perfil["cultura"], tarefa)
+        if entrada is not None:
+            perfil[campo] = entrada["caminho"]
+            perfil["versoes"][tarefa] = f"{entrada['id']}@{entrada['versao']}"
+        else:
+            perfil["versoes"][tarefa] = os.path.basename(perfil[campo])
+    return perfil
+
+# Modelos e sessões carregados sob demanda, um por combinação de perfil.
+# Os modelos (YOLO e do caminho direto) dividem um cache LRU limitado por
+# MODELOS_MAX/MODELOS_MEMORIA_MB: versões antigas e perfis pouco usados saem primeiro.
+# Cada chave carrega uma vez só (aquecimento x primeira requisição) sem
+# segurar as outras: o cache espera por chave, e as exportações e sessões do
+# rembg usam um lock por arquivo/chave (_lock_da_chave).
+_modelos = modelos.CacheModelos()
+_sessoes_rembg = {}
+_locks_por_chave: Dict[tuple, threading.Lock] = {}
+
+def _lock_da_chave(*chave) -> threading.Lock:
+    return _locks_por_chave.setdefault(chave, threading.Lock())  # setdefault é atômico
+
+# Configuração de execução da máquina (backend, threads e lote), preenchida
+# pelo autoajuste (autotune.py). "lote" é o lote da detecção e da segmentação
+# nos pipelines (/predict_lote, /predict_video).
+#   AUTOTUNE: "0" desligado | "carregar" só lê o arquivo | "1" lê ou mede no boot
+AUTOTUNE = os.environ.get("AUTOTUNE", "0")
+AUTOTUNE_ARQUIVO = os.environ.get("AUTOTUNE_ARQUIVO", "autotune.json")
+AUTOTUNE_SLO_MS = float(os.environ.get("AUTOTUNE_SLO_MS", "2000"))
+CONFIG_EXECUCAO = {"backend": None, "threads": None, "lote": 1, "origem": "padrão"}
+
+# Caminho de inferência enxuto (sem o predictor do Ultralytics) para a
+# segmentação da imagem inteira e para a detecção. Ver inferencia_direta.py.
+INFERENCIA_DIRETA = os.environ.get("INFERENCIA_DIRETA", "0") == "1"
+
+def _caminho_onnx(caminho: str, precisao: str) -> str:
+    """Exporta o modelo para ONNX uma única vez; o .onnx fica em cache ao lado do .pt"""
+    caminho_onnx = os.path.splitext(caminho)[0] + ("_fp16" if precisao == "fp16" else "") + ".onnx"
+    with _lock_da_chave("exportacao", caminho_onnx):
+        if not os.path.exists(caminho_onnx):
+            exportado = _yolo(caminho).export(format="onnx", dynamic=True, half=precisao == "fp16")
+            os.replace(exportado, caminho_onnx)
+    return caminho_onnx
+
+def _caminho_openvino(caminho: str, precisao: str) -> str:
+    """Converte o ONNX exportado para OpenVINO IR uma única vez; retorna o .xml em cache
+
+    A pasta segue o padrão do Ultralytics (<modelo>_openvino_model/ com
+    metadata.yaml), então YOLO(pasta) também a carrega.
+    """
+    base = os.path.splitext(caminho)[0] + ("_fp16" if precisao == "fp16" else "")
+    caminho_xml = os.path.join(f"{base}_openvino_model", os.path.basename(base) + ".xml")
+    with _lock_da_chave("exportacao", caminho_xml):
+        if not os.path.exists(caminho_xml):
+            caminho_onnx = _caminho_onnx(caminho, "fp32")
+            converter_para_ir(caminho_onnx, caminho_xml, fp16=precisao == "fp16",
+                              metadata=metadata_onnx(caminho_onnx))
+    return caminho_xml
+
+def _caminho_torchscript(caminho: str, imgsz: int, exportar: bool = True) -> str:
+    """Exporta o modelo para TorchScript uma única vez por tamanho de entrada (cache ao lado do .pt)
+
+    O trace fixa o tamanho da entrada, por isso um arquivo por imgsz.
+    """
+    caminho_ts = f"{os.path.splitext(caminho)[0]}_{imgsz}.torchscript"
+    if exportar:
+        with _lock_da_chave("exportacao", caminho_ts):
+            if not os.path.exists(caminho_ts):
+                exportado = _yolo(caminho).export(format="torchscript", imgsz=imgsz)
+                os.replace(exportado, caminho_ts)
+    return caminho_ts
+
+def _carregar_modelo(caminho: str, backend: str, precisao: str, tarefa: str):
+    """Carrega (ou reaproveita) um modelo YOLO no backend e precisão pedidos"""
+    def criar():
+        if backend == "onnx":
+            modelo = _yolo(_caminho_onnx(caminho, precisao), task=tarefa)
+        elif backend == "openvino":
+            modelo = _yolo(os.path.dirname(_caminho_openvino(caminho, precisao)), task=tarefa)
+        else:
+            modelo = _yolo(caminho)
+        log.info("Modelo %s carregado (%s, %s).", caminho, backend, precisao)
+        return modelo
+    return _modelos.obter(("yolo", caminho, backend, precisao), criar, caminho)
+
+def _criar_modelo_direto(caminho: str, backend: str, precisao: str, tarefa: str, imgsz: int,
+                         threads: Optional[int] = None) -> "ModeloDireto":
+    """Monta o modelo no caminho de inferência enxuto (sem cache)
+
+    threads limita as threads do ONNX Runtime/OpenVINO; no PyTorch o limite
+    é global (torch.set_num_threads).
+    """
+    from inferencia_direta import ModeloDireto
+    if backend == "onnx":
+        import ast
+        import onnxruntime as ort
+        opcoes = ort.SessionOptions()
+        if threads:
+            opcoes.intra_op_num_threads = threads
+        sessao = ort.InferenceSession(_caminho_onnx(caminho, precisao), sess_options=opcoes,
+                                      providers=["CPUExecutionProvider"])
+        names = ast.literal_eval(sessao.get_modelmeta().custom_metadata_map["names"])
+        return ModeloDireto(sessao, tarefa, names, imgsz)
+    if backend == "openvino":
+        caminho_xml = _caminho_openvino(caminho, precisao)
+        return ModeloDireto(SessaoOpenVINO(caminho_xml, threads), tarefa, names_ir(caminho_xml), imgsz)
+    # PyTorch: TorchScript pré-serializado (preparar_artefatos) carrega sem o Ultralytics
+    caminho_ts = _caminho_torchscript(caminho, imgsz, exportar=False)
+    if os.path.exists(caminho_ts):
+        return ModeloDireto.de_torchscript(caminho_ts, tarefa, imgsz)
+    yolo = _carregar_modelo(caminho, "pytorch", precisao, tarefa)
+    return ModeloDireto.de_yolo(yolo, imgsz)
+
+def _carregar_modelo_direto(caminho: str, perfil: Dict, tarefa: str, imgsz: int) -> "ModeloDireto":
+    """Carrega (ou reaproveita) o modelo no caminho de inferência enxuto"""
+    def criar():
+        modelo = _criar_modelo_direto(caminho, perfil["backend"], perfil["precisao"], tarefa,
+                                      imgsz, CONFIG_EXECUCAO["threads"])
+        log.info("Modelo %s pronto para inferência direta (%s, %dpx).", caminho, perfil["backend"], imgsz)
+        return modelo
+    return _modelos.obter(("direto", caminho, perfil["backend"], perfil["precisao"], imgsz), criar, caminho)
+
+def obter_modelo_segmentacao(perfil: Dict, direto: bool = False):
+    """Modelo de segmentação de lesões do perfil"""
+    caminho = perfil["seg_model"]
+    if direto:
+        return _carregar_modelo_direto(caminho, perfil, "segment", perfil["target_size"][0])
+    return _carregar_modelo(caminho, perfil["backend"], perfil["precisao"], "segment")
+
+def obter_modelo_deteccao(perfil: Dict, direto: bool = False):
+    """Modelo de detecção de doenças do perfil (None se não houver modelo)"""
+    if not deteccao_disponivel(perfil):
+        return None
     try:
-        detection_model = YOLO(DETECTION_MODEL_PATH)
-        print("Modelo YOLOv8 de detecção carregado com sucesso.")
+        if direto:
+            return _carregar_modelo_direto(perfil["det_model"], perfil, "detect", perfil["detection_size"][0])
+        return _carregar_modelo(perfil["det_model"], perfil["backend"], perfil["precisao"], "detect")
     except Exception as e:
-        print(f"ERRO ao carregar modelo de detecção: {e}")
-        detection_model = None
-else:
-    print(f"AVISO: Modelo de detecção não encontrado em {DETECTION_MODEL_PATH}")
+        log.error("Falha ao carregar modelo de detecção %s: %s", perfil["det_model"], e)
+        _deteccao_falhou.add(perfil["det_model"])
+        return None
+
+def _aquecer_versao(entrada: Dict) -> None:
+    """Carrega uma versão do registro no backend do perfil padrão (antes de ela ser ativada)"""
+    perfil = obter_perfil()
+    tamanho = perfil["target_size" if entrada["tarefa"] == "segment" else "detection_size"][0]
+    if INFERENCIA_DIRETA:
+        _carregar_modelo_direto(entrada["caminho"], perfil, entrada["tarefa"], tamanho)
+    else:
+        _carregar_modelo(entrada["caminho"], perfil["backend"], perfil["precisao"], entrada["tarefa"])
+
+def obter_sessao_rembg(perfil: Dict):
+    """Sessão do rembg reaproveitada entre requisições
+
+    No backend OpenVINO o modelo ONNX baixado pelo rembg é convertido para IR
+    (em cache ao lado do .onnx) e a sessão interna do rembg é trocada.
+    """
+    nome = perfil["rembg_model"]
+    backend = "openvino" if perfil["backend"] == "openvino" else "onnx"
+    chave = (nome, backend)
+    if chave in _sessoes_rembg:
+        return _sessoes_rembg[chave]
+    with _lock_da_chave("rembg", *chave):
+        if chave not in _sessoes_rembg:
+            from rembg import new_session
+            sessao = new_session(nome)
+            if backend == "openvino":
+                caminho_onnx = str(type(sessao).download_models())
+                caminho_xml = converter_para_ir(caminho_onnx, os.path.splitext(caminho_onnx)[0] + "_openvino.xml")
+                sessao.inner_session = SessaoOpenVINO(caminho_xml, CONFIG_EXECUCAO["threads"])
+            _sessoes_rembg[chave] = sessao
+        return _sessoes_rembg[chave]
+
+def aplicar_config_execucao(config: Dict, origem: str) -> None:
+    """Aplica backend, threads e lote escolhidos (a variável BACKEND tem precedência)"""
+    global BACKEND_FORCADO
+    CONFIG_EXECUCAO.update({chave: config.get(chave) for chave in ("backend", "threads", "lote")})
+    CONFIG_EXECUCAO["lote"] = CONFIG_EXECUCAO["lote"] or 1
+    CONFIG_EXECUCAO["origem"] = origem
+    if config.get("backend") and not os.environ.get("BACKEND"):
+        BACKEND_FORCADO = config["backend"]
+    if config.get("threads"):
+        import torch
+        torch.set_num_threads(config["threads"])
+    # Modelos diretos e sessões são recriados com o novo limite de threads
+    _modelos.descartar(lambda chave: chave[0] == "direto")
+    log.info("Configuração de execução (%s): backend %s, %s threads, lote %d", origem,
+             BACKEND_FORCADO or "do perfil", CONFIG_EXECUCAO["threads"] or "todas as", CONFIG_EXECUCAO["lote"])
+
+def executar_autotune(backends: Optional[List[str]] = None, slo_ms: float = AUTOTUNE_SLO_MS,
+                      lotes: Optional[List[int]] = None, repeticoes: int = 3,
+                      caminho: Optional[str] = None) -> Dict:
+    """Mede backends/threads/lotes nesta máquina, salva o resultado e aplica"""
+    perfil = obter_perfil()
+
+    def criar(backend, tarefa, imgsz, threads):
+        caminho_modelo = perfil["seg_model"] if tarefa == "segment" else perfil["det_model"]
+        return _criar_modelo_direto(caminho_modelo, backend, perfil["precisao"], tarefa, imgsz, threads)
+
+    config = autotune.autoajustar(criar, backends or list(BACKENDS), seg_size=perfil["target_size"][0],
+                                  det_size=perfil["detection_size"][0] if deteccao_disponivel(perfil) else None,
+                                  lotes=lotes or list(autotune.LOTES_PADRAO), slo_ms=slo_ms, repeticoes=repeticoes)
+    autotune.salvar(config, caminho or AUTOTUNE_ARQUIVO)
+    aplicar_config_execucao(config, "autoajuste medido agora")
+    return config
+
+def _configurar_execucao() -> None:
+    """Aplica o autoajuste salvo para esta máquina, ou mede agora se AUTOTUNE=1"""
+    config_salva = autotune.carregar(AUTOTUNE_ARQUIVO)
+    if config_salva is not None:
+        aplicar_config_execucao(config_salva, f"autoajuste de {config_salva.get('medido_em', '?')}")
+    elif AUTOTUNE == "1":
+        try:
+            executar_autotune()
+        except Exception as e:
+            log.warning("Autoajuste falhou, usando a configuração padrão: %s", e)
+    else:
+        log.warning("%s não tem configuração para esta máquina", AUTOTUNE_ARQUIVO)
+
+# --- Boot ---
+# O import do módulo fica leve (sem modelos); AQUECER=1 carrega os modelos do
+# perfil padrão numa thread, para o worker aceitar conexões logo. GET /pronto
+# responde 503 até o aquecimento terminar (útil como startup probe do Cloud Run).
+AQUECER = os.environ.get("AQUECER", "1") == "1"
+ESTADO_BOOT = {"pronto": False, "aquecimento_s": None, "erro": None}
+
+def aquecer() -> None:
+    """Carrega modelos e sessão do rembg do perfil padrão antes da primeira requisição"""
+    inicio = time.perf_counter()
+    try:
+        if AUTOTUNE != "0":
+            _configurar_execucao()
+        perfil = obter_perfil()
+        obter_modelo_segmentacao(perfil, direto=INFERENCIA_DIRETA)
+        obter_modelo_deteccao(perfil, direto=INFERENCIA_DIRETA)
+        obter_sessao_rembg(perfil)
+    except Exception as e:
+        ESTADO_BOOT["erro"] = str(e)
+        log.warning("Aquecimento incompleto, o restante carrega na primeira requisição: %s", e)
+    ESTADO_BOOT["aquecimento_s"] = round(time.perf_counter() - inicio, 2)
+    ESTADO_BOOT["pronto"] = True
+    log.info("Aquecimento concluído em %.1fs", ESTADO_BOOT["aquecimento_s"])
+
+def preparar_artefatos(perfis_rembg: Optional[List[str]] = None) -> None:
+    """Gera os artefatos pré-serializados (TorchScript, ONNX, OpenVINO) e baixa os modelos do rembg
+
+    Feito para o build da imagem (AQUECER=0 python -c "import app; app.preparar_artefatos()"),
+    assim o container não exporta nem baixa nada no boot. Os modelos do rembg
+    são grandes: por padrão só o do perfil padrão entra na imagem.
+    """
+    for nome in PERFIS:
+        perfil = obter_perfil(nome)
+        for caminho, imgsz in ((perfil["seg_model"], perfil["target_size"][0]),
+                               (perfil["det_model"], perfil["detection_size"][0])):
+            if not os.path.exists(caminho):
+                continue
+            _caminho_torchscript(caminho, imgsz)
+            _caminho_onnx(caminho, perfil["precisao"])
+            try:
+                _caminho_openvino(caminho, perfil["precisao"])
+            except ImportError:
+                log.warning("openvino não instalado, IR não gerada")
+    for nome in perfis_rembg or [PERFIL_PADRAO]:
+        obter_sessao_rembg(obter_perfil(nome))
+    log.info("Artefatos prontos.")
 
 # --- Lógica de Processamento de Imagem ---
-TARGET_SIZE = (640, 640)
 ZOOM_FACTOR = 1.0  # Sem zoom - usa 100% da imagem
 ADD_PADDING = False  # Padding desativado
 PADDING_FACTOR = 0.15
 
-def preprocess_image(image_path: str, output_path: str) -> None:
-    """Processa imagem com abordagem melhorada para centralização"""
-    print("[DEBUG] preprocess_image:", image_path, "->", output_path)
+# --- Modo cascata (detecção antes da segmentação) ---
+# O modelo de detecção (256x256) roda primeiro; rembg + segmentação só rodam
+# se ele encontrar lesão com confiança >= CASCATA_CONF. Caso contrário a folha
+# recebe severidade 0% e é marcada como "gated".
+CASCATA_ATIVA = os.environ.get("CASCATA_ATIVA", "0") == "1"
+CASCATA_CONF = float(os.environ.get("CASCATA_CONF", "0.4"))
+
+# --- Modo ROI (segmentação apenas em volta das detecções) ---
+# As caixas do modelo de detecção são levadas para o espaço da imagem
+# processada, expandidas por uma margem e recortadas da imagem intermediária
+# (1024px, sem fundo). Os recortes vão em lote para o modelo de segmentação.
+ROI_IMGSZ = int(os.environ.get("ROI_IMGSZ", "320"))
+ROI_MARGEM = 0.25  # Expansão de cada lado, como fração do lado da caixa
+ROI_MIN_LADO = 32  # Lado mínimo do recorte no espaço target_size
+ROI_AREA_MAX = 0.5  # Acima desta fração da imagem, segmentar a imagem inteira sai mais barato
+
+# --- Várias folhas na mesma foto ("folhas": "multiplas") ---
+# Em vez de escolher um único contorno, cada folha da imagem processada vira
+# uma instância com a própria severidade (foto de um ramo com várias folhas).
+FOLHAS_MODOS = ("uma", "multiplas")
+FOLHA_AREA_MIN = float(os.environ.get("FOLHA_AREA_MIN", "0.01"))  # Fração da imagem abaixo da qual não é folha
+# Lado da abertura morfológica, como fração da imagem: separa folhas ligadas só por pecíolo ou galho fino
+FOLHA_ABERTURA = float(os.environ.get("FOLHA_ABERTURA", "0.03"))
+
+# --- Pipeline em estágios para lotes de imagens (/predict_lote) ---
+# Threads por estágio, sobrescrevíveis com PIPELINE_WORKERS="preprocessar=3,contornos=2".
+# Detecção e segmentação ficam com 1 thread: cada modelo carregado roda uma
+# chamada por vez (modelos.lock_de_uso). O rembg (ONNX Runtime) aceita várias.
+PIPELINE_WORKERS = parse_workers(os.environ.get("PIPELINE_WORKERS"), {
+    "decodificar": 1, "detectar": 1, "preprocessar": 2, "segmentar": 1, "contornos": 1, "codificar": 1,
+})
+PIPELINE_FILA = int(os.environ.get("PIPELINE_FILA", "2"))  # Itens em espera entre dois estágios
+PIPELINE_MAX_IMAGENS = int(os.environ.get("PIPELINE_MAX_IMAGENS", "30"))
+
+def preprocess_image(image_path: str, output_path: str, intermediate_path: Optional[str] = None,
+                     perfil: Optional[Dict] = None) -> Optional[Dict]:
+    """Processa imagem com abordagem melhorada para centralização
+
+    Retorna a geometria do recorte quadrado (em coordenadas da imagem original)
+    para permitir mapear coordenadas entre as duas imagens. Se intermediate_path
+    for informado, salva também a imagem sem fundo no tamanho intermediário.
+    """
+    perfil = perfil or obter_perfil()
+    target_size = perfil["target_size"]
+    log.debug("preprocess_image: %s -> %s", image_path, output_path)
     img = cv2.imread(image_path)
     if img is None:
-        print(f"Erro ao carregar a imagem: {image_path}")
-        return
+        log.error("Erro ao carregar a imagem: %s", image_path)
+        return None
     
     h, w = img.shape[:2]
-    print(f"[DEBUG] Dimensões originais: {w}x{h}")
+    log.debug("Dimensões originais: %dx%d", w, h)
     
     # PASSO 1: Tornar a imagem quadrada (crop central EXPANDIDO)
     # Usar a menor dimensão como base e EXPANDIR para capturar mais área
@@ -95,7 +511,7 @@ def preprocess_image(image_path: str, output_path: str) -> None:
     
     # Fazer crop quadrado central expandido
     img_square = img[top:bottom, left:right]
-    print(f"[DEBUG] Após crop quadrado: {img_square.shape[1]}x{img_square.shape[0]}")
+    log.debug("Após crop quadrado: %dx%d", img_square.shape[1], img_square.shape[0])
     
     # PASSO 2: Aplicar zoom (se necessário)
     # ZOOM_FACTOR = 1.0 significa usar 100% da imagem (sem zoom)
@@ -108,15 +524,17 @@ def preprocess_image(image_path: str, output_path: str) -> None:
         
         # Aplicar zoom (crop com margens iguais)
         img_zoomed = img_square[margin:margin+zoom_size, margin:margin+zoom_size]
-        print(f"[DEBUG] Aplicando zoom - capturando {ZOOM_FACTOR*100:.0f}% da imagem: {img_zoomed.shape[1]}x{img_zoomed.shape[0]}")
+        left += margin
+        top += margin
+        log.debug("Aplicando zoom - capturando %.0f%% da imagem: %dx%d", ZOOM_FACTOR * 100, img_zoomed.shape[1], img_zoomed.shape[0])
     else:
         # Sem zoom - usa a imagem quadrada completa
         img_zoomed = img_square
-        print(f"[DEBUG] Sem zoom - usando 100% da imagem quadrada: {img_zoomed.shape[1]}x{img_zoomed.shape[0]}")
+        log.debug("Sem zoom - usando 100%% da imagem quadrada: %dx%d", img_zoomed.shape[1], img_zoomed.shape[0])
     
     # PASSO 3: Redimensionar para um tamanho adequado para o rembg
     # Usar um tamanho maior para melhor qualidade no rembg
-    intermediate_size = 1024
+    intermediate_size = perfil["intermediate_size"]
     img_resized = cv2.resize(img_zoomed, (intermediate_size, intermediate_size), interpolation=cv2.INTER_CUBIC)
     
     # Converter para RGB para o rembg
@@ -124,16 +542,18 @@ def preprocess_image(image_path: str, output_path: str) -> None:
     pil_img = Image.fromarray(img_rgb)
     
     try:
-        output_img = remove(pil_img)
+        from rembg import remove
+        with registro.etapa("rembg"):
+            output_img = remove(pil_img, session=obter_sessao_rembg(perfil))
         try:
             orientation = pil_img.getexif().get(274, 1) if hasattr(pil_img, "getexif") and pil_img.getexif() else 1
         except Exception:
             orientation = 1
     except Exception as e:
-        print(f"Erro ao remover o fundo: {e}")
+        log.error("Erro ao remover o fundo: %s", e)
         # Se a remoção do fundo falhar, não há como continuar o processamento
         orientation = 1
-        return
+        return None
     
     # Garantir que output_img seja PIL.Image
     if isinstance(output_img, bytes):
@@ -147,74 +567,128 @@ def preprocess_image(image_path: str, output_path: str) -> None:
     background = Image.new("RGBA", output_img.size, (255, 255, 255, 255))
     composited = Image.alpha_composite(background, output_img)
     composited = composited.convert("RGB")
+    if intermediate_path:
+        composited.save(intermediate_path)
     
     # PASSO 5: Adicionar padding se configurado (para "afastar" a imagem)
     if ADD_PADDING:
         # Primeiro reduzir a imagem para deixar espaço para o padding
         reduction_factor = 1 - (PADDING_FACTOR * 2)  # Se padding é 15%, reduzir para 70%
-        reduced_size = int(TARGET_SIZE[0] * reduction_factor)
+        reduced_size = int(target_size[0] * reduction_factor)
         
         # Reduzir a imagem
         composited = composited.resize((reduced_size, reduced_size), Image.Resampling.LANCZOS)
         
         # Criar imagem final com tamanho alvo e fundo branco
-        final_img = Image.new("RGB", TARGET_SIZE, (255, 255, 255))
+        final_img = Image.new("RGB", target_size, (255, 255, 255))
         
         # Calcular posição para centralizar a imagem reduzida
-        paste_position = (TARGET_SIZE[0] - reduced_size) // 2
+        paste_position = (target_size[0] - reduced_size) // 2
         
         # Colar a imagem reduzida no centro
         final_img.paste(composited, (paste_position, paste_position))
         composited = final_img
-        print(f"[DEBUG] Imagem reduzida para {reduction_factor*100:.0f}% e padding de {PADDING_FACTOR*100:.0f}% aplicado")
+        log.debug("Imagem reduzida para %.0f%% e padding de %.0f%% aplicado", reduction_factor * 100, PADDING_FACTOR * 100)
     else:
         # PASSO 6: Resize final para 640x640 (tamanho ideal para inferência YOLO)
-        composited = composited.resize(TARGET_SIZE, Image.Resampling.LANCZOS)
+        composited = composited.resize(target_size, Image.Resampling.LANCZOS)
     
     composited.save(output_path)
-    print(f"[DEBUG] Imagem salva em: {output_path} com dimensões {TARGET_SIZE}")
-    print("[DEBUG] Arquivo existe:", os.path.exists(output_path))
+    log.debug("Imagem salva em: %s com dimensões %s", output_path, target_size)
+    
+    geometria = {"left": left, "top": top, "size": img_zoomed.shape[0], "width": w, "height": h}
     
     # Limpeza explícita de memória
     del pil_img, output_img, background, composited, img, img_square, img_zoomed, img_resized
+    
+    return geometria
+
+def preprocess_image_detection(image_path: str, output_path: str, perfil: Optional[Dict] = None) -> Optional[np.ndarray]:
+    """Redimensiona imagem para 256x256 para detecção de doenças com YOLOv8
 
-def preprocess_image_detection(image_path: str, output_path: str) -> None:
-    """Redimensiona imagem para 256x256 para detecção de doenças com YOLOv8"""
-    print(f"[DEBUG] Redimensionando imagem para detecção: {image_path} -> {output_path}")
+    Retorna também a imagem redimensionada, para a inferência não precisar
+    ler de novo o arquivo salvo.
+    """
+    perfil = perfil or obter_perfil()
+    log.debug("Redimensionando imagem para detecção: %s -> %s", image_path, output_path)
     
     # Carregar imagem
     img = cv2.imread(image_path)
     if img is None:
-        print(f"Erro ao carregar a imagem: {image_path}")
-        return
+        log.error("Erro ao carregar a imagem: %s", image_path)
+        return None
     
     # Redimensionar para 256x256
-    img_resized = cv2.resize(img, (256, 256), interpolation=cv2.INTER_CUBIC)
+    img_resized = cv2.resize(img, perfil["detection_size"], interpolation=cv2.INTER_CUBIC)
     
     # Salvar imagem redimensionada
     cv2.imwrite(output_path, img_resized)
-    print(f"[DEBUG] Imagem redimensionada salva: {output_path} (256x256)")
+    log.debug("Imagem redimensionada salva: %s %s", output_path, perfil["detection_size"])
+    return img_resized
+
+def _deteccoes_diretas(images: List[Union[str, np.ndarray]], conf: float, perfil: Dict) -> List[List[Dict]]:
+    """Detecções de um lote pelo caminho de inferência enxuto, no mesmo formato do predict()"""
+    modelo = obter_modelo_deteccao(perfil, direto=True)
+    imgs = []
+    for image in images:
+        img = cv2.imread(image) if isinstance(image, str) else image
+        if img.shape[:2] != perfil["detection_size"][::-1]:
+            img = cv2.resize(img, perfil["detection_size"], interpolation=cv2.INTER_CUBIC)
+        imgs.append(img)
+    with modelos.lock_de_uso(modelo):
+        resultados = modelo(np.stack(imgs), conf=conf)
+    return [
+        [
+            {
+                'bbox': box.tolist(),
+                'confidence': float(score),
+                'class_id': int(cls),
+                'class_name': modelo.names[int(cls)]
+            }
+            for box, score, cls in zip(resultado["boxes"], resultado["scores"], resultado["classes"])
+        ]
+        for resultado in resultados
+    ]
+
+def detect_disease(image: Union[str, np.ndarray], conf: Optional[float] = None, perfil: Optional[Dict] = None) -> Dict:
+    """Detecta doença na imagem usando modelo YOLOv8 e retorna resultados detalhados
 
-def detect_disease(image_path: str) -> Dict:
-    """Detecta doença na imagem usando modelo YOLOv8 e retorna resultados detalhados"""
-    if detection_model is None:
+    Aceita o caminho do arquivo ou a imagem BGR já carregada.
+    """
+    return detect_disease_lote([image], conf, perfil)[0]
+
+@registro.etapa("deteccao")
+def detect_disease_lote(images: List[Union[str, np.ndarray]], conf: Optional[float] = None,
+                        perfil: Optional[Dict] = None) -> List[Dict]:
+    """Versão em lote de detect_disease: as imagens vão juntas numa só inferência"""
+    perfil = perfil or obter_perfil()
+    modelo = obter_modelo_deteccao(perfil, direto=INFERENCIA_DIRETA)
+    if modelo is None:
         raise ValueError("Modelo de detecção não está carregado")
+    conf = perfil["det_conf"] if conf is None else conf
     
-    # Fazer inferência
-    results = detection_model.predict(image_path, conf=0.3, save=False)
-    
-    print(f"[DEBUG] Número de resultados: {len(results)}")
+    if INFERENCIA_DIRETA:
+        lotes = _deteccoes_diretas(images, conf, perfil)
+        if registro.debug_ativo():
+            for detection in (d for detections in lotes for d in detections):
+                log.debug("Detecção: %s", detection)
+        return [_resumir_deteccoes(detections) for detections in lotes]
     
-    # Verificar se há resultados
-    if len(results) == 0:
-        return {"disease": "indefinido", "detections": [], "confidence": 0.0}
-    
-    result = results[0]
+    # Fazer inferência
+    with modelos.lock_de_uso(modelo):
+        results = modelo.predict(list(images), conf=conf, imgsz=perfil["detection_size"][0],
+                                 half=perfil["precisao"] == "fp16", save=False,
+                                 verbose=registro.debug_ativo())
     
+    log.debug("Número de resultados: %d", len(results))
+    return [_resumir_deteccoes(_deteccoes_yolo(result)) for result in results]
+
+def _deteccoes_yolo(result) -> List[Dict]:
+    """Detecções de um resultado do predict() do Ultralytics"""
     # Verificar se há detecções
     if result.boxes is None or len(result.boxes) == 0:
-        print("[DEBUG] Nenhuma detecção encontrada")
-        return {"disease": "indefinido", "detections": [], "confidence": 0.0}
+        log.debug("Nenhuma detecção encontrada")
+        return []
     
     # Processar detecções baseado no código fornecido
     detections = []
@@ -227,8 +701,12 @@ def detect_disease(image_path: str) -> Dict:
             'class_name': result.names[int(cls.cpu().numpy())]  # Class name
         }
         detections.append(detection)
-        print(f"[DEBUG] Detecção: {detection}")
+        log.debug("Detecção: %s", detection)
     
+    return detections
+
+def _resumir_deteccoes(detections: List[Dict]) -> Dict:
+    """Ordena as detecções e escolhe a doença principal"""
     # Ordenar por confiança (maior primeiro)
     detections.sort(key=lambda x: x['confidence'], reverse=True)
     
@@ -238,7 +716,7 @@ def detect_disease(image_path: str) -> Dict:
         disease_name = main_detection['class_name'].lower()
         confidence = main_detection['confidence']
         
-        print(f"[DEBUG] Doença principal detectada: {disease_name} (conf: {confidence:.3f})")
+        log.debug("Doença principal detectada: %s (conf: %.3f)", disease_name, confidence)
         
         return {
             "disease": disease_name,
@@ -248,6 +726,7 @@ def detect_disease(image_path: str) -> Dict:
     else:
         return {"disease": "indefinido", "detections": [], "confidence": 0.0}
 
+@registro.etapa("plot")
 def plot_detections(image_path: str, detections: List[Dict], output_path: str) -> None:
     """Plota bounding boxes com confidence na imagem"""
     import cv2
@@ -255,7 +734,7 @@ def plot_detections(image_path: str, detections: List[Dict], output_path: str) -
     # Carregar imagem original
     img = cv2.imread(image_path)
     if img is None:
-        print(f"Erro ao carregar imagem para plotagem: {image_path}")
+        log.error("Erro ao carregar imagem para plotagem: %s", image_path)
         return
     
     # Cores para diferentes classes (BGR format)
@@ -292,39 +771,184 @@ def plot_detections(image_path: str, detections: List[Dict], output_path: str) -
     
     # Salvar imagem com detecções
     cv2.imwrite(output_path, img)
-    print(f"[DEBUG] Imagem com detecções salva: {output_path}")
+    log.debug("Imagem com detecções salva: %s", output_path)
 
-def calcular_severidade(image_path_processada: str, plot_path: str) -> float:
-    """Calcula severidade seguindo exatamente o algoritmo de referência"""
-    img = cv2.imread(image_path_processada)
-    if img is None:
-        print(f"Erro ao carregar a imagem: {image_path_processada}")
-        return 0.0
+def mapear_caixas_roi(detections: List[Dict], geometria: Dict, perfil: Optional[Dict] = None) -> List[List[int]]:
+    """Leva as caixas da detecção (256x256) para o espaço da imagem processada
+
+    As caixas são expandidas pela margem, limitadas à imagem e unidas quando se
+    sobrepõem. Retorna lista vazia quando não vale a pena recortar (sem caixas
+    ou recortes cobrindo boa parte da imagem).
+    """
+    if ADD_PADDING or not detections:
+        return []
+    
+    perfil = perfil or obter_perfil()
+    target_size = perfil["target_size"]
     
-    # Inferência YOLO
-    results = model.predict(img, conf=0.6)
-    combined_mask = np.zeros_like(img[:, :, 0], dtype=np.float32)
+    # 256x256 (imagem original achatada) -> original -> recorte quadrado -> target_size
+    fx = geometria["width"] / perfil["detection_size"][0]
+    fy = geometria["height"] / perfil["detection_size"][1]
+    escala = target_size[0] / geometria["size"]
+    
+    caixas = []
+    for detection in detections:
+        x1, y1, x2, y2 = detection['bbox']
+        x1 = (x1 * fx - geometria["left"]) * escala
+        x2 = (x2 * fx - geometria["left"]) * escala
+        y1 = (y1 * fy - geometria["top"]) * escala
+        y2 = (y2 * fy - geometria["top"]) * escala
+        
+        # Expandir pela margem, respeitando o lado mínimo
+        mx = max((x2 - x1) * ROI_MARGEM, (ROI_MIN_LADO - (x2 - x1)) / 2)
+        my = max((y2 - y1) * ROI_MARGEM, (ROI_MIN_LADO - (y2 - y1)) / 2)
+        x1, x2 = max(0, int(x1 - mx)), min(target_size[0], int(np.ceil(x2 + mx)))
+        y1, y2 = max(0, int(y1 - my)), min(target_size[1], int(np.ceil(y2 + my)))
+        if x2 - x1 > 1 and y2 - y1 > 1:
+            caixas.append([x1, y1, x2, y2])
+    
+    # Unir caixas sobrepostas para não segmentar a mesma região duas vezes
+    unidas = True
+    while unidas:
+        unidas = False
+        for i in range(len(caixas)):
+            for j in range(i + 1, len(caixas)):
+                a, b = caixas[i], caixas[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    caixas[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del caixas[j]
+                    unidas = True
+                    break
+            if unidas:
+                break
+    
+    area_total = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in caixas)
+    if area_total > ROI_AREA_MAX * target_size[0] * target_size[1]:
+        log.debug("ROI cobre %.0f%% da imagem, usando imagem inteira", 100 * area_total / (target_size[0] * target_size[1]))
+        return []
+    
+    return caixas
+
+@registro.etapa("segmentacao")
+def _mascaras_lesoes(imgs: List[np.ndarray], perfil: Dict) -> List[np.ndarray]:
+    """Segmenta um lote de imagens inteiras; uma máscara combinada (0/255) por imagem"""
+    if INFERENCIA_DIRETA:
+        modelo = obter_modelo_segmentacao(perfil, direto=True)
+        with modelos.lock_de_uso(modelo):
+            resultados = modelo(np.stack(imgs), conf=perfil["seg_conf"])
+        return [r["masks"].any(axis=0).astype(np.uint8) * 255 for r in resultados]
     
-    for result in results:
+    modelo = obter_modelo_segmentacao(perfil)
+    with modelos.lock_de_uso(modelo):
+        results = modelo.predict(imgs, conf=perfil["seg_conf"], imgsz=imgs[0].shape[0],
+                                 half=perfil["precisao"] == "fp16", verbose=registro.debug_ativo())
+    mascaras = []
+    for img, result in zip(imgs, results):
+        combined_mask = np.zeros_like(img[:, :, 0], dtype=np.float32)
         if result.masks is not None:
             for mask in result.masks.data:
                 combined_mask += mask.cpu().numpy()
+        mascaras.append((combined_mask > 0).astype(np.uint8) * 255)
+    return mascaras
+
+def _mascara_lesoes(img: np.ndarray, perfil: Dict) -> np.ndarray:
+    """Segmenta a imagem inteira e retorna a máscara combinada das lesões (0/255)"""
+    return _mascaras_lesoes([img], perfil)[0]
+
+@registro.etapa("segmentacao")
+def _mascara_lesoes_roi(img: np.ndarray, intermediate_path: str, caixas: List[List[int]], perfil: Dict) -> np.ndarray:
+    """Segmenta só os recortes em volta das detecções e cola as máscaras de volta"""
+    img_inter = cv2.imread(intermediate_path)
+    escala = img_inter.shape[1] / img.shape[1]
+    
+    # Recortes tirados da imagem intermediária (maior resolução que a final)
+    recortes = [
+        img_inter[round(y1 * escala):round(y2 * escala), round(x1 * escala):round(x2 * escala)]
+        for x1, y1, x2, y2 in caixas
+    ]
+    modelo = obter_modelo_segmentacao(perfil)
+    with modelos.lock_de_uso(modelo):
+        results = modelo.predict(recortes, conf=perfil["seg_conf"], imgsz=ROI_IMGSZ,
+                                 half=perfil["precisao"] == "fp16", retina_masks=True,
+                                 verbose=registro.debug_ativo())
+    log.debug("ROI: %d recortes segmentados em %dpx", len(recortes), ROI_IMGSZ)
+    
+    combined_mask = np.zeros_like(img[:, :, 0], dtype=np.uint8)
+    for (x1, y1, x2, y2), result in zip(caixas, results):
+        if result.masks is None:
+            continue
+        # Máscaras vêm no tamanho do recorte; reduzir para o espaço da imagem final
+        mask = (result.masks.data.cpu().numpy().sum(axis=0) > 0).astype(np.float32)
+        mask = cv2.resize(mask, (x2 - x1, y2 - y1), interpolation=cv2.INTER_LINEAR)
+        combined_mask[y1:y2, x1:x2] |= (mask >= 0.5).astype(np.uint8) * 255
     
-    combined_mask = (combined_mask > 0).astype(np.uint8) * 255
+    return combined_mask
 
-    # Encontrar contornos das lesões na máscara combinada
-    lesion_contours, _ = cv2.findContours(combined_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+def segmentar_lesoes(image_path_processada: str, intermediate_path: Optional[str] = None,
+                     caixas_roi: Optional[List[List[int]]] = None,
+                     perfil: Optional[Dict] = None) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """Carrega a imagem processada e roda a segmentação; retorna (imagem, máscara das lesões)"""
+    perfil = perfil or obter_perfil()
+    img = cv2.imread(image_path_processada)
+    if img is None:
+        log.error("Erro ao carregar a imagem: %s", image_path_processada)
+        return None, None
+    
+    # Inferência YOLO (imagem inteira ou apenas as regiões de interesse)
+    if caixas_roi and intermediate_path:
+        combined_mask = _mascara_lesoes_roi(img, intermediate_path, caixas_roi, perfil)
+    else:
+        combined_mask = _mascara_lesoes(img, perfil)
+    return img, combined_mask
 
-    # Criar máscara vermelha para o overlay
-    red_mask = np.zeros_like(img)
-    red_mask[:, :, 2] = combined_mask
+def segmentar_lesoes_lote(entradas: List[Tuple[str, Optional[str], Optional[List[List[int]]]]],
+                          perfil: Optional[Dict] = None) -> List[Tuple[Optional[np.ndarray], Optional[np.ndarray]]]:
+    """Versão em lote de segmentar_lesoes para (imagem processada, intermediária, caixas ROI)
 
-    # Criar overlay com a máscara vermelha (lesões)
-    overlay = cv2.addWeighted(img, 0.7, red_mask, 0.3, 0)
+    As imagens inteiras vão juntas numa só inferência; as de modo ROI seguem
+    uma a uma, já que cada uma tem seus próprios recortes.
+    """
+    perfil = perfil or obter_perfil()
+    saida = [None] * len(entradas)
+    inteiras = []
+    for i, (path, intermediate_path, caixas_roi) in enumerate(entradas):
+        if caixas_roi and intermediate_path:
+            saida[i] = segmentar_lesoes(path, intermediate_path, caixas_roi, perfil)
+            continue
+        img = cv2.imread(path)
+        if img is None:
+            log.error("Erro ao carregar a imagem: %s", path)
+            saida[i] = (None, None)
+        else:
+            inteiras.append((i, img))
+    if inteiras:
+        mascaras = _mascaras_lesoes([img for _, img in inteiras], perfil)
+        for (i, img), mascara in zip(inteiras, mascaras):
+            saida[i] = (img, mascara)
+    return saida
 
-    # Desenhar contornos das lesões em azul para melhor visualização
-    cv2.drawContours(overlay, lesion_contours, -1, (255, 255, 0), 1)  # Amarelo brilhante para os contornos
+def calcular_severidade(image_path_processada: str, plot_path: str,
+                        intermediate_path: Optional[str] = None,
+                        caixas_roi: Optional[List[List[int]]] = None,
+                        perfil: Optional[Dict] = None) -> float:
+    """Calcula severidade seguindo exatamente o algoritmo de referência"""
+    img, combined_mask = segmentar_lesoes(image_path_processada, intermediate_path, caixas_roi, perfil)
+    if img is None:
+        return 0.0
+    return severidade_da_mascara(img, combined_mask, plot_path)
+
+def severidade_da_mascara(img: np.ndarray, combined_mask: np.ndarray, plot_path: str) -> float:
+    """Contornos da folha e das lesões, cálculo da severidade e plot do resultado"""
+    return analisar_mascara(img, combined_mask, plot_path)[0]
+
+@registro.etapa("severidade")
+def analisar_mascara(img: np.ndarray, combined_mask: np.ndarray,
+                     plot_path: Optional[str] = None) -> Tuple[float, Optional[np.ndarray]]:
+    """Severidade a partir da máscara das lesões; retorna (severidade, contorno da folha)
 
+    O plot do resultado só é desenhado se plot_path for informado (no formato
+    vetorial o cliente desenha o overlay).
+    """
     # ALGORITMO MELHORADO PARA DETECTAR FOLHA
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     
@@ -340,16 +964,16 @@ def calcular_severidade(image_path_processada: str, plot_path: str) -> float:
     contours, _ = cv2.findContours(dilated, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
     
     if not contours:
-        print("Nenhum contorno encontrado")
-        return 0.0
+        log.warning("Nenhum contorno encontrado")
+        return 0.0, None
     
     # Ordenar contornos por área
     contours = sorted(contours, key=cv2.contourArea, reverse=True)
     
-    print(f"[DEBUG] Total de contornos encontrados: {len(contours)}")
-    for i, c in enumerate(contours[:3]):  # Debug dos 3 maiores contornos
-        area = cv2.contourArea(c)
-        print(f"[DEBUG] Contorno {i}: área = {area}")
+    if registro.debug_ativo():
+        log.debug("Total de contornos encontrados: %d", len(contours))
+        for i, c in enumerate(contours[:3]):  # Debug dos 3 maiores contornos
+            log.debug("Contorno %d: área = %s", i, cv2.contourArea(c))
     
     # Lógica melhorada: pegar o maior contorno que não seja o fundo
     # O fundo geralmente é o maior contorno, então pegamos o segundo
@@ -361,185 +985,911 @@ def calcular_severidade(image_path_processada: str, plot_path: str) -> float:
         # Se o primeiro contorno for muito maior que o segundo, usar o segundo
         if area_primeiro > area_segundo * 3:
             leaf_contour = contours[1]
-            print(f"[DEBUG] Usando segundo contorno (primeiro muito grande)")
+            log.debug("Usando segundo contorno (primeiro muito grande)")
         else:
             leaf_contour = contours[0]
-            print(f"[DEBUG] Usando primeiro contorno")
+            log.debug("Usando primeiro contorno")
     else:
         leaf_contour = contours[0] if contours else None
-        print(f"[DEBUG] Usando único contorno disponível")
+        log.debug("Usando único contorno disponível")
     
     if leaf_contour is None:
-        print(f"Nenhum contorno válido encontrado na imagem")
-        return 0.0
+        log.warning("Nenhum contorno válido encontrado na imagem")
+        return 0.0, None
     
     area_folha = cv2.contourArea(leaf_contour)
-    print(f"[DEBUG] Área da folha selecionada: {area_folha}")
+    log.debug("Área da folha selecionada: %s", area_folha)
     
     if area_folha == 0:
-        print(f"Área da folha inválida")
-        return 0.0
+        log.warning("Área da folha inválida")
+        return 0.0, None
     
     lesion_area = np.sum(combined_mask == 255)
     severity = (lesion_area / area_folha * 100)
     
+    if plot_path:
+        desenhar_severidade(img, combined_mask, leaf_contour, severity, plot_path)
+    
+    return severity, leaf_contour
+
+def instancias_folhas(img: np.ndarray, combined_mask: np.ndarray) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """Separa as folhas da imagem processada; retorna (rótulos, contornos)
+
+    rótulos tem 0 no fundo e k na k-ésima folha (da maior para a menor), com
+    os buracos preenchidos: lesões claras no meio da folha continuam sendo folha.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # Fundo branco do rembg: a folha é o lado escuro do Otsu; as lesões também são folha
+    _, folha = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    folha = cv2.bitwise_or(folha, combined_mask)
+    h, w = folha.shape[:2]
+    lado = max(5, int(min(h, w) * FOLHA_ABERTURA) | 1)
+    folha = cv2.morphologyEx(folha, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (lado, lado)))
+
+    contours, _ = cv2.findContours(folha, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    area_min = FOLHA_AREA_MIN * h * w
+    contours = sorted((c for c in contours if cv2.contourArea(c) >= area_min), key=cv2.contourArea, reverse=True)
+    rotulos = np.zeros((h, w), np.int32)
+    for k, contorno in enumerate(contours, start=1):
+        cv2.drawContours(rotulos, [contorno], -1, k, cv2.FILLED)
+    return rotulos, contours
+
+@registro.etapa("severidade")
+def analisar_folhas(img: np.ndarray, combined_mask: np.ndarray,
+                    plot_path: Optional[str] = None) -> Tuple[float, List[Dict], List[np.ndarray]]:
+    """Severidade de cada folha da imagem; retorna (média, folhas, contornos)
+
+    Cada folha traz "folha" (número no plot), "severity", "area" (fração da
+    imagem) e "bbox" normalizada [x1, y1, x2, y2]. As contagens de pixels de
+    folha e de lesão por folha saem de uma passada só (bincount nos rótulos).
+    """
+    rotulos, contours = instancias_folhas(img, combined_mask)
+    if not contours:
+        log.warning("Nenhuma folha encontrada")
+        return 0.0, [], []
+    n = len(contours) + 1
+    area_folhas = np.bincount(rotulos.ravel(), minlength=n)
+    area_lesoes = np.bincount(rotulos[combined_mask == 255], minlength=n)
+
+    h, w = rotulos.shape
+    folhas = []
+    for k, contorno in enumerate(contours, start=1):
+        x, y, bw, bh = cv2.boundingRect(contorno)
+        folhas.append({
+            "folha": k,
+            "severity": round(float(area_lesoes[k]) / float(area_folhas[k]) * 100, 2),
+            "area": round(float(area_folhas[k]) / (h * w), 4),
+            "bbox": [round(x / w, 4), round(y / h, 4), round((x + bw) / w, 4), round((y + bh) / h, 4)],
+        })
+    media = sum(f["severity"] for f in folhas) / len(folhas)
+    log.debug("%d folhas, severidade média %.2f%%", len(folhas), media)
+
+    if plot_path:
+        desenhar_folhas(img, combined_mask, contours, folhas, media, plot_path)
+    return media, folhas, contours
+
+def _overlay_lesoes(img: np.ndarray, combined_mask: np.ndarray) -> np.ndarray:
+    """Imagem com as lesões em vermelho e contornadas"""
+    # Encontrar contornos das lesões na máscara combinada
+    lesion_contours, _ = cv2.findContours(combined_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    # Criar máscara vermelha para o overlay
+    red_mask = np.zeros_like(img)
+    red_mask[:, :, 2] = combined_mask
+
+    # Criar overlay com a máscara vermelha (lesões)
+    overlay = cv2.addWeighted(img, 0.7, red_mask, 0.3, 0)
+
+    # Desenhar contornos das lesões em azul para melhor visualização
+    cv2.drawContours(overlay, lesion_contours, -1, (255, 255, 0), 1)  # Amarelo brilhante para os contornos
+    return overlay
+
+@registro.etapa("plot")
+def desenhar_folhas(img: np.ndarray, combined_mask: np.ndarray, contours: List[np.ndarray],
+                    folhas: List[Dict], media: float, plot_path: str) -> None:
+    """Overlay das lesões com cada folha numerada e a severidade dela"""
+    overlay = _overlay_lesoes(img, combined_mask)
+    cv2.drawContours(overlay, contours, -1, (0, 255, 255), 2)
+    h, w = overlay.shape[:2]
+    for folha in folhas:
+        x, y = int(folha["bbox"][0] * w), int(folha["bbox"][1] * h)
+        cv2.putText(overlay, f"{folha['folha']}: {folha['severity']:.1f}%", (x + 4, max(y + 20, 50)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2, cv2.LINE_AA)
+    cv2.putText(overlay, f"Media ({len(folhas)} folhas): {media:.2f}%", (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 255), 2, cv2.LINE_AA)
+    cv2.imwrite(plot_path, overlay)
+    log.debug("Plot salvo em: %s", plot_path)
+
+@registro.etapa("plot")
+def desenhar_severidade(img: np.ndarray, combined_mask: np.ndarray, leaf_contour: np.ndarray,
+                        severity: float, plot_path: str) -> None:
+    """Overlay das lesões (vermelho), contorno da folha e severidade"""
+    overlay = _overlay_lesoes(img, combined_mask)
+
     # Desenhar contorno da folha
     cv2.drawContours(overlay, [leaf_contour], -1, (0, 255, 255), 2)
     cv2.putText(overlay, f"Severidade: {severity:.2f}%", (10, 30),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 255), 2, cv2.LINE_AA)
     
     cv2.imwrite(plot_path, overlay)
-    print(f"Plot salvo em: {plot_path}")
+    log.debug("Plot salvo em: %s", plot_path)
+
+def detectar_para_severidade(input_path: str, output_path: str, plot_path: str,
+                             cascata: bool = False, cascata_conf: float = CASCATA_CONF,
+                             roi: bool = False, perfil: Optional[Dict] = None) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """Detecção na frente da severidade (cascata e/ou ROI)
+
+    Retorna (resultado, detecção): resultado só é preenchido quando a cascata
+    considera a folha sadia e o resto do fluxo pode ser pulado.
+    """
+    return detectar_para_severidade_lote([(input_path, output_path, plot_path)],
+                                         cascata, cascata_conf, roi, perfil)[0]
+
+def detectar_para_severidade_lote(entradas: List[Tuple[str, str, str]],
+                                  cascata: bool = False, cascata_conf: float = CASCATA_CONF,
+                                  roi: bool = False, perfil: Optional[Dict] = None
+                                  ) -> List[Tuple[Optional[Dict], Optional[Dict]]]:
+    """Versão em lote de detectar_para_severidade para (imagem, saída, plot)
+
+    As imagens vão juntas numa só inferência de detecção; as que não abrem
+    seguem sem detecção, como no fluxo sem cascata.
+    """
+    perfil = perfil or obter_perfil()
+    saida = [(None, None)] * len(entradas)
+    if not (cascata or roi) or not deteccao_disponivel(perfil):
+        return saida
+    detection_paths = [os.path.join(OUTPUT_FOLDER, f"cascata_{os.path.basename(output_path)}")
+                       for _, output_path, _ in entradas]
+    try:
+        legiveis = []
+        for i, ((input_path, _, _), detection_path) in enumerate(zip(entradas, detection_paths)):
+            img_deteccao = preprocess_image_detection(input_path, detection_path, perfil)
+            if img_deteccao is not None:
+                legiveis.append((i, img_deteccao))
+        if not legiveis:
+            return saida
+        conf = min(cascata_conf, perfil["det_conf"]) if cascata else perfil["det_conf"]
+        deteccoes = detect_disease_lote([img for _, img in legiveis], conf=conf, perfil=perfil)
+        for (i, _), deteccao in zip(legiveis, deteccoes):
+            if cascata and deteccao["confidence"] < cascata_conf:
+                # Folha considerada sadia: pula rembg e segmentação
+                log.debug("Cascata: sem lesão acima de %.2f (maior confiança %.3f), severidade 0%%",
+                          cascata_conf, deteccao["confidence"])
+                plot_detections(detection_paths[i], deteccao["detections"], entradas[i][2])
+                saida[i] = ({"severity": 0.0, "gated": True, "roi": 0,
+                             "cascata_confianca": deteccao["confidence"]}, deteccao)
+            else:
+                saida[i] = (None, deteccao)
+        return saida
+    finally:
+        for detection_path in detection_paths:
+            if os.path.exists(detection_path):
+                os.remove(detection_path)
+
+def preprocessar_para_severidade(input_path: str, output_path: str, deteccao: Optional[Dict] = None,
+                                 roi: bool = False, perfil: Optional[Dict] = None) -> Tuple[Optional[str], List[List[int]]]:
+    """Remove o fundo e prepara a imagem; retorna (imagem intermediária, caixas ROI)
+
+    A imagem intermediária só é gerada no modo ROI com detecções, e quem chama
+    é responsável por apagá-la depois da segmentação.
+    """
+    perfil = perfil or obter_perfil()
+    intermediate_path = None
+    if roi and deteccao and deteccao["detections"]:
+        intermediate_path = os.path.join(OUTPUT_FOLDER, f"roi_{os.path.basename(output_path)}")
+    try:
+        geometria = preprocess_image(input_path, output_path, intermediate_path, perfil)
+    except Exception:
+        if intermediate_path and os.path.exists(intermediate_path):
+            os.remove(intermediate_path)
+        raise
+    caixas_roi = mapear_caixas_roi(deteccao["detections"], geometria, perfil) if intermediate_path and geometria else []
+    return intermediate_path, caixas_roi
+
+def analisar_severidade(input_path: str, output_path: str, plot_path: str,
+                        cascata: bool = False, cascata_conf: float = CASCATA_CONF,
+                        roi: bool = False, perfil: Optional[Dict] = None,
+                        formato: str = "imagem", formato_mascara: str = "rle", folhas: str = "uma") -> Dict:
+    """Executa o fluxo de severidade, opcionalmente com a detecção na frente
+
+    A detecção alimenta a cascata (pular folhas sadias) e/ou o modo ROI
+    (segmentar só em volta das lesões detectadas). Com formato "vetorial" ou
+    "ambos" o resultado traz também "vetor" (ver formato_vetorial); em
+    "vetorial" o plot não é desenhado. Com folhas "multiplas" a severidade é
+    a média das folhas e o resultado traz a lista "folhas" (ver analisar_folhas).
+    """
+    perfil = perfil or obter_perfil()
+    resultado, deteccao = detectar_para_severidade(input_path, output_path, plot_path,
+                                                   cascata, cascata_conf, roi, perfil)
+    if resultado is not None:
+        resultado["doenca"] = deteccao["disease"]
+        if formato != "imagem":
+            resultado["vetor"] = vetorizar_deteccoes(deteccao, perfil)
+        if folhas == "multiplas":
+            resultado["folhas"] = []
+        return resultado
+
+    intermediate_path, caixas_roi = preprocessar_para_severidade(input_path, output_path, deteccao, roi, perfil)
+    try:
+        img, combined_mask = segmentar_lesoes(output_path, intermediate_path, caixas_roi, perfil)
+    finally:
+        if intermediate_path and os.path.exists(intermediate_path):
+            os.remove(intermediate_path)
     
-    return severity
+    resultado = {"severity": 0.0, "gated": False, "roi": len(caixas_roi)}
+    if deteccao is not None:
+        resultado["doenca"] = deteccao["disease"]
+    if img is not None:
+        resultado.update(severidade_segmentada(img, combined_mask, plot_path, formato, formato_mascara, folhas))
+    elif folhas == "multiplas":
+        resultado["folhas"] = []
+    return resultado
+
+def severidade_segmentada(img: np.ndarray, combined_mask: np.ndarray, plot_path: str,
+                          formato: str, formato_mascara: str, folhas: str) -> Dict:
+    """"severity" (e "folhas", "vetor" conforme o modo) a partir da máscara das lesões"""
+    plot = plot_path if formato != "vetorial" else None
+    if folhas == "multiplas":
+        severity, lista, contornos = analisar_folhas(img, combined_mask, plot)
+        resultado = {"severity": severity, "folhas": lista}
+        if formato != "imagem":
+            resultado["vetor"] = formato_vetorial.vetorizar_severidade(combined_mask, None, formato_mascara,
+                                                                       folhas=contornos)
+        return resultado
+    severity, folha = analisar_mascara(img, combined_mask, plot)
+    resultado = {"severity": severity}
+    if formato != "imagem":
+        resultado["vetor"] = formato_vetorial.vetorizar_severidade(combined_mask, folha, formato_mascara)
+    return resultado
+
+def vetorizar_deteccoes(deteccao: Dict, perfil: Dict) -> Dict:
+    """Detecções (imagem de detecção inteira) em formato vetorial, caixas normalizadas"""
+    largura, altura = perfil["detection_size"]
+    return {"largura": largura, "altura": altura,
+            "deteccoes": formato_vetorial.deteccoes_colunares(deteccao["detections"], largura, altura)}
+
+def detectar_quadro(img: np.ndarray, perfil: Dict) -> Dict:
+    """Detecção num quadro da câmera ao vivo (ao_vivo.py), com as caixas normalizadas"""
+    # Mesmo redimensionamento do preprocess_image_detection, sem passar pelo disco
+    img = cv2.resize(img, perfil["detection_size"], interpolation=cv2.INTER_CUBIC)
+    deteccao = detect_disease(img, perfil=perfil)
+    return {"doenca": deteccao["disease"], "confianca": round(deteccao["confidence"], 4),
+            **vetorizar_deteccoes(deteccao, perfil)}
+
+def ler_modo_folhas(dados: Dict) -> str:
+    """Campo "folhas" da requisição: "uma" (padrão) ou "multiplas" (severidade por folha)"""
+    folhas = dados.get("folhas", "uma")
+    if folhas not in FOLHAS_MODOS:
+        raise ValueError(f"folhas deve ser um de {', '.join(FOLHAS_MODOS)}")
+    return folhas
+
+def ler_formato(dados: Dict) -> Tuple[str, str]:
+    """Campos "formato" (imagem, vetorial, ambos) e "mascara" (rle, poligonos) da requisição"""
+    formato = dados.get("formato", "imagem")
+    formato_mascara = dados.get("mascara", "rle")
+    if formato not in formato_vetorial.FORMATOS:
+        raise ValueError(f"formato deve ser um de {', '.join(formato_vetorial.FORMATOS)}")
+    if formato_mascara not in formato_vetorial.FORMATOS_MASCARA:
+        raise ValueError(f"mascara deve ser um de {', '.join(formato_vetorial.FORMATOS_MASCARA)}")
+    return formato, formato_mascara
+
+def _remover_arquivos(*caminhos: Optional[str]) -> None:
+    """Apaga os arquivos temporários que existirem (no Cloud Run, /tmp ocupa memória)"""
+    for caminho in caminhos:
+        if caminho and os.path.exists(caminho):
+            os.remove(caminho)
+
+def _limpar_item_lote(dados: Dict) -> None:
+    """Apaga os arquivos temporários de uma imagem do lote"""
+    _remover_arquivos(*(dados.get(chave) for chave in ("input_path", "output_path", "plot_path", "intermediate_path")))
+
+def criar_pipeline_severidade(cascata: bool = False, cascata_conf: float = CASCATA_CONF, roi: bool = False,
+                              perfil: Optional[Dict] = None, workers: Optional[Dict[str, int]] = None,
+                              tamanho_fila: int = PIPELINE_FILA, formato: str = "imagem",
+                              formato_mascara: str = "rle", folhas: str = "uma") -> Pipeline:
+    """Monta o fluxo de analisar_severidade como pipeline em estágios
+
+    Cada item de entrada é um dicionário com "file" (imagem em base64 ou
+    bytes); ao final do pipeline ele contém "resposta" com severidade e plot
+    em bytes (e/ou "vetor", conforme o formato).
+    """
+    perfil = perfil or obter_perfil()
+    workers = workers or PIPELINE_WORKERS
+
+    def decodificar(dados):
+        image_data = ler_imagem(dados.pop("file"))
+        filename = f"lote_{uuid.uuid4()}.jpg"
+        dados["input_path"] = os.path.join(INPUT_FOLDER, filename)
+        dados["output_path"] = os.path.join(OUTPUT_FOLDER, filename)
+        dados["plot_path"] = os.path.join(PLOTS_FOLDER, filename)
+        with open(dados["input_path"], "wb") as f:
+            f.write(image_data)
+
+    def detectar(lista):
+        # Recebe uma lista de itens: a detecção da cascata/ROI roda em lote, como a segmentação
+        saidas = detectar_para_severidade_lote([(dados["input_path"], dados["output_path"], dados["plot_path"])
+                                                for dados in lista], cascata, cascata_conf, roi, perfil)
+        for dados, (resultado, deteccao) in zip(lista, saidas):
+            dados["resultado"], dados["deteccao"] = resultado, deteccao
+
+    def preprocessar(dados):
+        if dados["resultado"] is None:
+            dados["intermediate_path"], dados["caixas_roi"] = preprocessar_para_severidade(
+                dados["input_path"], dados["output_path"], dados["deteccao"], roi, perfil)
+
+    def segmentar(lista):
+        # Recebe uma lista de itens: a segmentação roda em lote (CONFIG_EXECUCAO["lote"])
+        pendentes = [dados for dados in lista if dados["resultado"] is None]
+        saidas = segmentar_lesoes_lote([(dados["output_path"], dados["intermediate_path"], dados["caixas_roi"])
+                                        for dados in pendentes], perfil)
+        for dados, (img, mascara) in zip(pendentes, saidas):
+            dados["img"], dados["mascara"] = img, mascara
+
+    def contornos(dados):
+        if dados["resultado"] is None:
+            img, mascara = dados.pop("img"), dados.pop("mascara")
+            dados["resultado"] = {"severity": 0.0, "gated": False, "roi": len(dados["caixas_roi"])}
+            if img is not None:
+                dados["resultado"].update(severidade_segmentada(img, mascara, dados["plot_path"],
+                                                                formato, formato_mascara, folhas))
+        elif dados["resultado"]["gated"]:
+            if formato != "imagem":
+                dados["resultado"]["vetor"] = vetorizar_deteccoes(dados["deteccao"], perfil)
+        if folhas == "multiplas":
+            dados["resultado"].setdefault("folhas", [])
+
+    def codificar(dados):
+        dados["resposta"] = {
+            "severity": round(dados["resultado"]["severity"], 2),
+            "gated": dados["resultado"]["gated"],
+        }
+        if dados.get("deteccao") is not None:
+            dados["resposta"]["doenca"] = dados["deteccao"]["disease"]
+        if formato != "vetorial":
+            # Bytes crus: responder() passa para base64 só se a resposta for JSON
+            plot_image = b""
+            if os.path.exists(dados["plot_path"]):
+                with open(dados["plot_path"], "rb") as f:
+                    plot_image = f.read()
+            dados["resposta"]["plot_image"] = plot_image
+        for chave in ("folhas", "vetor"):
+            if chave in dados["resultado"]:
+                dados["resposta"][chave] = dados["resultado"][chave]
+        _limpar_item_lote(dados)
+
+    funcoes = {"decodificar": decodificar, "detectar": detectar, "preprocessar": preprocessar,
+               "segmentar": segmentar, "contornos": contornos, "codificar": codificar}
+    # Detecção e segmentação trabalham em lote; a fila precisa comportar um lote inteiro
+    lote = CONFIG_EXECUCAO["lote"]
+    estagios = [(nome, funcao, workers[nome], lote if nome in ("detectar", "segmentar") else None)
+                for nome, funcao in funcoes.items()]
+    return Pipeline(estagios, max(tamanho_fila, lote))
+
+def gerar_recomendacao(severity: float) -> Dict:
+    """Recomendação de manejo a partir da severidade (média)"""
+    if severity < 5:
+        return {
+            "tipo": "calda_bordalesa",
+            "titulo": "Recomendação: Calda Bordalesa",
+            "descricao": "Para severidades médias abaixo de 5% recomenda-se o uso de tratamentos alternativos, como a utilização de calda bordalesa.",
+            "instrucoes": [
+                "1. Diluição do sulfato de cobre: Pegue 200 g de sulfato de cobre e coloque-o dentro de um pano, formando um saquinho. Amarre o saquinho na ponta de uma vara e mergulhe em aproximadamente 5 litros de água fria ou morna por 4 a 24 horas.",
+                "2. Preparo do leite de cal: Coloque 200 g de cal virgem em 2 litros de água e misture bem.",
+                "3. Mistura dos ingredientes: Derrame vagarosamente o sulfato de cobre diluído sobre o leite de cal.",
+                "4. Verificação da acidez: Mergulhe um objeto de ferro na calda por 3 minutos. Se escurecer, acrescente cal.",
+                "5. Filtragem e aplicação: Coe a calda e aplique com pulverizador."
+            ],
+            "fonte": "BRASIL. Ministério da Agricultura, Pecuária e Abastecimento. Calda bordalesa. Coordenação de Agroecologia, [s.d.]. Disponível em: <www.agricultura.gov.br/desenvolvimento-sustentavel/organicos>."
+        }
+    else:
+        return {
+            "tipo": "fungicida",
+            "titulo": "Recomendação: Uso de Fungicida",
+            "descricao": "Devido à severidade média superior a 5%, recomenda-se o uso de fungicida.",
+            "instrucoes": [
+                "Procure orientação técnica para escolha e aplicação adequada do fungicida.",
+                "Siga rigorosamente as instruções do fabricante.",
+                "Respeite o período de carência antes da colheita."
+            ],
+            "fonte": "Orientação técnica recomendada para casos de alta severidade."
+        }
+
+def _executar_idempotente(parametros: Dict, imagens: List[bytes], analisar, **kwargs):
+    """Roda a análise com Idempotency-Key/deduplicação e responde no formato do Accept
+
+    O cabeçalho X-Idempotencia diz se a resposta foi calculada agora ("nova"),
+    veio de uma requisição idêntica em andamento ("anexada") ou do cache ("repetida").
+    """
+    try:
+        resposta, status, origem = idempotencia.executar_uma_vez(request.path, request.headers.get("Idempotency-Key"),
+                                                                 parametros, imagens, analisar, **kwargs)
+    except idempotencia.ChaveReutilizada:
+        return jsonify({"error": "Idempotency-Key já usada com outra requisição"}), 422
+    except idempotencia.EmAndamento:
+        resposta_http = jsonify({"error": "A requisição original com esta chave ainda está em andamento;"
+                                          " tente de novo em instantes para receber o resultado dela"})
+        resposta_http.status_code = 409
+        resposta_http.headers["Retry-After"] = str(idempotencia.IDEMPOTENCIA_RETRY_AFTER_S)
+        return resposta_http
+    if origem != "nova":
+        log.info("Requisição %s: resultado %s", request.path, origem)
+    if status == 200:
+        resposta_http = responder(resposta)
+    else:
+        resposta_http = jsonify(resposta)
+        resposta_http.status_code = status
+    resposta_http.headers["X-Idempotencia"] = origem
+    return resposta_http
+
+def _sem_repetir(dados: Dict, imagem: bytes, parametros: Dict, analisar):
+    """Envolve a análise de uma foto para reaproveitar a da mesma foto e sinalizar as parecidas (duplicatas.py)
+
+    O cliente pode desligar por requisição com "duplicatas": false.
+    """
+    if not dados.get("duplicatas", True):
+        return analisar
+    ctx = duplicatas.contexto(request.path, parametros)
+    return lambda: duplicatas.sem_repetir(imagem, ctx, analisar)
+
+def versao_modelo(perfil: Dict) -> str:
+    """Identificação dos modelos que geraram a análise (histórico e parâmetros do cache de respostas)"""
+    versoes = perfil["versoes"]
+    return f"{versoes['segment']}+{versoes['detect']}:{perfil['backend']}:{perfil['precisao']}"
+
+def ler_talhao(dados: Dict) -> Optional[str]:
+    """Campos "talhao" e "levantamento" da requisição: com talhão, as análises vão para o histórico"""
+    talhao = dados.get("talhao")
+    if talhao is None or talhao == "":
+        return None
+    if not isinstance(talhao, str) or len(talhao) > 100:
+        raise ValueError("talhao deve ser um texto de até 100 caracteres")
+    levantamento = dados.get("levantamento")
+    if levantamento is not None and (not isinstance(levantamento, str) or len(levantamento) > 100):
+        raise ValueError("levantamento deve ser um texto de até 100 caracteres")
+    return talhao
+
+def linha_historico(dados: Dict, resposta: Dict, imagem: bytes, perfil: Dict) -> Optional[Dict]:
+    """Linha do banco para uma análise nova (None para fotos reaproveitadas de outra análise)
+
+    Ponto e horário vêm do EXIF da foto (lido do cabeçalho, sem decodificar);
+    sem GPS no EXIF, valem "lat"/"lon" da requisição.
+    """
+    duplicata = resposta.get("duplicata")
+    if duplicata and duplicata["reutilizada"]:
+        return None
+    ponto = geo.metadados_foto(imagem)
+    if "lat" not in ponto:
+        ponto.update(geo.ponto_da_requisicao(dados))
+    return {**ponto, "talhao": dados["talhao"], "levantamento": dados.get("levantamento"),
+            "severidade": resposta["severity"], "doenca": resposta.get("doenca"),
+            "modelo": versao_modelo(perfil), "imagem_hash": hashlib.sha256(imagem).hexdigest(),
+            "endpoint": request.path, "analise_id": resposta.get("analise_id"),
+            "duplicata_de": duplicata["de"] if duplicata else None}
+
+def _com_historico(dados: Dict, imagem: bytes, perfil: Dict, analisar):
+    """Grava no histórico (banco.py) o resultado de analisar() quando a requisição traz "talhao"
+
+    Fica por dentro da idempotência: repetições da mesma requisição não gravam de novo.
+    """
+    if not banco.BANCO_ATIVO or not dados.get("talhao"):
+        return analisar
+
+    def analisar_e_gravar() -> Tuple[Dict, int]:
+        resposta, status = analisar()
+        if status == 200:
+            linha = linha_historico(dados, resposta, imagem, perfil)
+            if linha is not None:
+                banco.registrar_seguro([linha])
+        return resposta, status
+    return analisar_e_gravar
+
+def _hashes_arquivo(arquivo) -> Tuple[Optional[int], Optional[str]]:
+    """(pHash, sha256) de um item de "files" (base64 ou bytes); (None, None) se não der para decodificar"""
+    try:
+        imagem = ler_imagem(arquivo)
+        return duplicatas.phash_imagem(imagem), duplicatas.digest_imagem(imagem)
+    except Exception:
+        return None, None
 
 # --- Endpoint da API ---
 @app.route("/predict", methods=["POST"])
+@perfilar
 def predict():
-    if 'file' not in request.json:
+    # Corpo em JSON (imagem em base64) ou MessagePack/CBOR (imagem em bytes)
+    dados = corpo_requisicao()
+    if not dados or 'file' not in dados:
         return jsonify({"error": "Nenhum arquivo enviado"}), 400
     
-    # Decodifica a imagem recebida em base64
-    image_data_b64 = request.json['file']
+    # Decodifica a imagem recebida
     try:
-        image_data = base64.b64decode(image_data_b64)
+        image_data = ler_imagem(dados['file'])
     except Exception as e:
         return jsonify({"error": f"Erro ao decodificar base64: {str(e)}"}), 400
 
-    # Salva a imagem com um nome único para evitar conflitos
-    filename = f"{uuid.uuid4()}.jpg"
-    input_path = os.path.join(INPUT_FOLDER, filename)
-    output_path = os.path.join(OUTPUT_FOLDER, filename)
-    plot_path = os.path.join(PLOTS_FOLDER, filename)
+    # Cascata opcional: o padrão vem do servidor e pode ser sobrescrito por requisição
+    cascata = bool(dados.get("cascata", CASCATA_ATIVA))
+    roi = bool(dados.get("roi", False))
+    try:
+        cascata_conf = float(dados.get("cascata_conf", CASCATA_CONF))
+    except (TypeError, ValueError):
+        return jsonify({"error": "cascata_conf inválido"}), 400
+    try:
+        perfil = obter_perfil(dados.get("perfil"), cultura=dados.get("cultura"))
+        formato, formato_mascara = ler_formato(dados)
+        folhas = ler_modo_folhas(dados)
+        talhao = ler_talhao(dados)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    with open(input_path, "wb") as f:
-        f.write(image_data)
+    def analisar() -> Tuple[Dict, int]:
+        # Salva a imagem com um nome único para evitar conflitos
+        filename = f"{uuid.uuid4()}.jpg"
+        input_path = os.path.join(INPUT_FOLDER, filename)
+        output_path = os.path.join(OUTPUT_FOLDER, filename)
+        plot_path = os.path.join(PLOTS_FOLDER, filename)
 
-    try:
-        # Executa a lógica de IA
-        print(f"Processando arquivo: {filename}")
-        preprocess_image(input_path, output_path)
-        severity = calcular_severidade(output_path, plot_path)
-
-        # Codifica a imagem de resultado (plot) para enviar de volta
-        with open(plot_path, "rb") as f:
-            plot_image_b64 = base64.b64encode(f.read()).decode('utf-8')
-
-        # Limpa os arquivos temporários
-        os.remove(input_path)
-        os.remove(output_path)
-        os.remove(plot_path)
-
-        # Gerar recomendações baseadas na severidade
-        if severity < 5:
-            recomendacao = {
-                "tipo": "calda_bordalesa",
-                "titulo": "Recomendação: Calda Bordalesa",
-                "descricao": "Para severidades médias abaixo de 5% recomenda-se o uso de tratamentos alternativos, como a utilização de calda bordalesa.",
-                "instrucoes": [
-                    "1. Diluição do sulfato de cobre: Pegue 200 g de sulfato de cobre e coloque-o dentro de um pano, formando um saquinho. Amarre o saquinho na ponta de uma vara e mergulhe em aproximadamente 5 litros de água fria ou morna por 4 a 24 horas.",
-                    "2. Preparo do leite de cal: Coloque 200 g de cal virgem em 2 litros de água e misture bem.",
-                    "3. Mistura dos ingredientes: Derrame vagarosamente o sulfato de cobre diluído sobre o leite de cal.",
-                    "4. Verificação da acidez: Mergulhe um objeto de ferro na calda por 3 minutos. Se escurecer, acrescente cal.",
-                    "5. Filtragem e aplicação: Coe a calda e aplique com pulverizador."
-                ],
-                "fonte": "BRASIL. Ministério da Agricultura, Pecuária e Abastecimento. Calda bordalesa. Coordenação de Agroecologia, [s.d.]. Disponível em: <www.agricultura.gov.br/desenvolvimento-sustentavel/organicos>."
-            }
-        else:
-            recomendacao = {
-                "tipo": "fungicida",
-                "titulo": "Recomendação: Uso de Fungicida",
-                "descricao": "Devido à severidade média superior a 5%, recomenda-se o uso de fungicida.",
-                "instrucoes": [
-                    "Procure orientação técnica para escolha e aplicação adequada do fungicida.",
-                    "Siga rigorosamente as instruções do fabricante.",
-                    "Respeite o período de carência antes da colheita."
-                ],
-                "fonte": "Orientação técnica recomendada para casos de alta severidade."
+        with open(input_path, "wb") as f:
+            f.write(image_data)
+
+        try:
+            # Executa a lógica de IA
+            log.debug("Processando arquivo: %s", filename)
+            analise = analisar_severidade(input_path, output_path, plot_path,
+                                          cascata=cascata, cascata_conf=cascata_conf, roi=roi, perfil=perfil,
+                                          formato=formato, formato_mascara=formato_mascara, folhas=folhas)
+            severity = analise["severity"]
+
+            recomendacao = gerar_recomendacao(severity)
+
+            resposta = {
+                "severity": round(severity, 2),
+                "recomendacao": recomendacao,
+                "gated": analise["gated"],
+                "perfil": perfil["nome"]
             }
+            if "doenca" in analise:
+                resposta["doenca"] = analise["doenca"]
+            if formato != "vetorial":
+                # Imagem de resultado (plot) em bytes: base64 em plot_image_b64 no JSON, binária no MessagePack/CBOR
+                with open(plot_path, "rb") as f:
+                    resposta["plot_image"] = f.read()
+            for chave in ("folhas", "vetor"):
+                if chave in analise:
+                    resposta[chave] = analise[chave]
 
-        # Retorna o resultado
-        return jsonify({
-            "severity": round(severity, 2),
-            "plot_image_b64": plot_image_b64,
-            "recomendacao": recomendacao
-        })
+            return resposta, 200
 
-    except Exception as e:
-        print(f"Erro durante o processamento: {e}")
-        return jsonify({"error": f"Erro interno no servidor: {str(e)}"}), 500
+        except Exception as e:
+            log.exception("Erro durante o processamento: %s", e)
+            return {"error": f"Erro interno no servidor: {str(e)}"}, 500
+        finally:
+            # Limpa os arquivos temporários também quando o processamento falha:
+            # antes eles ficavam no tmpfs e a memória do worker só crescia
+            _remover_arquivos(input_path, output_path, plot_path)
+
+    # Mesma foto com os mesmos parâmetros (toque duplo, reenvio após timeout): roda uma vez só
+    parametros = {"cascata": cascata, "cascata_conf": cascata_conf, "roi": roi, "perfil": perfil["nome"],
+                  "modelo": versao_modelo(perfil),
+                  "backend": perfil["backend"], "formato": formato, "mascara": formato_mascara,
+                  "folhas": folhas, "talhao": talhao, "duplicatas": bool(dados.get("duplicatas", True))}
+    return _executar_idempotente(parametros, [image_data], _com_historico(
+        dados, image_data, perfil, _sem_repetir(dados, image_data, parametros, analisar)))
+
+@app.route("/predict_lote", methods=["POST"])
+def predict_lote():
+    """Severidade de várias imagens numa chamada, com os estágios sobrepostos"""
+    dados = corpo_requisicao()
+    arquivos = dados.get("files") if dados else None
+    if not arquivos or not isinstance(arquivos, list):
+        return jsonify({"error": "Nenhum arquivo enviado"}), 400
+    if len(arquivos) > PIPELINE_MAX_IMAGENS:
+        return jsonify({"error": f"Máximo de {PIPELINE_MAX_IMAGENS} imagens por lote"}), 413
+
+    cascata = bool(dados.get("cascata", CASCATA_ATIVA))
+    roi = bool(dados.get("roi", False))
+    try:
+        cascata_conf = float(dados.get("cascata_conf", CASCATA_CONF))
+    except (TypeError, ValueError):
+        return jsonify({"error": "cascata_conf inválido"}), 400
+    try:
+        perfil = obter_perfil(dados.get("perfil"), cultura=dados.get("cultura"))
+        formato, formato_mascara = ler_formato(dados)
+        folhas = ler_modo_folhas(dados)
+        talhao = ler_talhao(dados)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    usar_duplicatas = duplicatas.DUPLICATAS_ATIVA and bool(dados.get("duplicatas", True))
+
+    def analisar() -> Tuple[Dict, int]:
+        # Fotos repetidas (a outra do lote ou a análises recentes) não passam de novo pelo pipeline;
+        # as só parecidas passam, mas saem marcadas como duplicata
+        hashes, digests = zip(*[_hashes_arquivo(arquivo) if usar_duplicatas else (None, None)
+                                for arquivo in arquivos])
+        planos = duplicatas.planejar_lote(list(hashes), ctx, list(digests))
+        analisar_indices = [i for i, plano in enumerate(planos) if plano is None or not plano["reutilizar"]]
+
+        pipeline = criar_pipeline_severidade(cascata, cascata_conf, roi, perfil, formato=formato,
+                                             formato_mascara=formato_mascara, folhas=folhas)
+        log.debug("Processando lote de %d imagens em pipeline (%d reaproveitadas)",
+                  len(arquivos), len(arquivos) - len(analisar_indices))
+        itens = pipeline.executar([{"file": arquivos[i]} for i in analisar_indices])
+
+        resultados: List[Optional[Dict]] = [None] * len(arquivos)
+        for item, i in zip(itens, analisar_indices):
+            # Itens com erro param no meio do pipeline e ainda podem ter arquivos no tmpfs
+            _limpar_item_lote(item["dados"])
+            if item["erro"] is not None:
+                log.error("Erro na imagem %d do lote: %s", i, item["erro"])
+                resultados[i] = {"error": f"Erro interno no servidor: {item['erro']}"}
+            else:
+                resultados[i] = item["dados"]["resposta"]
+                if hashes[i] is not None:
+                    resultados[i]["analise_id"] = duplicatas.indice.adicionar(hashes[i], ctx, resultados[i],
+                                                                            digests[i])
+        for i, plano in enumerate(planos):
+            if plano is None or (resultados[i] is not None and "error" in resultados[i]):
+                continue
+            if "lote" in plano:
+                original = resultados[plano["lote"]]
+                if "error" in original:
+                    resultados[i] = resultados[i] or original
+                    continue
+                plano = {**plano, "id": original["analise_id"], "resposta": original}
+            resultados[i] = duplicatas.marcar(plano["resposta"] if plano["reutilizar"] else resultados[i], plano)
+
+        if talhao and banco.BANCO_ATIVO:
+            linhas = [linha_historico(dados, r, ler_imagem(arquivos[i]), perfil)
+                      for i, r in enumerate(resultados) if "error" not in r]
+            banco.registrar_seguro([linha for linha in linhas if linha is not None])
+
+        # A mesma folha repetida dentro do lote entra uma vez só na média
+        severidades, ids_lote = [], set()
+        for r in resultados:
+            if "error" in r or ("duplicata" in r and r["duplicata"]["de"] in ids_lote):
+                continue
+            ids_lote.add(r.get("analise_id"))
+            severidades.append(r["severity"])
+        severidade_media = sum(severidades) / len(severidades) if severidades else 0.0
+        return {
+            "resultados": resultados,
+            "severidade_media": round(severidade_media, 2),
+            "recomendacao": gerar_recomendacao(severidade_media) if severidades else None,
+            "tempos_estagios": {nome: round(t, 3) for nome, t in pipeline.ocupacao().items()},
+            "perfil": perfil["nome"]
+        }, 200
+
+    parametros = {"cascata": cascata, "cascata_conf": cascata_conf, "roi": roi, "perfil": perfil["nome"],
+                  "modelo": versao_modelo(perfil),
+                  "backend": perfil["backend"], "formato": formato, "mascara": formato_mascara,
+                  "folhas": folhas, "talhao": talhao, "duplicatas": usar_duplicatas}
+    ctx = duplicatas.contexto(request.path, parametros)
+    imagens = [arquivo.encode() if isinstance(arquivo, str) else bytes(arquivo) for arquivo in arquivos]
+    # Lote com alguma imagem com erro não fica guardado: a nova tentativa roda de novo
+    return _executar_idempotente(parametros, imagens, analisar,
+                                 guardar=lambda r, s: s == 200 and all("error" not in x for x in r["resultados"]))
+
+def _ler_bool(valor, padrao: bool) -> bool:
+    """Campo de formulário/query string como booleano ("1", "true", "sim")"""
+    if valor is None or valor == "":
+        return padrao
+    return str(valor).lower() in ("1", "true", "sim", "on")
+
+@app.route("/predict_video", methods=["POST"])
+@perfilar
+def predict_video():
+    """Severidade ao longo de um vídeo curto: quadros amostrados (video.py) passam pelo pipeline
+
+    O vídeo vem no campo "video" (multipart) ou como corpo cru (Content-Type
+    video/*); os parâmetros (perfil, cascata, roi, formato...) vêm nos campos
+    do formulário ou na query string. A cascata fica ligada por padrão: os
+    quadros sem lesão pulam o rembg e a segmentação. Com folhas=multiplas
+    cada quadro traz a severidade de cada folha visível.
+    """
+    if request.content_length and request.content_length > video.VIDEO_MAX_MB * 2**20:
+        return jsonify({"error": f"Vídeo maior que {video.VIDEO_MAX_MB:.0f} MB"}), 413
+    arquivo = request.files.get("video")
+    if arquivo is None and not request.mimetype.startswith("video/"):
+        return jsonify({"error": "Nenhum vídeo enviado (campo 'video' ou corpo video/*)"}), 400
+
+    dados = {**request.args.to_dict(), **request.form.to_dict()}
+    cascata = _ler_bool(dados.get("cascata"), True)
+    roi = _ler_bool(dados.get("roi"), False)
+    try:
+        cascata_conf = float(dados.get("cascata_conf", CASCATA_CONF))
+    except (TypeError, ValueError):
+        return jsonify({"error": "cascata_conf inválido"}), 400
+    try:
+        perfil = obter_perfil(dados.get("perfil"), cultura=dados.get("cultura"))
+        formato, formato_mascara = ler_formato(dados)
+        folhas = ler_modo_folhas(dados)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # O vídeo vai para o disco em blocos (cv2.VideoCapture precisa de um arquivo)
+    video_path = os.path.join(INPUT_FOLDER, f"video_{uuid.uuid4()}")
+    try:
+        digest = video.salvar_upload(arquivo.stream if arquivo is not None else request.stream, video_path)
+    except video.VideoGrande as e:
+        _remover_arquivos(video_path)
+        return jsonify({"error": str(e)}), 413
+
+    def analisar() -> Tuple[Dict, int]:
+        try:
+            amostrador = video.AmostradorVideo(video_path)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        # Com o with, o VideoCapture é solto mesmo se o pipeline falhar antes de ler o vídeo todo
+        with amostrador:
+            pipeline = criar_pipeline_severidade(cascata, cascata_conf, roi, perfil, formato=formato,
+                                                 formato_mascara=formato_mascara, folhas=folhas)
+            quadros = []
+
+            def entradas():
+                # Consumido pela thread de entrada do pipeline: decodificação e análise se sobrepõem
+                for indice, tempo, quadro, nitidez in amostrador:
+                    quadros.append({"quadro": indice, "tempo_s": tempo, "nitidez": nitidez})
+                    yield {"file": cv2.imencode(".jpg", quadro, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()}
+
+            log.debug("Processando vídeo %s", amostrador.info)
+            itens = pipeline.executar(entradas())
+            resumo_video = {**amostrador.info, **amostrador.estatisticas}
+        if not itens:
+            return {"error": "Nenhum quadro nítido e estável encontrado no vídeo", "video": resumo_video}, 422
+
+        resultados = []
+        for item, quadro in zip(itens, quadros):
+            _limpar_item_lote(item["dados"])
+            if item["erro"] is not None:
+                log.error("Erro no quadro %d do vídeo: %s", quadro["quadro"], item["erro"])
+                resultados.append({**quadro, "error": f"Erro interno no servidor: {item['erro']}"})
+                continue
+            resultado = {**quadro, **item["dados"]["resposta"]}
+            deteccao = item["dados"].get("deteccao")
+            if deteccao is not None:
+                resultado["doenca"] = deteccao["disease"]
+                resultado["confianca"] = round(deteccao["confidence"], 4)
+            resultados.append(resultado)
+
+        severidades = [r["severity"] for r in resultados if "error" not in r]
+        severidade_media = sum(severidades) / len(severidades) if severidades else 0.0
+        doencas = collections.Counter(r["doenca"] for r in resultados if r.get("doenca", "indefinido") != "indefinido")
+        return {
+            "quadros": resultados,
+            "severidade_media": round(severidade_media, 2),
+            "severidade_max": max(severidades, default=0.0),
+            "quadros_com_lesao": sum(1 for s in severidades if s > 0),
+            "doencas": dict(doencas.most_common()),
+            "recomendacao": gerar_recomendacao(severidade_media) if severidades else None,
+            "video": resumo_video,
+            "tempos_estagios": {nome: round(t, 3) for nome, t in pipeline.ocupacao().items()},
+            "perfil": perfil["nome"]
+        }, 200
+
+    parametros = {"cascata": cascata, "cascata_conf": cascata_conf, "roi": roi, "perfil": perfil["nome"],
+                  "modelo": versao_modelo(perfil),
+                  "backend": perfil["backend"], "formato": formato, "mascara": formato_mascara, "folhas": folhas}
+    try:
+        return _executar_idempotente(parametros, [digest.encode()], analisar,
+                                     guardar=lambda r, s: s == 200 and all("error" not in x for x in r["quadros"]))
+    finally:
+        _remover_arquivos(video_path)
 
 @app.route("/detect_disease", methods=["POST"])
+@perfilar
 def detect_disease_endpoint():
     """Endpoint para detectar doença usando YOLOv8"""
-    if 'file' not in request.json:
+    dados = corpo_requisicao()
+    if not dados or 'file' not in dados:
         return jsonify({"error": "Nenhum arquivo enviado"}), 400
     
-    # Verificar se o modelo está carregado
-    if detection_model is None:
-        return jsonify({"error": "Modelo de detecção não está disponível"}), 503
-    
-    # Decodificar imagem base64
-    image_data_b64 = request.json['file']
+    # Decodificar imagem (base64 no JSON, bytes no MessagePack/CBOR)
     try:
-        image_data = base64.b64decode(image_data_b64)
+        image_data = ler_imagem(dados['file'])
     except Exception as e:
         return jsonify({"error": f"Erro ao decodificar base64: {str(e)}"}), 400
+    try:
+        perfil = obter_perfil(dados.get("perfil"), cultura=dados.get("cultura"))
+        formato, _ = ler_formato(dados)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    # Salvar imagem temporária
-    filename = f"detect_{uuid.uuid4()}.jpg"
-    input_path = os.path.join(INPUT_FOLDER, filename)
-    processed_path = os.path.join(OUTPUT_FOLDER, f"processed_{filename}")
-    plot_path = os.path.join(PLOTS_FOLDER, f"plot_{filename}")
+    # Verificar se há modelo de detecção (o da cultura ou o embutido)
+    if not deteccao_disponivel(perfil):
+        return jsonify({"error": "Modelo de detecção não está disponível"}), 503
 
-    with open(input_path, "wb") as f:
-        f.write(image_data)
+    def analisar() -> Tuple[Dict, int]:
+        # Salvar imagem temporária
+        filename = f"detect_{uuid.uuid4()}.jpg"
+        input_path = os.path.join(INPUT_FOLDER, filename)
+        processed_path = os.path.join(OUTPUT_FOLDER, f"processed_{filename}")
+        plot_path = os.path.join(PLOTS_FOLDER, f"plot_{filename}")
 
-    try:
-        # Preprocessar imagem para 256x256
-        print(f"Processando detecção para arquivo: {filename}")
-        preprocess_image_detection(input_path, processed_path)
-        
-        # Detectar doença
-        detection_result = detect_disease(processed_path)
-        detected_disease = detection_result["disease"]
-        detections = detection_result["detections"]
-        confidence = detection_result["confidence"]
+        with open(input_path, "wb") as f:
+            f.write(image_data)
+
+        try:
+            # Preprocessar imagem para 256x256
+            log.debug("Processando detecção para arquivo: %s", filename)
+            img_deteccao = preprocess_image_detection(input_path, processed_path, perfil)
         
-        # Plotar detecções na imagem original (redimensionada)
-        plot_detections(processed_path, detections, plot_path)
+            # Detectar doença (com a imagem em memória, sem reler o arquivo)
+            detection_result = detect_disease(img_deteccao if img_deteccao is not None else processed_path, perfil=perfil)
+            detected_disease = detection_result["disease"]
+            detections = detection_result["detections"]
+            confidence = detection_result["confidence"]
         
-        # Codificar imagem com detecções para envio
-        plot_image_b64 = ""
-        if os.path.exists(plot_path):
-            with open(plot_path, "rb") as f:
-                plot_image_b64 = base64.b64encode(f.read()).decode('utf-8')
-
-        # Limpar arquivos temporários
-        if os.path.exists(input_path):
-            os.remove(input_path)
-        if os.path.exists(processed_path):
-            os.remove(processed_path)
-        if os.path.exists(plot_path):
-            os.remove(plot_path)
-
-        # Retornar resultado detalhado
-        return jsonify({
-            "detected_disease": detected_disease,
-            "detections": detections,
-            "confidence": confidence,
-            "plot_image_b64": plot_image_b64,
-            "success": True
-        })
+            resposta = {
+                "detected_disease": detected_disease,
+                "confidence": confidence,
+                "perfil": perfil["nome"],
+                "success": True
+            }
+            if formato != "vetorial":
+                # Plotar detecções na imagem original (redimensionada)
+                plot_detections(processed_path, detections, plot_path)
+            
+                # Imagem com detecções em bytes (base64 só na resposta JSON)
+                plot_image = b""
+                if os.path.exists(plot_path):
+                    with open(plot_path, "rb") as f:
+                        plot_image = f.read()
+                resposta["detections"] = detections
+                resposta["plot_image"] = plot_image
+            if formato != "imagem":
+                # Caixas normalizadas em arrays por campo no lugar da lista de detecções
+                resposta["vetor"] = vetorizar_deteccoes(detection_result, perfil)
 
-    except Exception as e:
-        print(f"Erro durante a detecção: {e}")
-        # Limpar arquivos em caso de erro
-        if os.path.exists(input_path):
-            os.remove(input_path)
-        if os.path.exists(processed_path):
-            os.remove(processed_path)
-        return jsonify({"error": f"Erro interno no servidor: {str(e)}"}), 500
+            return resposta, 200
+
+        except Exception as e:
+            log.exception("Erro durante a detecção: %s", e)
+            return {"error": f"Erro interno no servidor: {str(e)}"}, 500
+        finally:
+            # Limpar arquivos temporários (o plot também ficava para trás em caso de erro)
+            _remover_arquivos(input_path, processed_path, plot_path)
+
+    parametros = {"perfil": perfil["nome"], "modelo": versao_modelo(perfil), "backend": perfil["backend"], "formato": formato,
+                  "duplicatas": bool(dados.get("duplicatas", True))}
+    return _executar_idempotente(parametros, [image_data], _sem_repetir(dados, image_data, parametros, analisar))
+
+# WebSocket /ao_vivo: detecção quadro a quadro da "Câmera com Guia"
+ao_vivo.registrar(app, detectar_quadro, obter_perfil, deteccao_disponivel)
+# GET /admin/modelos e POST /admin/modelos/<id>/ativar (troca de versão sem reiniciar)
+modelos.registrar_rotas(app, _modelos, _aquecer_versao)
+
+@app.route("/config", methods=["GET"])
+def config_endpoint():
+    """Configuração efetiva do servidor (perfil, backend, threads, lote, pipeline)"""
+    import torch
+    return jsonify({
+        "perfil_padrao": PERFIL_PADRAO,
+        "backend": BACKEND_FORCADO or PERFIS[PERFIL_PADRAO]["backend"],
+        "inferencia_direta": INFERENCIA_DIRETA,
+        "execucao": {**CONFIG_EXECUCAO, "threads_torch": torch.get_num_threads(), "cpus": os.cpu_count()},
+        "autotune": {"modo": AUTOTUNE, "arquivo": AUTOTUNE_ARQUIVO, "slo_ms": AUTOTUNE_SLO_MS},
+        "pipeline": {"workers": PIPELINE_WORKERS, "fila": PIPELINE_FILA, "max_imagens": PIPELINE_MAX_IMAGENS},
+        "cascata": {"ativa": CASCATA_ATIVA, "conf": CASCATA_CONF},
+        "folhas": {"modos": list(FOLHAS_MODOS), "area_min": FOLHA_AREA_MIN, "abertura": FOLHA_ABERTURA},
+        "deteccao_disponivel": deteccao_disponivel(),
+        "idempotencia": idempotencia.cache.resumo() if idempotencia.IDEMPOTENCIA_ATIVA else None,
+        "ao_vivo": ao_vivo.resumo(),
+        "duplicatas": duplicatas.indice.resumo() if duplicatas.DUPLICATAS_ATIVA else None,
+        "banco": banco.resumo(),
+        "modelos": {"cultura_padrao": modelos.CULTURA_PADRAO,
+                    "versoes": obter_perfil().get("versoes"), "cache": _modelos.resumo()},
+        "boot": ESTADO_BOOT,
+    })
+
+@app.route("/pronto", methods=["GET"])
+def pronto_endpoint():
+    """Prontidão: 200 depois que os modelos do perfil padrão foram carregados"""
+    return jsonify(ESTADO_BOOT), 200 if ESTADO_BOOT["pronto"] else 503
+
+if AQUECER:
+    threading.Thread(target=aquecer, name="aquecimento", daemon=True).start()
+elif AUTOTUNE != "0":
+    _configurar_execucao()
 
 if __name__ == "__main__":
     # A porta é gerenciada pelo Cloud Run, não precisamos definir aqui.
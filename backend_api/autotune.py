@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Autoajuste de backend, threads e tamanho de lote para a máquina atual
+
+Mede os backends disponíveis (PyTorch, ONNX Runtime, OpenVINO) com entradas
+sintéticas de 640x640 (segmentação) e 256x256 (detecção), para cada número
+de threads e tamanho de lote, e escolhe a combinação de maior vazão cuja
+latência fica dentro do SLO. O resultado é gravado num arquivo JSON, indexado
+pela assinatura da máquina (CPUs, modelo do processador, versões), para que os
+próximos boots na mesma máquina só leiam o arquivo.
+
+Uso offline (rodar dentro de backend_api/, com os modelos):
+  python autotune.py [--slo-ms 2000] [--saida autotune.json]
+No servidor: AUTOTUNE=carregar (só lê o arquivo) ou AUTOTUNE=1 (mede no boot se faltar).
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+SLO_MS_PADRAO = 2000.0
+LOTES_PADRAO = (1, 2, 4)
+
+
+def assinatura_maquina() -> str:
+    """Identifica a máquina: uma configuração medida em 4 vCPUs não vale para 1 vCPU"""
+    modelo_cpu = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for linha in f:
+                if linha.startswith("model name"):
+                    modelo_cpu = linha.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    import torch
+    return f"{os.cpu_count()}cpu|{modelo_cpu}|torch {torch.__version__}"
+
+
+def threads_candidatas() -> List[int]:
+    """1, 2, 4... até o número de CPUs, sempre incluindo o total"""
+    cpus = os.cpu_count() or 1
+    candidatas = {cpus}
+    n = 1
+    while n < cpus:
+        candidatas.add(n)
+        n *= 2
+    return sorted(candidatas)
+
+
+def _medir(modelo, imgsz: int, lote: int, repeticoes: int) -> float:
+    """Mediana do tempo (s) de uma chamada com um lote sintético"""
+    rng = np.random.default_rng(0)
+    entrada = rng.integers(0, 256, (lote, imgsz, imgsz, 3), dtype=np.uint8)
+    modelo(entrada)  # Aquecimento
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        modelo(entrada)
+        tempos.append(time.perf_counter() - inicio)
+    return float(np.median(tempos))
+
+
+def autoajustar(criar_modelo: Callable[[str, str, int, int], object], backends: List[str],
+                seg_size: int = 640, det_size: Optional[int] = 256, threads: Optional[List[int]] = None,
+                lotes: List[int] = LOTES_PADRAO, slo_ms: float = SLO_MS_PADRAO, repeticoes: int = 3) -> Dict:
+    """Mede todas as combinações e retorna a configuração escolhida
+
+    criar_modelo(backend, tarefa, imgsz, threads) deve devolver um ModeloDireto
+    novo (sem cache). Com det_size None a detecção não entra na conta.
+    A latência de uma combinação é o tempo de um lote inteiro de segmentação
+    mais detecção; a vazão é imagens por segundo nesse lote.
+    """
+    import torch
+
+    threads = threads or threads_candidatas()
+    threads_originais = torch.get_num_threads()
+    medicoes = []
+    try:
+        for backend in backends:
+            for n_threads in threads:
+                torch.set_num_threads(n_threads)
+                try:
+                    seg = criar_modelo(backend, "segment", seg_size, n_threads)
+                    det = criar_modelo(backend, "detect", det_size, n_threads) if det_size else None
+                except Exception as e:
+                    log.warning("Autoajuste sem o backend %s: %s", backend, e)
+                    break
+                for lote in lotes:
+                    t = _medir(seg, seg_size, lote, repeticoes)
+                    if det is not None:
+                        t += _medir(det, det_size, lote, repeticoes)
+                    medicoes.append({"backend": backend, "threads": n_threads, "lote": lote,
+                                     "latencia_ms": round(t * 1000, 1), "imagens_s": round(lote / t, 2)})
+                    log.info("Autoajuste %-8s threads=%d lote=%d: %.1f ms, %.2f imagens/s",
+                             backend, n_threads, lote, t * 1000, lote / t)
+                del seg, det
+    finally:
+        torch.set_num_threads(threads_originais)
+
+    if not medicoes:
+        raise RuntimeError("Nenhum backend pôde ser medido")
+    dentro_slo = [m for m in medicoes if m["latencia_ms"] <= slo_ms]
+    if dentro_slo:
+        escolhida = max(dentro_slo, key=lambda m: m["imagens_s"])
+    else:
+        # Nada cabe no SLO: fica com a menor latência
+        escolhida = min(medicoes, key=lambda m: m["latencia_ms"])
+    return {
+        **escolhida,
+        "slo_ms": slo_ms,
+        "dentro_slo": bool(dentro_slo),
+        "assinatura": assinatura_maquina(),
+        "medido_em": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "medicoes": medicoes,
+    }
+
+
+def carregar(caminho: str) -> Optional[Dict]:
+    """Configuração salva para esta máquina (None se não houver)"""
+    if not os.path.exists(caminho):
+        return None
+    try:
+        with open(caminho) as f:
+            return json.load(f).get(assinatura_maquina())
+    except (OSError, ValueError) as e:
+        log.warning("Arquivo de autoajuste %s ignorado: %s", caminho, e)
+        return None
+
+
+def salvar(config: Dict, caminho: str) -> None:
+    """Grava a configuração sob a assinatura da máquina, mantendo as de outras máquinas"""
+    configs = {}
+    if os.path.exists(caminho):
+        try:
+            with open(caminho) as f:
+                configs = json.load(f)
+        except (OSError, ValueError):
+            configs = {}
+    configs[config["assinatura"]] = config
+    temporario = f"{caminho}.tmp{os.getpid()}"
+    with open(temporario, "w") as f:
+        json.dump(configs, f, indent=2, ensure_ascii=False)
+    os.replace(temporario, caminho)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Autoajuste de backend, threads e lote")
+    parser.add_argument("--slo-ms", type=float, default=SLO_MS_PADRAO,
+                        help="Latência máxima aceitável por lote (segmentação + detecção)")
+    parser.add_argument("--backends", default="pytorch,onnx,openvino", help="Backends separados por vírgula")
+    parser.add_argument("--lotes", default=",".join(map(str, LOTES_PADRAO)), help="Tamanhos de lote")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--saida", help="Arquivo JSON (padrão: AUTOTUNE_ARQUIVO do servidor)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("AQUECER", "0")
+    os.environ.setdefault("LOG_FORMATO", "texto")
+    import app
+
+    config = app.executar_autotune(backends=args.backends.split(","), slo_ms=args.slo_ms,
+                                   lotes=[int(n) for n in args.lotes.split(",")],
+                                   repeticoes=args.repeticoes, caminho=args.saida)
+    print(f"\nEscolhido: backend {config['backend']}, {config['threads']} threads, lote {config['lote']} "
+          f"({config['latencia_ms']} ms, {config['imagens_s']} imagens/s"
+          f"{'' if config['dentro_slo'] else ', nenhuma combinação dentro do SLO'})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+"""
+Avaliação dos modelos num conjunto rotulado local (rodar dentro de backend_api/, com os modelos)
+Uso: python avaliacao.py <pasta> [--config "perfil=fast,backend=onnx"] [--config "det=novo.pt"] ...
+
+Estrutura da pasta (a mesma do treino YOLO):
+  images/...        fotos (subpastas permitidas)
+  labels/...        um .txt por foto no formato YOLO: classe cx cy w h, normalizados
+                    (polígonos de segmentação também valem: vira a caixa do polígono);
+                    foto sem .txt = folha sem doença
+  masks/...         opcional: PNG por foto com 0 = fundo, 1 = folha sadia, 2 = lesão
+  severidade.csv    opcional: arquivo,severidade (%); tem precedência sobre as máscaras
+
+Cada --config é uma configuração a comparar (chaves: perfil, backend, cultura,
+det, seg, det_conf, seg_conf, nome); sem --config, avalia a configuração padrão
+do servidor. Métricas: mAP@0.5 e mAP@0.5:0.95, precisão e revocação no limiar
+de confiança e acerto da doença principal por foto; erro da severidade (MAE,
+RMSE, viés) e concordância da recomendação (limiar de 5%); latência mediana e
+p95 da detecção e da severidade.
+
+As predições ficam em cache (SQLite, ao lado do conjunto) por hash do modelo e
+hash da imagem, guardadas com confiança mínima CONF_CACHE. Trocar limiares
+(det_conf, seg_conf, --iou) só repontua, sem rodar os modelos de novo:
+- detecção: todas as caixas com confiança >= CONF_CACHE (o NMS mantém as
+  mesmas caixas acima de qualquer limiar maior);
+- severidade: área da folha e histograma, em centésimos, da maior confiança
+  de lesão em cada pixel; a máscara em qualquer limiar múltiplo de 0.01 sai
+  da soma do histograma.
+A latência guardada é a da execução que preencheu o cache (--sem-cache mede de novo).
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# A avaliação carrega os modelos por conta própria: sem aquecimento em segundo plano
+os.environ.setdefault("AQUECER", "0")
+os.environ.setdefault("LOG_FORMATO", "texto")
+
+CONF_CACHE = 0.01
+LIMIAR_TRATAMENTO = 5.0  # Mesmo limiar de gerar_recomendacao no app
+IOUS_MAP = np.linspace(0.5, 0.95, 10)
+EXTENSOES = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+CHAVES_CONFIG = ("nome", "perfil", "backend", "cultura", "det", "seg", "det_conf", "seg_conf")
+
+
+# --- Conjunto rotulado ---
+
+def ler_rotulos_yolo(caminho: str) -> List[Tuple[int, np.ndarray]]:
+    """(classe, caixa xyxy normalizada) de um .txt YOLO; arquivo ausente = nenhuma caixa"""
+    if not os.path.exists(caminho):
+        return []
+    rotulos = []
+    with open(caminho) as f:
+        for linha in f:
+            valores = linha.split()
+            if len(valores) < 5:
+                continue
+            classe, numeros = int(float(valores[0])), [float(v) for v in valores[1:]]
+            if len(numeros) == 4:
+                cx, cy, w, h = numeros
+                caixa = [cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2]
+            else:
+                xs, ys = numeros[0::2], numeros[1::2]
+                caixa = [min(xs), min(ys), max(xs), max(ys)]
+            rotulos.append((classe, np.array(caixa, dtype=np.float32)))
+    return rotulos
+
+
+def severidade_da_mascara(caminho: str) -> Optional[float]:
+    """Severidade (%) de uma máscara rotulada: lesão / (folha sadia + lesão)"""
+    mascara = cv2.imread(caminho, cv2.IMREAD_GRAYSCALE)
+    if mascara is None:
+        return None
+    folha = int(np.count_nonzero(mascara))
+    return 100.0 * np.count_nonzero(mascara == 2) / folha if folha else None
+
+
+def carregar_conjunto(pasta: str) -> List[Dict]:
+    """Fotos do conjunto com as caixas e a severidade de referência (None se não houver)"""
+    pasta_imagens = os.path.join(pasta, "images")
+    if not os.path.isdir(pasta_imagens):
+        raise FileNotFoundError(f"Pasta {pasta_imagens} não encontrada")
+    referencia = {}
+    caminho_csv = os.path.join(pasta, "severidade.csv")
+    if os.path.exists(caminho_csv):
+        with open(caminho_csv, newline="") as f:
+            referencia = {linha["arquivo"]: float(linha["severidade"]) for linha in csv.DictReader(f)}
+
+    amostras = []
+    for raiz, _, nomes in os.walk(pasta_imagens):
+        for nome in sorted(nomes):
+            if not nome.lower().endswith(EXTENSOES):
+                continue
+            caminho = os.path.join(raiz, nome)
+            relativo = os.path.relpath(caminho, pasta_imagens)
+            base = os.path.splitext(relativo)[0]
+            severidade = referencia.get(relativo, referencia.get(nome))
+            mascara = os.path.join(pasta, "masks", base + ".png")
+            if severidade is None and os.path.exists(mascara):
+                severidade = severidade_da_mascara(mascara)
+            amostras.append({"arquivo": relativo, "caminho": caminho, "severidade": severidade,
+                             "caixas": ler_rotulos_yolo(os.path.join(pasta, "labels", base + ".txt"))})
+    return sorted(amostras, key=lambda a: a["arquivo"])
+
+
+# --- Cache de predições ---
+
+class CachePredicoes:
+    """Predições cruas por (chave do modelo, hash da imagem), num SQLite"""
+
+    def __init__(self, caminho: str, ignorar: bool = False):
+        self.ignorar = ignorar  # --sem-cache: roda tudo de novo e sobrescreve
+        self.con = sqlite3.connect(caminho)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute("""CREATE TABLE IF NOT EXISTS predicoes (
+            modelo TEXT NOT NULL, imagem TEXT NOT NULL, dados TEXT NOT NULL, ms REAL NOT NULL,
+            criada_em REAL NOT NULL, PRIMARY KEY (modelo, imagem)) WITHOUT ROWID""")
+        self.contadores = {"cache": 0, "inferidas": 0}
+
+    def obter(self, modelo: str, imagem: str) -> Optional[Tuple[Dict, float]]:
+        if self.ignorar:
+            return None
+        linha = self.con.execute("SELECT dados, ms FROM predicoes WHERE modelo = ? AND imagem = ?",
+                                 (modelo, imagem)).fetchone()
+        if linha is None:
+            return None
+        self.contadores["cache"] += 1
+        return json.loads(linha[0]), linha[1]
+
+    def guardar(self, modelo: str, imagem: str, dados: Dict, ms: float) -> None:
+        with self.con:
+            self.con.execute("INSERT OR REPLACE INTO predicoes VALUES (?, ?, ?, ?, ?)",
+                             (modelo, imagem, json.dumps(dados), ms, time.time()))
+        self.contadores["inferidas"] += 1
+
+
+_hashes_modelos: Dict[str, str] = {}
+
+
+def hash_modelo(caminho: str) -> str:
+    """sha256 (16 primeiros dígitos) do arquivo de pesos, calculado uma vez por execução"""
+    import modelos
+    if caminho not in _hashes_modelos:
+        _hashes_modelos[caminho] = modelos.sha256_arquivo(caminho)[:16] if os.path.exists(caminho) else "ausente"
+    return _hashes_modelos[caminho]
+
+
+def chave_modelo(app, perfil: Dict, tarefa: str) -> str:
+    """O que muda a saída crua: pesos, backend, precisão, caminho de inferência e tamanhos"""
+    partes = [perfil["backend"], perfil["precisao"], "direto" if app.INFERENCIA_DIRETA else "predict"]
+    if tarefa == "detect":
+        partes = [hash_modelo(perfil["det_model"]), *partes, perfil["detection_size"][0]]
+    else:
+        partes = [hash_modelo(perfil["seg_model"]), *partes, perfil["target_size"][0],
+                  perfil["intermediate_size"], perfil["rembg_model"]]
+    return f"{tarefa}:" + ":".join(str(p) for p in partes)
+
+
+# --- Inferência (saídas cruas, com confiança mínima CONF_CACHE) ---
+
+def predizer_deteccao(app, img: np.ndarray, perfil: Dict) -> Dict:
+    """Caixas [classe, confiança, x1, y1, x2, y2] normalizadas, como no /detect_disease"""
+    largura, altura = perfil["detection_size"]
+    img_det = cv2.resize(img, perfil["detection_size"], interpolation=cv2.INTER_CUBIC)
+    deteccao = app.detect_disease(img_det, conf=CONF_CACHE, perfil=perfil)
+    return {"caixas": [[d["class_id"], round(d["confidence"], 4), d["bbox"][0] / largura, d["bbox"][1] / altura,
+                        d["bbox"][2] / largura, d["bbox"][3] / altura] for d in deteccao["detections"]]}
+
+
+def _mapa_confianca(app, img: np.ndarray, perfil: Dict) -> np.ndarray:
+    """Maior confiança de lesão em cada pixel, em centésimos (0 = sem lesão)"""
+    if app.INFERENCIA_DIRETA:
+        resultado = app.obter_modelo_segmentacao(perfil, direto=True)(img[None], conf=CONF_CACHE)[0]
+        mascaras, scores = resultado.get("masks", []), resultado["scores"]
+    else:
+        resultado = app.obter_modelo_segmentacao(perfil).predict(img, conf=CONF_CACHE, imgsz=img.shape[0],
+                                                                 half=perfil["precisao"] == "fp16", verbose=False)[0]
+        mascaras = [] if resultado.masks is None else resultado.masks.data.cpu().numpy() > 0
+        scores = [] if resultado.masks is None else resultado.boxes.conf.cpu().numpy()
+    mapa = np.zeros(img.shape[:2], np.uint8)
+    for mascara, score in zip(mascaras, scores):
+        np.maximum(mapa, mascara.astype(np.uint8) * max(1, int(score * 100)), out=mapa)
+    return mapa
+
+
+def predizer_severidade(app, caminho: str, perfil: Dict) -> Dict:
+    """Área da folha e histograma de confiança das lesões, no fluxo de severidade do servidor"""
+    saida = os.path.join(app.OUTPUT_FOLDER, f"avaliacao_{uuid.uuid4()}.jpg")
+    try:
+        app.preprocess_image(caminho, saida, None, perfil)
+        img = cv2.imread(saida)
+    finally:
+        if os.path.exists(saida):
+            os.remove(saida)
+    if img is None:
+        return {"area_folha": 0.0, "histograma": []}
+    _, contorno = app.analisar_mascara(img, np.zeros(img.shape[:2], np.uint8))
+    histograma = np.bincount(_mapa_confianca(app, img, perfil).ravel(), minlength=101)
+    return {"area_folha": float(cv2.contourArea(contorno)) if contorno is not None else 0.0,
+            "histograma": histograma.tolist()}
+
+
+def severidade_no_limiar(predicao: Dict, seg_conf: float) -> float:
+    """Severidade (%) como o servidor calcularia com seg_conf (arredondado a centésimos)"""
+    if not predicao["area_folha"] or not predicao["histograma"]:
+        return 0.0
+    inicio = max(1, round(seg_conf * 100))
+    return 100.0 * sum(predicao["histograma"][inicio:]) / predicao["area_folha"]
+
+
+# --- Métricas ---
+
+def _iou(caixa: np.ndarray, caixas: np.ndarray) -> np.ndarray:
+    x1 = np.maximum(caixa[0], caixas[:, 0])
+    y1 = np.maximum(caixa[1], caixas[:, 1])
+    x2 = np.minimum(caixa[2], caixas[:, 2])
+    y2 = np.minimum(caixa[3], caixas[:, 3])
+    intersecao = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    areas = (caixas[:, 2] - caixas[:, 0]) * (caixas[:, 3] - caixas[:, 1])
+    return intersecao / np.maximum((caixa[2] - caixa[0]) * (caixa[3] - caixa[1]) + areas - intersecao, 1e-9)
+
+
+def _casar(predicoes: List[Tuple], verdades: Dict[int, np.ndarray], iou_min: float) -> np.ndarray:
+    """Marca cada predição (imagem, confiança, caixa), da mais confiante à menos, como acerto ou não"""
+    usadas = {i: np.zeros(len(caixas), bool) for i, caixas in verdades.items()}
+    acertos = np.zeros(len(predicoes), bool)
+    for k, (i, _, caixa) in enumerate(predicoes):
+        caixas = verdades.get(i)
+        if caixas is None or not len(caixas):
+            continue
+        ious = np.where(usadas[i], -1.0, _iou(caixa, caixas))
+        j = int(np.argmax(ious))
+        if ious[j] >= iou_min:
+            usadas[i][j] = acertos[k] = True
+    return acertos
+
+
+def average_precision(acertos: np.ndarray, n_verdades: int) -> float:
+    """AP com interpolação de 101 pontos de revocação (como no COCO)"""
+    if n_verdades == 0:
+        return float("nan")
+    if not len(acertos):
+        return 0.0
+    tp = np.cumsum(acertos)
+    precisao = tp / np.arange(1, len(acertos) + 1)
+    revocacao = tp / n_verdades
+    envelope = np.maximum.accumulate(precisao[::-1])[::-1]
+    indices = np.searchsorted(revocacao, np.linspace(0, 1, 101), side="left")
+    return float(np.mean([envelope[i] if i < len(envelope) else 0.0 for i in indices]))
+
+
+def metricas_deteccao(amostras: List[Dict], predicoes: List[Dict], det_conf: float, iou: float) -> Dict:
+    """mAP (todas as caixas em cache), precisão/revocação em det_conf e acerto da doença por foto"""
+    classes = sorted({c for a in amostras for c, _ in a["caixas"]})
+    ap50, ap_media = {}, {}
+    for classe in classes:
+        verdades = {i: np.array([caixa for c, caixa in a["caixas"] if c == classe]).reshape(-1, 4)
+                    for i, a in enumerate(amostras)}
+        n_verdades = sum(len(v) for v in verdades.values())
+        candidatas = sorted(((i, p[1], np.array(p[2:], np.float32)) for i, pred in enumerate(predicoes)
+                             for p in pred["caixas"] if p[0] == classe), key=lambda x: -x[1])
+        aps = [average_precision(_casar(candidatas, verdades, limiar), n_verdades) for limiar in IOUS_MAP]
+        ap50[classe], ap_media[classe] = aps[0], float(np.mean(aps))
+
+    # No limiar de operação: caixas de qualquer classe casadas com verdades da mesma classe
+    tp = 0
+    for classe in classes:
+        verdades = {i: np.array([caixa for c, caixa in a["caixas"] if c == classe]).reshape(-1, 4)
+                    for i, a in enumerate(amostras)}
+        candidatas = sorted(((i, p[1], np.array(p[2:], np.float32)) for i, pred in enumerate(predicoes)
+                             for p in pred["caixas"] if p[0] == classe and p[1] >= det_conf), key=lambda x: -x[1])
+        tp += int(_casar(candidatas, verdades, iou).sum())
+    n_pred = sum(1 for pred in predicoes for p in pred["caixas"] if p[1] >= det_conf)
+    n_verdades = sum(len(a["caixas"]) for a in amostras)
+
+    # Doença principal: classe mais frequente nos rótulos x caixa mais confiante (None = sem doença)
+    acertos_doenca = 0
+    for amostra, pred in zip(amostras, predicoes):
+        rotulos = [c for c, _ in amostra["caixas"]]
+        verdade = max(set(rotulos), key=rotulos.count) if rotulos else None
+        confiantes = [p for p in pred["caixas"] if p[1] >= det_conf]
+        prevista = max(confiantes, key=lambda p: p[1])[0] if confiantes else None
+        acertos_doenca += verdade == prevista
+
+    validas50 = [v for v in ap50.values() if not np.isnan(v)]
+    validas = [v for v in ap_media.values() if not np.isnan(v)]
+    return {
+        "map50": float(np.mean(validas50)) if validas50 else None,
+        "map50_95": float(np.mean(validas)) if validas else None,
+        "ap50_por_classe": ap50,
+        "precisao": tp / n_pred if n_pred else None,
+        "revocacao": tp / n_verdades if n_verdades else None,
+        "acerto_doenca": acertos_doenca / len(amostras) if amostras else None,
+    }
+
+
+def metricas_severidade(referencias: List[float], previstas: List[float]) -> Dict:
+    if not referencias:
+        return {"n": 0}
+    ref, prev = np.array(referencias), np.array(previstas)
+    erro = prev - ref
+    return {
+        "n": len(ref),
+        "mae": float(np.abs(erro).mean()),
+        "rmse": float(np.sqrt((erro ** 2).mean())),
+        "vies": float(erro.mean()),
+        "mesma_recomendacao": float(np.mean((ref < LIMIAR_TRATAMENTO) == (prev < LIMIAR_TRATAMENTO))),
+    }
+
+
+# --- Configurações e relatório ---
+
+def ler_config(texto: str) -> Dict:
+    """"perfil=fast,backend=onnx,det=novo.pt" -> dicionário (ValueError em chave desconhecida)"""
+    config = {}
+    for parte in filter(None, (p.strip() for p in texto.split(","))):
+        chave, _, valor = parte.partition("=")
+        if chave not in CHAVES_CONFIG or not valor:
+            raise ValueError(f"Configuração inválida '{parte}'. Chaves: {', '.join(CHAVES_CONFIG)}")
+        config[chave] = float(valor) if chave in ("det_conf", "seg_conf") else valor
+    return config
+
+
+def montar_perfil(app, config: Dict) -> Dict:
+    perfil = app.obter_perfil(config.get("perfil"), backend=config.get("backend"), cultura=config.get("cultura"))
+    for chave, campo, tarefa in (("det", "det_model", "detect"), ("seg", "seg_model", "segment")):
+        if config.get(chave):
+            perfil[campo] = config[chave]
+            perfil["versoes"][tarefa] = os.path.basename(config[chave])
+    return perfil
+
+
+def _ms(tempos: List[float], q: float) -> str:
+    return f"{np.percentile(tempos, q):.0f}" if tempos else "-"
+
+
+def _num(valor: Optional[float], casas: int = 3) -> str:
+    return "-" if valor is None else f"{valor:.{casas}f}"
+
+
+def avaliar_config(app, amostras: List[Dict], config: Dict, cache: CachePredicoes, args) -> Dict:
+    perfil = montar_perfil(app, config)
+    det_conf = config.get("det_conf", args.det_conf if args.det_conf is not None else perfil["det_conf"])
+    seg_conf = config.get("seg_conf", args.seg_conf if args.seg_conf is not None else perfil["seg_conf"])
+    nome = config.get("nome") or ",".join(f"{k}={v}" for k, v in config.items()) or "padrão"
+    deteccao_ok = app.deteccao_disponivel(perfil)
+    chave_det = chave_modelo(app, perfil, "detect") if deteccao_ok else None
+    chave_seg = chave_modelo(app, perfil, "segment") if not args.sem_severidade else None
+
+    predicoes_det, tempos_det, tempos_sev, referencias, previstas = [], [], [], [], []
+    aquecidos = set()  # A primeira inferência de cada modelo inclui o carregamento: roda uma vez fora da medida
+    for n, amostra in enumerate(amostras, 1):
+        with open(amostra["caminho"], "rb") as f:
+            dados = f.read()
+        hash_imagem = hashlib.sha256(dados).hexdigest()
+        if chave_det is not None:
+            guardada = cache.obter(chave_det, hash_imagem)
+            if guardada is None:
+                img = cv2.imdecode(np.frombuffer(dados, np.uint8), cv2.IMREAD_COLOR)
+                if chave_det not in aquecidos:
+                    predizer_deteccao(app, img, perfil)
+                    aquecidos.add(chave_det)
+                inicio = time.perf_counter()
+                predicao = predizer_deteccao(app, img, perfil)
+                guardada = predicao, (time.perf_counter() - inicio) * 1000
+                cache.guardar(chave_det, hash_imagem, *guardada)
+            predicoes_det.append(guardada[0])
+            tempos_det.append(guardada[1])
+        if chave_seg is not None and amostra["severidade"] is not None:
+            guardada = cache.obter(chave_seg, hash_imagem)
+            if guardada is None:
+                if chave_seg not in aquecidos:
+                    predizer_severidade(app, amostra["caminho"], perfil)
+                    aquecidos.add(chave_seg)
+                inicio = time.perf_counter()
+                predicao = predizer_severidade(app, amostra["caminho"], perfil)
+                guardada = predicao, (time.perf_counter() - inicio) * 1000
+                cache.guardar(chave_seg, hash_imagem, *guardada)
+            referencias.append(amostra["severidade"])
+            previstas.append(severidade_no_limiar(guardada[0], seg_conf))
+            tempos_sev.append(guardada[1])
+        print(f"\r⏳ {nome}: {n}/{len(amostras)}", end="", flush=True)
+    print()
+
+    nomes_classes = {}
+    if deteccao_ok:
+        modelo = app.obter_modelo_deteccao(perfil)
+        nomes_classes = dict(getattr(modelo, "names", {}) or {})
+    deteccao = metricas_deteccao(amostras, predicoes_det, det_conf, args.iou) if deteccao_ok else None
+    if deteccao:
+        deteccao["ap50_por_classe"] = {nomes_classes.get(c, str(c)): v for c, v in deteccao["ap50_por_classe"].items()}
+    return {
+        "nome": nome, "config": config, "modelos": perfil["versoes"], "backend": perfil["backend"],
+        "det_conf": det_conf, "seg_conf": seg_conf,
+        "chaves_cache": {"deteccao": chave_det, "severidade": chave_seg},
+        "deteccao": deteccao,
+        "severidade": metricas_severidade(referencias, previstas),
+        "latencia_ms": {"deteccao_p50": float(np.median(tempos_det)) if tempos_det else None,
+                        "deteccao_p95": float(np.percentile(tempos_det, 95)) if tempos_det else None,
+                        "severidade_p50": float(np.median(tempos_sev)) if tempos_sev else None,
+                        "severidade_p95": float(np.percentile(tempos_sev, 95)) if tempos_sev else None},
+        "_tempos": (tempos_det, tempos_sev),
+    }
+
+
+def imprimir_relatorio(resultados: List[Dict], n_imagens: int, args) -> None:
+    print(f"\n{n_imagens} imagens; IoU {args.iou} para precisão/revocação; latência em ms (p50/p95)")
+    print("| Configuração         | mAP50 | mAP50-95 | Precisão | Revoc. | Doença | Sev. MAE | Sev. RMSE | "
+          "Mesma recom. | Detecção ms | Severidade ms |")
+    print("|----------------------|-------|----------|----------|--------|--------|----------|-----------|"
+          "--------------|-------------|---------------|")
+    for r in resultados:
+        d = r["deteccao"] or {}
+        s = r["severidade"]
+        tempos_det, tempos_sev = r["_tempos"]
+        print(f"| {r['nome'][:20]:<20} | {_num(d.get('map50')):>5} | {_num(d.get('map50_95')):>8} | "
+              f"{_num(d.get('precisao')):>8} | {_num(d.get('revocacao')):>6} | {_num(d.get('acerto_doenca')):>6} | "
+              f"{_num(s.get('mae'), 2):>8} | {_num(s.get('rmse'), 2):>9} | {_num(s.get('mesma_recomendacao')):>12} | "
+              f"{_ms(tempos_det, 50):>5}/{_ms(tempos_det, 95):<5} | {_ms(tempos_sev, 50):>6}/{_ms(tempos_sev, 95):<6} |")
+
+    classes = sorted({c for r in resultados if r["deteccao"] for c in r["deteccao"]["ap50_por_classe"]})
+    if classes:
+        print("\nAP50 por classe")
+        print("| Classe               | " + " | ".join(f"{r['nome'][:14]:<14}" for r in resultados) + " |")
+        print("|----------------------|" + "|".join("-" * 16 for _ in resultados) + "|")
+        for classe in classes:
+            valores = [(r["deteccao"] or {}).get("ap50_por_classe", {}).get(classe) for r in resultados]
+            print(f"| {classe[:20]:<20} | " + " | ".join(f"{_num(v):>14}" for v in valores) + " |")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Avaliação de detecção e severidade num conjunto rotulado")
+    parser.add_argument("pasta", help="Pasta com images/, labels/ e, opcionalmente, masks/ e severidade.csv")
+    parser.add_argument("--config", action="append", default=[],
+                        help='Configuração a comparar, ex.: "perfil=fast,backend=onnx" ou "nome=novo,det=novo.pt"')
+    parser.add_argument("--det-conf", type=float, help="Limiar da detecção (padrão: o de cada perfil)")
+    parser.add_argument("--seg-conf", type=float, help="Limiar da segmentação (padrão: o de cada perfil)")
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU mínimo para precisão/revocação")
+    parser.add_argument("--cache", help="Arquivo do cache de predições (padrão: <pasta>/.avaliacao_cache.db)")
+    parser.add_argument("--sem-cache", action="store_true", help="Roda os modelos de novo (e atualiza o cache)")
+    parser.add_argument("--sem-severidade", action="store_true", help="Só a detecção (sem rembg e segmentação)")
+    parser.add_argument("--relatorio", help="Salva as métricas completas em JSON")
+    args = parser.parse_args()
+
+    try:
+        configs = [ler_config(texto) for texto in args.config] or [{}]
+        amostras = carregar_conjunto(args.pasta)
+    except (ValueError, FileNotFoundError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if not amostras:
+        print(f"❌ Nenhuma imagem em {os.path.join(args.pasta, 'images')}")
+        sys.exit(1)
+    com_severidade = sum(a["severidade"] is not None for a in amostras)
+    print(f"📁 {len(amostras)} imagens, {sum(len(a['caixas']) for a in amostras)} caixas rotuladas, "
+          f"{com_severidade} com severidade de referência")
+
+    import app
+    cache = CachePredicoes(args.cache or os.path.join(args.pasta, ".avaliacao_cache.db"), ignorar=args.sem_cache)
+    resultados = []
+    for config in configs:
+        try:
+            resultados.append(avaliar_config(app, amostras, config, cache, args))
+        except ValueError as e:
+            print(f"❌ Configuração {config}: {e}")
+    if not resultados:
+        sys.exit(1)
+    imprimir_relatorio(resultados, len(amostras), args)
+    print(f"\n💾 Predições: {cache.contadores['cache']} do cache, {cache.contadores['inferidas']} inferidas agora")
+
+    if args.relatorio:
+        with open(args.relatorio, "w", encoding="utf-8") as f:
+            json.dump({"pasta": args.pasta, "imagens": len(amostras), "iou": args.iou,
+                       "configuracoes": [{k: v for k, v in r.items() if k != "_tempos"} for r in resultados]},
+                      f, ensure_ascii=False, indent=2)
+        print(f"📄 Relatório salvo em {args.relatorio}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# backend_api/backend_openvino.py
+"""Backend OpenVINO para CPUs Intel
+
+Converte os modelos ONNX (YOLO exportado pelo Ultralytics e modelos do rembg)
+para o formato IR do OpenVINO uma única vez, com os arquivos .xml/.bin em cache
+no disco, e oferece uma sessão com a mesma interface de
+onnxruntime.InferenceSession usada pelo rembg e pelo ModeloDireto.
+O pacote openvino é opcional: só é importado quando o backend é escolhido.
+"""
+import logging
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+import yaml
+
+log = logging.getLogger(__name__)
+
+
+def converter_para_ir(caminho_onnx: str, caminho_xml: str, fp16: bool = False,
+                      metadata: Optional[Dict] = None) -> str:
+    """Converte um .onnx para IR (.xml + .bin) se ainda não houver cache
+
+    Se metadata for informado (metadados do Ultralytics), grava também o
+    metadata.yaml ao lado do .xml para o YOLO() carregar a pasta diretamente.
+    """
+    if not os.path.exists(caminho_xml):
+        import openvino as ov
+
+        pasta = os.path.dirname(caminho_xml)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        modelo = ov.convert_model(caminho_onnx)
+        # Grava num nome temporário e renomeia: outro processo nunca lê IR pela metade
+        temporario = caminho_xml[:-4] + f".tmp{os.getpid()}.xml"
+        ov.save_model(modelo, temporario, compress_to_fp16=fp16)
+        os.replace(temporario[:-4] + ".bin", caminho_xml[:-4] + ".bin")
+        os.replace(temporario, caminho_xml)
+        log.info("Modelo %s convertido para OpenVINO IR em %s (%s).", caminho_onnx, caminho_xml,
+                 "fp16" if fp16 else "fp32")
+    if metadata is not None:
+        caminho_metadata = os.path.join(os.path.dirname(caminho_xml), "metadata.yaml")
+        if not os.path.exists(caminho_metadata):
+            with open(caminho_metadata, "w") as f:
+                yaml.safe_dump(metadata, f, sort_keys=False, allow_unicode=True)
+    return caminho_xml
+
+
+def metadata_onnx(caminho_onnx: str) -> Dict[str, str]:
+    """Metadados gravados no .onnx pelo exportador do Ultralytics (names, stride, task...)"""
+    import onnx
+
+    modelo = onnx.load(caminho_onnx, load_external_data=False)
+    return {prop.key: prop.value for prop in modelo.metadata_props}
+
+
+class _No:
+    """Descrição de entrada/saída no formato do onnxruntime (name, shape, type)"""
+
+    def __init__(self, name: str, shape: List, type: str):
+        self.name = name
+        self.shape = shape
+        self.type = type
+
+
+class SessaoOpenVINO:
+    """Modelo OpenVINO compilado com a interface de onnxruntime.InferenceSession"""
+
+    def __init__(self, caminho_modelo: str, threads: Optional[int] = None):
+        import openvino as ov
+
+        core = ov.Core()
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads:
+            config["INFERENCE_NUM_THREADS"] = threads
+        self._compilado = core.compile_model(caminho_modelo, "CPU", config)
+        # Um infer request por thread: o pipeline chama o rembg de várias threads
+        self._local = threading.local()
+        self._entradas = [
+            _No(porta.get_any_name(), list(porta.get_partial_shape()), self._tipo(porta))
+            for porta in self._compilado.inputs
+        ]
+        self._saidas = [
+            _No(porta.get_any_name(), list(porta.get_partial_shape()), self._tipo(porta))
+            for porta in self._compilado.outputs
+        ]
+
+    @staticmethod
+    def _tipo(porta) -> str:
+        # A IR em fp16 é comprimida só nos pesos; entradas e saídas continuam float32
+        return "tensor(float16)" if porta.get_element_type().get_type_name() == "f16" else "tensor(float)"
+
+    def get_inputs(self) -> List[_No]:
+        return self._entradas
+
+    def get_outputs(self) -> List[_No]:
+        return self._saidas
+
+    def run(self, nomes_saida: Optional[List[str]], entradas: Dict[str, np.ndarray]) -> List[np.ndarray]:
+        """Inferência síncrona; devolve as saídas na ordem pedida (todas se None)"""
+        request = getattr(self._local, "request", None)
+        if request is None:
+            request = self._local.request = self._compilado.create_infer_request()
+        resultado = request.infer(entradas)
+        saidas = [resultado[porta] for porta in self._compilado.outputs]
+        if nomes_saida is None:
+            return saidas
+        por_nome = {no.name: saida for no, saida in zip(self._saidas, saidas)}
+        return [por_nome[nome] for nome in nomes_saida]
+
+
+def names_ir(caminho_xml: str) -> Dict[int, str]:
+    """Classes do modelo a partir do metadata.yaml gravado ao lado da IR"""
+    with open(os.path.join(os.path.dirname(caminho_xml), "metadata.yaml")) as f:
+        names = yaml.safe_load(f)["names"]
+    if isinstance(names, str):
+        import ast
+        names = ast.literal_eval(names)
+    return {int(k): v for k, v in names.items()}
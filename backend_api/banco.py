@@ -0,0 +1,648 @@
+# backend_api/banco.py
+"""Histórico das análises por talhão (SQLite embutido)
+
+Cada análise de severidade de uma requisição com "talhao" vira uma linha em
+"analises" (talhão, levantamento, horário, severidade, doença detectada,
+versão do modelo e hash da imagem). Os levantamentos (uma ida ao campo; o
+cliente manda "levantamento", senão vale o dia) ficam também resumidos em
+"levantamentos" (n, soma, soma dos quadrados, máximo, folhas acima do
+limiar), atualizada na mesma transação de cada inserção: a tela de histórico
+lê só essa tabela, pelo índice (talhao, fim), e não depende de quantas
+análises existem.
+
+Média, percentis, série diária e tendência de um talhão saem de consultas
+SQL sobre o índice (talhao, criada_em). Fotos que o servidor marcou como
+a mesma folha de outra análise do mesmo talhão ("duplicata") ficam
+gravadas, mas não entram nas estatísticas.
+
+A curva de progresso da doença de cada talhão (média diária, AUDPC
+acumulada pela regra do trapézio e taxas de variação) é mantida de forma
+incremental: "progresso_diario" guarda n e soma por dia e "progresso" guarda
+a AUDPC até o penúltimo dia mais os dois últimos pontos, então cada nova
+análise só recalcula o último trapézio. Uma análise com data anterior ao
+último dia refaz a curva do talhão a partir dos totais diários.
+
+Análises de fotos com GPS no EXIF (ou com "lat"/"lon" na requisição) levam
+o ponto e o geohash (geo.py); GET /mapa agrega a severidade por célula do
+geohash dentro de uma caixa, pelo índice parcial em geohash.
+
+O arquivo fica em BANCO_ARQUIVO; no Cloud Run /tmp some com a instância,
+então em produção ele deve apontar para um volume montado (deploy_backend.sh
+com BANCO_NFS). Com o arquivo em /tmp, o app avisa no log ao iniciar.
+
+Em disco local o journal é WAL (leituras não esperam as gravações). O WAL
+usa memória compartilhada de uma máquina só e não funciona em sistema de
+arquivos de rede: num volume NFS (ou com BANCO_JOURNAL=DELETE) o journal é
+DELETE e as instâncias se revezam pelos locks de arquivo do NFS, uma
+gravação por vez em todo o serviço. Serve para o ritmo do histórico; para
+muitas gravações simultâneas o caminho é um banco gerenciado.
+
+Recalcular os totais diários e a curva a partir das análises (depois de
+atualizar um banco antigo ou corrigir linhas à mão):
+  python banco.py reconstruir [--talhao T1]
+"""
+import argparse
+import datetime
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from flask import jsonify, request
+
+import geo
+
+BANCO_ATIVO = os.environ.get("BANCO_ATIVO", "1") == "1"
+BANCO_ARQUIVO = os.environ.get("BANCO_ARQUIVO", "/tmp/cultivatrack.db")
+# Modo do journal: vazio escolhe sozinho (WAL em disco local, DELETE em sistema de arquivos de rede)
+BANCO_JOURNAL = os.environ.get("BANCO_JOURNAL", "").upper()
+JOURNAL_MODOS = ("WAL", "DELETE", "TRUNCATE")
+SISTEMAS_REDE = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "fuse.gcsfuse", "9p")
+BANCO_FUSO_HORAS = float(os.environ.get("BANCO_FUSO_HORAS", "-3"))  # Fuso dos dias da série diária (Brasília)
+LIMIAR_TRATAMENTO = 5.0  # Severidade (%) a partir da qual gerar_recomendacao indica fungicida
+PERCENTIS = (50, 75, 90)
+HISTORICO_MAX = 200  # Limite de linhas por página
+MAPA_MAX_CELULAS = int(os.environ.get("MAPA_MAX_CELULAS", "2048"))  # Células por resposta do /mapa
+MAPA_MAX_PREFIXOS = 16  # Intervalos do índice consultados por mapa
+
+log = logging.getLogger(__name__)
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS analises (
+    id INTEGER PRIMARY KEY,
+    talhao TEXT NOT NULL,
+    levantamento TEXT NOT NULL,
+    criada_em REAL NOT NULL,
+    severidade REAL,
+    doenca TEXT,
+    modelo TEXT,
+    imagem_hash TEXT,
+    endpoint TEXT,
+    analise_id TEXT,
+    duplicata_de TEXT,
+    contabilizada INTEGER NOT NULL,
+    lat REAL,
+    lon REAL,
+    geohash TEXT,
+    tirada_em REAL
+);
+CREATE INDEX IF NOT EXISTS idx_analises_talhao_tempo ON analises (talhao, criada_em);
+CREATE INDEX IF NOT EXISTS idx_analises_analise_id ON analises (analise_id);
+CREATE TABLE IF NOT EXISTS levantamentos (
+    talhao TEXT NOT NULL,
+    levantamento TEXT NOT NULL,
+    inicio REAL NOT NULL,
+    fim REAL NOT NULL,
+    n INTEGER NOT NULL,
+    soma REAL NOT NULL,
+    soma_quadrados REAL NOT NULL,
+    maximo REAL,
+    acima INTEGER NOT NULL,
+    PRIMARY KEY (talhao, levantamento)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_levantamentos_talhao_fim ON levantamentos (talhao, fim);
+CREATE TABLE IF NOT EXISTS progresso_diario (
+    talhao TEXT NOT NULL,
+    dia INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    soma REAL NOT NULL,
+    PRIMARY KEY (talhao, dia)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS progresso (
+    talhao TEXT PRIMARY KEY,
+    primeiro_dia INTEGER NOT NULL,
+    dias INTEGER NOT NULL,
+    penultimo_dia INTEGER,
+    penultima_media REAL,
+    ultimo_dia INTEGER NOT NULL,
+    ultima_media REAL NOT NULL,
+    audpc_base REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Colunas que bancos criados antes delas não têm (ALTER TABLE na abertura)
+COLUNAS_NOVAS = {"analises": [("lat", "REAL"), ("lon", "REAL"), ("geohash", "TEXT"), ("tirada_em", "REAL")]}
+INDICES_NOVOS = """
+CREATE INDEX IF NOT EXISTS idx_analises_geohash ON analises (geohash) WHERE geohash IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_analises_talhao_severidade ON analises (talhao, severidade, criada_em)
+    WHERE contabilizada = 1;
+"""
+
+_local = threading.local()
+_lock_esquema = threading.Lock()
+_esquema_criado = False
+
+
+def sistema_arquivos(caminho: str) -> str:
+    """Tipo do sistema de arquivos do caminho pelo ponto de montagem mais longo em /proc/mounts ("" se não der)"""
+    pasta = os.path.realpath(os.path.dirname(os.path.abspath(caminho)))
+    tipo, maior = "", -1
+    try:
+        with open("/proc/mounts") as f:
+            for linha in f:
+                partes = linha.split()
+                if len(partes) < 3:
+                    continue
+                ponto = partes[1].replace("\\040", " ")
+                if (pasta == ponto or pasta.startswith(ponto.rstrip("/") + "/")) and len(ponto) > maior:
+                    tipo, maior = partes[2], len(ponto)
+    except OSError:
+        pass
+    return tipo
+
+
+_modo_journal: Optional[str] = None
+
+
+def modo_journal() -> str:
+    """BANCO_JOURNAL, ou DELETE se o arquivo está num sistema de arquivos de rede, ou WAL"""
+    global _modo_journal
+    if _modo_journal is None:
+        if BANCO_JOURNAL in JOURNAL_MODOS:
+            _modo_journal = BANCO_JOURNAL
+        else:
+            if BANCO_JOURNAL:
+                log.warning("BANCO_JOURNAL=%s inválido (use %s); escolhendo pelo sistema de arquivos",
+                            BANCO_JOURNAL, "/".join(JOURNAL_MODOS))
+            _modo_journal = "DELETE" if sistema_arquivos(BANCO_ARQUIVO) in SISTEMAS_REDE else "WAL"
+    return _modo_journal
+
+
+def conexao() -> sqlite3.Connection:
+    """Conexão da thread atual (o sqlite3 não compartilha conexões entre threads)"""
+    global _esquema_criado
+    con = getattr(_local, "con", None)
+    if con is None:
+        con = sqlite3.connect(BANCO_ARQUIVO, timeout=5, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        modo = modo_journal()
+        con.execute(f"PRAGMA journal_mode={modo}")
+        # NORMAL só é seguro com WAL; no journal DELETE fica o padrão (FULL)
+        con.execute("PRAGMA synchronous=NORMAL" if modo == "WAL" else "PRAGMA synchronous=FULL")
+        with _lock_esquema:
+            if not _esquema_criado:
+                con.executescript(ESQUEMA)
+                _migrar(con)
+                _esquema_criado = True
+        _local.con = con
+    return con
+
+
+def _migrar(con: sqlite3.Connection) -> None:
+    for tabela, colunas in COLUNAS_NOVAS.items():
+        existentes = {linha[1] for linha in con.execute(f"PRAGMA table_info({tabela})")}
+        for nome, tipo in colunas:
+            if nome not in existentes:
+                con.execute(f"ALTER TABLE {tabela} ADD COLUMN {nome} {tipo}")
+    con.executescript(INDICES_NOVOS)
+
+
+def _indice_dia(instante: float) -> int:
+    """Dias desde 1970-01-01 no fuso BANCO_FUSO_HORAS"""
+    return int((instante + BANCO_FUSO_HORAS * 3600) // 86400)
+
+
+def _data(dia: int) -> str:
+    return (datetime.date(1970, 1, 1) + datetime.timedelta(days=dia)).isoformat()
+
+
+def _trapezio(dia_a: Optional[int], media_a: Optional[float], dia_b: int, media_b: float) -> float:
+    if dia_a is None:
+        return 0.0
+    return (media_a + media_b) / 2 * (dia_b - dia_a)
+
+
+def _curva_do_talhao(con: sqlite3.Connection, talhao: str) -> None:
+    """Refaz a linha de "progresso" do talhão a partir dos totais diários"""
+    con.execute("DELETE FROM progresso WHERE talhao = ?", (talhao,))
+    pontos = con.execute("SELECT dia, soma / n FROM progresso_diario WHERE talhao = ? ORDER BY dia",
+                         (talhao,)).fetchall()
+    if not pontos:
+        return
+    base = sum(_trapezio(*pontos[i - 1], *pontos[i]) for i in range(1, len(pontos) - 1))
+    penultimo = pontos[-2] if len(pontos) > 1 else (None, None)
+    con.execute("INSERT INTO progresso VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (talhao, pontos[0][0], len(pontos), *penultimo, *pontos[-1], base))
+
+
+def _atualizar_progresso(con: sqlite3.Connection, talhao: str, dia: int, severidade: float) -> None:
+    """Soma a análise ao total do dia e atualiza a curva (só o último trapézio muda)"""
+    n, soma = con.execute(
+        "INSERT INTO progresso_diario (talhao, dia, n, soma) VALUES (?, ?, 1, ?)"
+        " ON CONFLICT (talhao, dia) DO UPDATE SET n = n + 1, soma = soma + excluded.soma RETURNING n, soma",
+        (talhao, dia, severidade)).fetchone()
+    media = soma / n
+    atual = con.execute("SELECT * FROM progresso WHERE talhao = ?", (talhao,)).fetchone()
+    if atual is None:
+        con.execute("INSERT INTO progresso VALUES (?, ?, 1, NULL, NULL, ?, ?, 0)", (talhao, dia, dia, media))
+    elif dia == atual["ultimo_dia"]:
+        con.execute("UPDATE progresso SET ultima_media = ? WHERE talhao = ?", (media, talhao))
+    elif dia > atual["ultimo_dia"]:
+        # O trapézio entre o penúltimo e o último dia não muda mais: entra na base
+        base = atual["audpc_base"] + _trapezio(atual["penultimo_dia"], atual["penultima_media"],
+                                               atual["ultimo_dia"], atual["ultima_media"])
+        con.execute("UPDATE progresso SET dias = dias + 1, penultimo_dia = ultimo_dia,"
+                    " penultima_media = ultima_media, ultimo_dia = ?, ultima_media = ?, audpc_base = ?"
+                    " WHERE talhao = ?", (dia, media, base, talhao))
+    else:
+        # Dia anterior ao último (relógio ajustado, carga retroativa): refaz a curva inteira
+        _curva_do_talhao(con, talhao)
+
+
+def registrar(linhas: List[Dict]) -> int:
+    """Grava análises ({"talhao", "severidade", "doenca", "modelo", ...}) numa transação; retorna quantas
+
+    Linhas sem "levantamento" entram no levantamento do dia.
+    """
+    if not linhas:
+        return 0
+    agora = time.time()
+    con = conexao()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        for linha in linhas:
+            talhao = str(linha["talhao"])
+            levantamento = str(linha.get("levantamento") or f"dia-{_data(_indice_dia(agora))}")
+            severidade = linha.get("severidade")
+            duplicata_de = linha.get("duplicata_de")
+            # A mesma folha já analisada neste talhão não conta duas vezes
+            repetida = duplicata_de is not None and con.execute(
+                "SELECT 1 FROM analises WHERE analise_id = ? AND talhao = ? LIMIT 1",
+                (duplicata_de, talhao)).fetchone() is not None
+            contabilizada = severidade is not None and not repetida
+            lat, lon = linha.get("lat"), linha.get("lon")
+            tirada_em = _instante_seguro(linha.get("tirada_em"))
+            con.execute(
+                "INSERT INTO analises (talhao, levantamento, criada_em, severidade, doenca, modelo, imagem_hash,"
+                " endpoint, analise_id, duplicata_de, contabilizada, lat, lon, geohash, tirada_em)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (talhao, levantamento, agora, severidade, linha.get("doenca"), linha.get("modelo"),
+                 linha.get("imagem_hash"), linha.get("endpoint"), linha.get("analise_id"), duplicata_de,
+                 int(contabilizada), lat, lon, geo.geohash(lat, lon) if lat is not None else None, tirada_em))
+            if contabilizada:
+                con.execute(
+                    "INSERT INTO levantamentos (talhao, levantamento, inicio, fim, n, soma, soma_quadrados, maximo, acima)"
+                    " VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)"
+                    " ON CONFLICT (talhao, levantamento) DO UPDATE SET"
+                    " fim = excluded.fim, n = n + 1, soma = soma + excluded.soma,"
+                    " soma_quadrados = soma_quadrados + excluded.soma_quadrados,"
+                    " maximo = max(maximo, excluded.maximo), acima = acima + excluded.acima",
+                    (talhao, levantamento, agora, agora, severidade, severidade * severidade, severidade,
+                     int(severidade >= LIMIAR_TRATAMENTO)))
+                _atualizar_progresso(con, talhao, _indice_dia(agora), severidade)
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    return len(linhas)
+
+
+def registrar_seguro(linhas: List[Dict]) -> None:
+    """registrar() sem derrubar a análise: falha no banco só vai para o log"""
+    try:
+        registrar(linhas)
+    except Exception as e:
+        log.exception("Erro gravando análises no banco: %s", e)
+
+
+def _desvio(n: int, soma: float, soma_quadrados: float) -> Optional[float]:
+    if n < 2:
+        return None
+    return math.sqrt(max(0.0, (soma_quadrados - soma * soma / n) / (n - 1)))
+
+
+def _percentis(con: sqlite3.Connection, filtro: str, args: tuple, n: int) -> Dict[str, float]:
+    """Percentis pelo posto mais próximo: a linha de posição ceil(p·n) na ordem da severidade
+
+    Período com boa parte das análises do talhão (total pelos levantamentos):
+    uma única caminhada pelo índice (talhao, severidade, criada_em), sem
+    ordenar, cada percentil retomando da linha do anterior. Período curto:
+    as linhas dele saem do índice de tempo e só elas são ordenadas.
+    """
+    posicoes = [max(0, math.ceil(p / 100 * n) - 1) for p in PERCENTIS]
+    total = con.execute("SELECT COALESCE(SUM(n), 0) FROM levantamentos WHERE talhao = ?", (args[0],)).fetchone()[0]
+    if n * 10 < total:
+        return {f"p{p}": con.execute(
+            f"SELECT severidade FROM analises INDEXED BY idx_analises_talhao_tempo WHERE {filtro}"
+            f" ORDER BY severidade LIMIT 1 OFFSET ?", (*args, posicao)).fetchone()[0]
+            for p, posicao in zip(PERCENTIS, posicoes)}
+
+    percentis, linha, anterior = {}, None, -1
+    for p, posicao in zip(PERCENTIS, posicoes):
+        if posicao != anterior:
+            # Depois da linha do percentil anterior (a ordem do índice desempata por criada_em e id)
+            depois = "" if linha is None else " AND (severidade, criada_em, id) > (?, ?, ?)"
+            linha = con.execute(
+                f"SELECT severidade, criada_em, id FROM analises INDEXED BY idx_analises_talhao_severidade"
+                f" WHERE {filtro}{depois} ORDER BY severidade, criada_em, id LIMIT 1 OFFSET ?",
+                (*args, *(tuple(linha) if linha is not None else ()), posicao - anterior - 1)).fetchone()
+            anterior = posicao
+        percentis[f"p{p}"] = linha[0]
+    return percentis
+
+
+def resumo_talhao(talhao: str, desde: float = 0.0, ate: float = math.inf, dias_max: int = 90) -> Dict:
+    """Estatísticas das análises de um talhão no período: média, percentis, série diária e tendência"""
+    con = conexao()
+    filtro = "talhao = ? AND criada_em >= ? AND criada_em < ? AND contabilizada = 1"
+    args = (talhao, desde, ate if math.isfinite(ate) else 1e18)
+    linha = con.execute(
+        f"SELECT COUNT(*) AS n, AVG(severidade) AS media, MAX(severidade) AS maximo,"
+        f" SUM(severidade >= ?) AS acima, SUM(severidade * severidade) AS soma_quadrados,"
+        f" MIN(criada_em) AS inicio, MAX(criada_em) AS fim FROM analises WHERE {filtro}",
+        (LIMIAR_TRATAMENTO, *args)).fetchone()
+    n = linha["n"]
+    resumo = {"talhao": talhao, "n": n, "limiar": LIMIAR_TRATAMENTO}
+    if not n:
+        return resumo
+
+    percentis = _percentis(con, filtro, args, n)
+
+    # Série diária e tendência (mínimos quadrados das médias diárias, em pontos percentuais por dia)
+    fuso = BANCO_FUSO_HORAS * 3600
+    diaria = f"""SELECT CAST((criada_em + ?) / 86400 AS INTEGER) AS dia, AVG(severidade) AS media, COUNT(*) AS n
+                 FROM analises WHERE {filtro} GROUP BY dia"""
+    por_dia = con.execute(f"SELECT date(dia * 86400, 'unixepoch') AS data, media, n FROM ({diaria})"
+                          f" ORDER BY dia DESC LIMIT ?", (fuso, *args, dias_max)).fetchall()
+    k, sx, sy, sxx, sxy = con.execute(
+        f"SELECT COUNT(*), SUM(dia), SUM(media), SUM(dia * dia), SUM(dia * media) FROM ({diaria})",
+        (fuso, *args)).fetchone()
+    denominador = k * sxx - sx * sx if k else 0
+    tendencia = (k * sxy - sx * sy) / denominador if k >= 2 and denominador else None
+
+    resumo.update({
+        "media": round(linha["media"], 2),
+        "desvio": None if n < 2 else round(_desvio(n, linha["media"] * n, linha["soma_quadrados"]), 2),
+        "maximo": round(linha["maximo"], 2),
+        "fracao_acima_limiar": round(linha["acima"] / n, 4),
+        **{nome: round(valor, 2) for nome, valor in percentis.items()},
+        "tendencia_pp_dia": None if tendencia is None else round(tendencia, 3),
+        "por_dia": [{"data": d["data"], "media": round(d["media"], 2), "n": d["n"]} for d in reversed(por_dia)],
+        "inicio": linha["inicio"],
+        "fim": linha["fim"],
+    })
+    return resumo
+
+
+def reconstruir(talhao: Optional[str] = None) -> int:
+    """Recalcula totais diários e curvas de progresso a partir das análises; retorna quantos talhões"""
+    con = conexao()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        if talhao is None:
+            talhoes_ = [l[0] for l in con.execute("SELECT DISTINCT talhao FROM analises")]
+            con.execute("DELETE FROM progresso_diario")
+            con.execute("DELETE FROM progresso")
+        else:
+            talhoes_ = [talhao]
+            con.execute("DELETE FROM progresso_diario WHERE talhao = ?", (talhao,))
+        for t in talhoes_:
+            con.execute(
+                "INSERT INTO progresso_diario (talhao, dia, n, soma)"
+                " SELECT talhao, CAST((criada_em + ?) / 86400 AS INTEGER) AS dia, COUNT(*), SUM(severidade)"
+                " FROM analises WHERE talhao = ? AND contabilizada = 1 GROUP BY dia",
+                (BANCO_FUSO_HORAS * 3600, t))
+            _curva_do_talhao(con, t)
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    return len(talhoes_)
+
+
+def _logito(y: float) -> float:
+    return math.log(y / (1 - y))
+
+
+def progresso_talhao(talhao: str, dias_max: int = 365) -> Dict:
+    """Curva de progresso do talhão: AUDPC acumulada, taxas e a série diária (últimos dias_max dias)
+
+    Lê só a linha de "progresso" e os últimos dias de "progresso_diario".
+    """
+    con = conexao()
+    p = con.execute("SELECT * FROM progresso WHERE talhao = ?", (talhao,)).fetchone()
+    if p is None:
+        return {"talhao": talhao, "dias": 0}
+    audpc = p["audpc_base"] + _trapezio(p["penultimo_dia"], p["penultima_media"], p["ultimo_dia"], p["ultima_media"])
+    duracao = p["ultimo_dia"] - p["primeiro_dia"]
+    taxa = taxa_aparente = None
+    if p["penultimo_dia"] is not None:
+        intervalo = p["ultimo_dia"] - p["penultimo_dia"]
+        taxa = (p["ultima_media"] - p["penultima_media"]) / intervalo
+        # Taxa aparente de infecção de Vanderplank (logito da proporção doente por dia)
+        y0, y1 = p["penultima_media"] / 100, p["ultima_media"] / 100
+        if 0 < y0 < 1 and 0 < y1 < 1:
+            taxa_aparente = (_logito(y1) - _logito(y0)) / intervalo
+
+    # AUDPC acumulada em cada dia da série, de trás para a frente a partir do total
+    linhas = con.execute("SELECT dia, n, soma / n AS media FROM progresso_diario WHERE talhao = ?"
+                         " ORDER BY dia DESC LIMIT ?", (talhao, dias_max)).fetchall()
+    serie, acumulada = [], audpc
+    for i, l in enumerate(linhas):
+        serie.append({"data": _data(l["dia"]), "media": round(l["media"], 2), "n": l["n"],
+                      "audpc": round(max(0.0, acumulada), 2)})  # max: resíduo de ponto flutuante no 1º dia
+        if i + 1 < len(linhas):
+            acumulada -= _trapezio(linhas[i + 1]["dia"], linhas[i + 1]["media"], l["dia"], l["media"])
+    serie.reverse()
+
+    return {
+        "talhao": talhao,
+        "dias": p["dias"],
+        "inicio": _data(p["primeiro_dia"]),
+        "ultimo": _data(p["ultimo_dia"]),
+        "severidade_atual": round(p["ultima_media"], 2),
+        "audpc": round(audpc, 2),
+        # AUDPC dividida pela duração: severidade média ponderada no tempo, comparável entre talhões
+        "audpc_padronizada": round(audpc / duracao, 2) if duracao else None,
+        "taxa_pp_dia": None if taxa is None else round(taxa, 3),
+        "taxa_aparente_dia": None if taxa_aparente is None else round(taxa_aparente, 4),
+        "serie": serie,
+    }
+
+
+def mapa(lat_min: float, lon_min: float, lat_max: float, lon_max: float, precisao: Optional[int] = None,
+         talhao: Optional[str] = None, desde: float = 0.0, ate: float = math.inf) -> Dict:
+    """Severidade agregada por célula do geohash dentro da caixa, em arrays por coluna
+
+    Sem precisão, usa a maior com até MAPA_MAX_CELULAS células na caixa. A
+    caixa é coberta por até MAPA_MAX_PREFIXOS prefixos, e cada um vira um
+    intervalo do índice de geohash agrupado por célula.
+    """
+    if precisao is None:
+        precisao = geo.precisao_para_caixa(lat_min, lon_min, lat_max, lon_max, MAPA_MAX_CELULAS)
+    precisao = max(1, min(geo.GEO_PRECISAO, precisao))
+    precisao_prefixo = geo.precisao_para_caixa(lat_min, lon_min, lat_max, lon_max, MAPA_MAX_PREFIXOS, precisao)
+
+    filtro = ("geohash >= ? AND geohash < ? AND lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?"
+              " AND contabilizada = 1 AND criada_em >= ? AND criada_em < ?")
+    if talhao is not None:
+        filtro += " AND talhao = ?"
+    consulta = (f"SELECT substr(geohash, 1, ?) AS celula, COUNT(*), AVG(severidade), MAX(severidade),"
+                f" SUM(severidade >= ?) FROM analises WHERE {filtro} GROUP BY celula")
+    con = conexao()
+    linhas = []
+    for prefixo in sorted(set(geo.cobertura(lat_min, lon_min, lat_max, lon_max, precisao_prefixo))):
+        args = [precisao, LIMIAR_TRATAMENTO, prefixo, prefixo + geo.FIM_PREFIXO, lat_min, lat_max, lon_min, lon_max,
+                desde, ate if math.isfinite(ate) else 1e18]
+        if talhao is not None:
+            args.append(talhao)
+        linhas.extend(con.execute(consulta, args).fetchall())
+    celulas = geo.agregar_celulas(linhas)
+    return {"precisao": precisao, "celula_graus": geo.tamanho_celula(precisao), "limiar": LIMIAR_TRATAMENTO,
+            "n": sum(celulas["n"]), "celulas": celulas}
+
+
+def levantamentos(talhao: str, limite: int = 20, antes: Optional[float] = None) -> List[Dict]:
+    """Levantamentos mais recentes do talhão (paginação por "fim", sem OFFSET)"""
+    linhas = conexao().execute(
+        "SELECT * FROM levantamentos WHERE talhao = ? AND fim < ? ORDER BY fim DESC LIMIT ?",
+        (talhao, antes if antes is not None else 1e18, limite)).fetchall()
+    return [{
+        "levantamento": l["levantamento"],
+        "inicio": l["inicio"],
+        "fim": l["fim"],
+        "n": l["n"],
+        "media": round(l["soma"] / l["n"], 2),
+        "desvio": None if l["n"] < 2 else round(_desvio(l["n"], l["soma"], l["soma_quadrados"]), 2),
+        "maximo": round(l["maximo"], 2),
+        "fracao_acima_limiar": round(l["acima"] / l["n"], 4),
+    } for l in linhas]
+
+
+def analises(talhao: str, limite: int = 50, antes: Optional[float] = None) -> List[Dict]:
+    """Análises mais recentes do talhão, uma linha por foto (paginação por "criada_em")"""
+    linhas = conexao().execute(
+        "SELECT criada_em, levantamento, severidade, doenca, modelo, imagem_hash, endpoint, analise_id,"
+        " duplicata_de, contabilizada, lat, lon, tirada_em FROM analises WHERE talhao = ? AND criada_em < ?"
+        " ORDER BY criada_em DESC LIMIT ?",
+        (talhao, antes if antes is not None else 1e18, limite)).fetchall()
+    return [{**dict(l), "contabilizada": bool(l["contabilizada"])} for l in linhas]
+
+
+def talhoes() -> List[Dict]:
+    """Talhões com histórico, do levantamento mais recente para o mais antigo"""
+    linhas = conexao().execute(
+        "SELECT talhao, COUNT(*) AS levantamentos, SUM(n) AS n, SUM(soma) AS soma, MAX(fim) AS ultimo"
+        " FROM levantamentos GROUP BY talhao ORDER BY ultimo DESC").fetchall()
+    return [{"talhao": l["talhao"], "levantamentos": l["levantamentos"], "n": l["n"],
+             "media": round(l["soma"] / l["n"], 2), "ultimo": l["ultimo"]} for l in linhas]
+
+
+def _instante(valor: Optional[str]) -> Optional[float]:
+    """Parâmetro de tempo da query string: segundos Unix ou data/hora ISO (no fuso BANCO_FUSO_HORAS)"""
+    if valor is None or valor == "":
+        return None
+    try:
+        return float(valor)
+    except ValueError:
+        instante = datetime.datetime.fromisoformat(valor)
+        if instante.tzinfo is None:
+            instante = instante.replace(tzinfo=datetime.timezone(datetime.timedelta(hours=BANCO_FUSO_HORAS)))
+        return instante.timestamp()
+
+
+def _instante_seguro(valor) -> Optional[float]:
+    try:
+        return _instante(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def volatil() -> bool:
+    """O arquivo do banco está em /tmp (no Cloud Run, memória da instância)"""
+    return os.path.abspath(BANCO_ARQUIVO).startswith("/tmp/")
+
+
+def registrar_rotas(app) -> None:
+    """Adiciona GET /mapa, /talhoes, /talhoes/<talhao>/resumo, /progresso, /levantamentos e /analises ao app Flask"""
+    if not BANCO_ATIVO:
+        return
+    if volatil():
+        log.warning("Histórico dos talhões em %s: o arquivo some quando a instância para e não é "
+                    "compartilhado entre instâncias; aponte BANCO_ARQUIVO para um volume montado", BANCO_ARQUIVO)
+    elif modo_journal() != "WAL":
+        log.info("Histórico dos talhões em %s com journal %s: uma gravação por vez entre as instâncias",
+                 BANCO_ARQUIVO, modo_journal())
+
+    def _limite(padrao: int) -> int:
+        return max(1, min(HISTORICO_MAX, request.args.get("limite", padrao, type=int)))
+
+    @app.route("/talhoes", methods=["GET"])
+    def listar_talhoes():
+        return jsonify({"talhoes": talhoes()})
+
+    @app.route("/mapa", methods=["GET"])
+    def mapa_endpoint():
+        """?bbox=lat_min,lon_min,lat_max,lon_max[&precisao=7&talhao=T1&desde=...&ate=...]"""
+        try:
+            lat_min, lon_min, lat_max, lon_max = (float(x) for x in request.args.get("bbox", "").split(","))
+            desde = _instante(request.args.get("desde"))
+            ate = _instante(request.args.get("ate"))
+        except ValueError:
+            return jsonify({"error": "bbox deve ser lat_min,lon_min,lat_max,lon_max (e desde/ate datas válidas)"}), 400
+        if not (-90 <= lat_min < lat_max <= 90 and -180 <= lon_min < lon_max <= 180):
+            return jsonify({"error": "bbox fora dos limites ou invertida"}), 400
+        return jsonify(mapa(lat_min, lon_min, lat_max, lon_max, request.args.get("precisao", type=int),
+                            request.args.get("talhao"), desde or 0.0, ate if ate is not None else math.inf))
+
+    @app.route("/talhoes/<talhao>/resumo", methods=["GET"])
+    def resumo_endpoint(talhao):
+        """?desde=2026-09-01&ate=2026-10-01 (opcionais)"""
+        try:
+            desde = _instante(request.args.get("desde"))
+            ate = _instante(request.args.get("ate"))
+        except ValueError:
+            return jsonify({"error": "desde/ate devem ser segundos Unix ou datas ISO"}), 400
+        return jsonify(resumo_talhao(talhao, desde or 0.0, ate if ate is not None else math.inf))
+
+    @app.route("/talhoes/<talhao>/progresso", methods=["GET"])
+    def progresso_endpoint(talhao):
+        """Curva de progresso da doença (AUDPC); ?dias=365 limita a série diária"""
+        dias = max(1, min(3650, request.args.get("dias", 365, type=int)))
+        return jsonify(progresso_talhao(talhao, dias))
+
+    @app.route("/talhoes/<talhao>/levantamentos", methods=["GET"])
+    def levantamentos_endpoint(talhao):
+        """?limite=20&antes=<fim do último da página anterior>"""
+        itens = levantamentos(talhao, _limite(20), request.args.get("antes", type=float))
+        return jsonify({"levantamentos": itens, "proximo": itens[-1]["fim"] if itens else None})
+
+    @app.route("/talhoes/<talhao>/analises", methods=["GET"])
+    def analises_endpoint(talhao):
+        """?limite=50&antes=<criada_em da última da página anterior>"""
+        itens = analises(talhao, _limite(50), request.args.get("antes", type=float))
+        return jsonify({"analises": itens, "proximo": itens[-1]["criada_em"] if itens else None})
+
+
+def resumo() -> Dict:
+    """Estado do banco para GET /config"""
+    if not BANCO_ATIVO:
+        return {"ativo": False}
+    try:
+        con = conexao()
+        # MAX(id) em vez de COUNT(*): não percorre a tabela
+        n = con.execute("SELECT COALESCE(MAX(id), 0) FROM analises").fetchone()[0]
+        return {"ativo": True, "arquivo": BANCO_ARQUIVO, "volatil": volatil(), "journal": modo_journal(),
+                "analises": n}
+    except sqlite3.Error as e:
+        return {"ativo": True, "arquivo": BANCO_ARQUIVO, "erro": str(e)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manutenção do histórico de análises (SQLite)")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_reconstruir = sub.add_parser("reconstruir", help="Recalcula totais diários e curvas de progresso (AUDPC)")
+    p_reconstruir.add_argument("--talhao", help="Só este talhão (padrão: todos)")
+    args = parser.parse_args()
+
+    if args.comando == "reconstruir":
+        inicio = time.perf_counter()
+        n = reconstruir(args.talhao)
+        print(f"{n} talhão(ões) reconstruído(s) em {time.perf_counter() - inicio:.2f}s ({BANCO_ARQUIVO})")
+
+
+if __name__ == "__main__":
+    main()
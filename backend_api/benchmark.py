@@ -0,0 +1,705 @@
+#!/usr/bin/env python3
+"""
+Benchmarks locais do pipeline de análise (rodar dentro de backend_api/, com os modelos)
+Uso: python benchmark.py <comando> [opções]
+
+Comandos:
+  cascata   Mede o custo economizado pela cascata detecção -> segmentação
+  roi       Compara segmentação da imagem inteira (640 e 1024) com recortes ROI
+  perfis    Tabela de latência e erro de severidade de cada perfil (fast/balanced/accurate)
+  direto    Inferência direta (sem predictor) vs model.predict(): latência e paridade
+  pipeline  Vazão de um lote: imagens uma a uma vs pipeline em estágios
+  backends  Latência em CPU e paridade de PyTorch, ONNX Runtime e OpenVINO
+  boot      Relatório de -X importtime do app e tempo de aquecimento dos modelos
+  codificacao  Tamanho e tempo de serialização das respostas: JSON vs MessagePack vs CBOR
+"""
+
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+import uuid
+from typing import Dict, List
+
+EXTENSOES = ("*.jpg", "*.jpeg", "*.png")
+
+# Os benchmarks carregam os modelos por conta própria: sem aquecimento em segundo plano
+os.environ.setdefault("AQUECER", "0")
+os.environ.setdefault("LOG_FORMATO", "texto")
+
+
+def listar_imagens(pasta: str) -> List[str]:
+    """Lista as imagens de uma pasta (não recursivo)"""
+    arquivos = []
+    for ext in EXTENSOES:
+        arquivos.extend(glob.glob(os.path.join(pasta, ext)))
+        arquivos.extend(glob.glob(os.path.join(pasta, ext.upper())))
+    return sorted(set(arquivos))
+
+
+def montar_amostra(saudaveis: List[str], doentes: List[str], n: int, fracao_saudaveis: float,
+                   seed: int) -> List[Dict]:
+    """Sorteia uma mistura de folhas sadias e doentes na proporção pedida"""
+    rng = random.Random(seed)
+    n_saudaveis = round(n * fracao_saudaveis)
+    amostra = [{"path": rng.choice(saudaveis), "doente": False} for _ in range(n_saudaveis)]
+    amostra += [{"path": rng.choice(doentes), "doente": True} for _ in range(n - n_saudaveis)]
+    rng.shuffle(amostra)
+    return amostra
+
+
+def _caminhos_temporarios(app) -> Dict[str, str]:
+    nome = f"bench_{uuid.uuid4()}.jpg"
+    return {
+        "output_path": os.path.join(app.OUTPUT_FOLDER, nome),
+        "plot_path": os.path.join(app.PLOTS_FOLDER, nome),
+    }
+
+
+def _limpar(caminhos: Dict[str, str]) -> None:
+    for caminho in caminhos.values():
+        if os.path.exists(caminho):
+            os.remove(caminho)
+
+
+def bench_cascata(args) -> None:
+    """Compara o fluxo completo com a cascata numa mistura realista de folhas"""
+    import app
+
+    if not app.deteccao_disponivel():
+        print("❌ Modelo de detecção não carregado; a cascata não tem efeito")
+        sys.exit(1)
+
+    saudaveis = listar_imagens(args.saudaveis)
+    doentes = listar_imagens(args.doentes)
+    if not saudaveis or not doentes:
+        print("❌ É preciso ao menos uma imagem em cada pasta (--saudaveis e --doentes)")
+        sys.exit(1)
+
+    amostra = montar_amostra(saudaveis, doentes, args.n, args.fracao_saudaveis, args.seed)
+
+    # Aquecimento para não contar o setup do predictor na primeira medição
+    caminhos = _caminhos_temporarios(app)
+    app.analisar_severidade(amostra[0]["path"], cascata=True, cascata_conf=args.conf, **caminhos)
+    _limpar(caminhos)
+
+    tempo_completo = 0.0
+    tempo_cascata = 0.0
+    gated_saudaveis = 0
+    gated_doentes = 0
+    erro_abs = []
+
+    for item in amostra:
+        caminhos = _caminhos_temporarios(app)
+        inicio = time.perf_counter()
+        completo = app.analisar_severidade(item["path"], cascata=False, **caminhos)
+        tempo_completo += time.perf_counter() - inicio
+        _limpar(caminhos)
+
+        caminhos = _caminhos_temporarios(app)
+        inicio = time.perf_counter()
+        cascata = app.analisar_severidade(item["path"], cascata=True, cascata_conf=args.conf, **caminhos)
+        tempo_cascata += time.perf_counter() - inicio
+        _limpar(caminhos)
+
+        if cascata["gated"]:
+            if item["doente"]:
+                gated_doentes += 1
+            else:
+                gated_saudaveis += 1
+        erro_abs.append(abs(completo["severity"] - cascata["severity"]))
+
+    n_saudaveis = sum(1 for item in amostra if not item["doente"])
+    n_doentes = len(amostra) - n_saudaveis
+    economia = 1 - tempo_cascata / tempo_completo if tempo_completo > 0 else 0.0
+
+    print(f"\nAmostra: {len(amostra)} folhas ({n_saudaveis} sadias, {n_doentes} doentes), limiar {args.conf:.2f}")
+    print("| Modo      | Tempo total (s) | ms/folha |")
+    print("|-----------|-----------------|----------|")
+    print(f"| Completo  | {tempo_completo:15.2f} | {1000 * tempo_completo / len(amostra):8.1f} |")
+    print(f"| Cascata   | {tempo_cascata:15.2f} | {1000 * tempo_cascata / len(amostra):8.1f} |")
+    print(f"\nEconomia de processamento: {economia:.1%}")
+    print(f"Sadias puladas (gated): {gated_saudaveis}/{n_saudaveis}")
+    print(f"Doentes puladas por engano: {gated_doentes}/{n_doentes}")
+    print(f"Erro absoluto médio de severidade: {sum(erro_abs) / len(erro_abs):.2f} p.p.")
+
+
+def bench_roi(args) -> None:
+    """Compara o estágio de segmentação: imagem inteira 640, imagem inteira 1024 e ROI"""
+    import cv2
+    import numpy as np
+    import app
+
+    if not app.deteccao_disponivel():
+        print("❌ Modelo de detecção não carregado; o modo ROI depende dele")
+        sys.exit(1)
+
+    imagens = listar_imagens(args.imagens)
+    if not imagens:
+        print(f"❌ Nenhuma imagem em {args.imagens}")
+        sys.exit(1)
+
+    tempos = {"640": 0.0, "1024": 0.0, "roi": 0.0}
+    pixels = {"640": 0, "1024": 0, "roi": 0}
+    usadas = 0
+    n_recortes = 0
+
+    for path in imagens:
+        nome = f"bench_{uuid.uuid4()}.jpg"
+        detection_path = os.path.join(app.OUTPUT_FOLDER, f"det_{nome}")
+        output_path = os.path.join(app.OUTPUT_FOLDER, nome)
+        intermediate_path = os.path.join(app.OUTPUT_FOLDER, f"roi_{nome}")
+        try:
+            app.preprocess_image_detection(path, detection_path)
+            deteccao = app.detect_disease(detection_path)
+            geometria = app.preprocess_image(path, output_path, intermediate_path)
+            caixas = app.mapear_caixas_roi(deteccao["detections"], geometria) if geometria else []
+            if not caixas:
+                continue
+            img = cv2.imread(output_path)
+            img_inter = cv2.imread(intermediate_path)
+
+            inicio = time.perf_counter()
+            mascara = app._mascara_lesoes(img)
+            tempos["640"] += time.perf_counter() - inicio
+            pixels["640"] += int(np.sum(mascara == 255))
+
+            inicio = time.perf_counter()
+            results = app.obter_modelo_segmentacao(app.obter_perfil()).predict(img_inter, conf=0.6, imgsz=img_inter.shape[0], retina_masks=True)
+            tempos["1024"] += time.perf_counter() - inicio
+            if results[0].masks is not None:
+                mascara = (results[0].masks.data.cpu().numpy().sum(axis=0) > 0).astype(np.float32)
+                mascara = cv2.resize(mascara, app.TARGET_SIZE, interpolation=cv2.INTER_LINEAR)
+                pixels["1024"] += int(np.sum(mascara >= 0.5))
+
+            inicio = time.perf_counter()
+            mascara = app._mascara_lesoes_roi(img, intermediate_path, caixas)
+            tempos["roi"] += time.perf_counter() - inicio
+            pixels["roi"] += int(np.sum(mascara == 255))
+
+            usadas += 1
+            n_recortes += len(caixas)
+        finally:
+            for caminho in (detection_path, output_path, intermediate_path):
+                if os.path.exists(caminho):
+                    os.remove(caminho)
+
+    if usadas == 0:
+        print("❌ Nenhuma imagem com detecções localizadas (ROI cairia para a imagem inteira)")
+        sys.exit(1)
+
+    print(f"\nImagens com ROI: {usadas}/{len(imagens)} ({n_recortes / usadas:.1f} recortes por imagem, {app.ROI_IMGSZ}px)")
+    print("| Segmentação         | ms/imagem | Pixels de lesão (640) |")
+    print("|---------------------|-----------|-----------------------|")
+    for chave, nome in (("640", "Imagem inteira 640"), ("1024", "Imagem inteira 1024"), ("roi", "Recortes ROI")):
+        print(f"| {nome:<19} | {1000 * tempos[chave] / usadas:9.1f} | {pixels[chave] // usadas:21d} |")
+
+
+def _ler_referencia(caminho: str) -> Dict[str, float]:
+    """Lê um CSV arquivo,severidade com a severidade de referência de cada imagem"""
+    import csv
+
+    with open(caminho, newline="") as f:
+        return {os.path.basename(linha["arquivo"]): float(linha["severidade"]) for linha in csv.DictReader(f)}
+
+
+def bench_perfis(args) -> None:
+    """Latência (média e p95) e erro de severidade de cada perfil"""
+    import numpy as np
+    import app
+
+    imagens = listar_imagens(args.imagens)
+    if not imagens:
+        print(f"❌ Nenhuma imagem em {args.imagens}")
+        sys.exit(1)
+
+    # Sem CSV de referência, o perfil "accurate" serve de referência
+    referencia = _ler_referencia(args.referencia) if args.referencia else None
+    nomes = ["accurate"] + [nome for nome in app.PERFIS if nome != "accurate"]
+
+    resultados = {}
+    for nome in nomes:
+        perfil = app.obter_perfil(nome)
+        caminhos = _caminhos_temporarios(app)
+        app.analisar_severidade(imagens[0], perfil=perfil, **caminhos)  # Aquecimento e conversão de modelos
+        _limpar(caminhos)
+
+        tempos, severidades = [], {}
+        for path in imagens:
+            caminhos = _caminhos_temporarios(app)
+            inicio = time.perf_counter()
+            analise = app.analisar_severidade(path, perfil=perfil, **caminhos)
+            tempos.append(time.perf_counter() - inicio)
+            _limpar(caminhos)
+            severidades[os.path.basename(path)] = analise["severity"]
+        resultados[nome] = {"tempos": tempos, "severidades": severidades}
+
+    if referencia is None:
+        referencia = resultados["accurate"]["severidades"]
+
+    print(f"\n{len(imagens)} imagens; erro medido contra "
+          f"{'o CSV de referência' if args.referencia else 'o perfil accurate'}")
+    print("| Perfil    | Backend | Tamanho | ms médio | ms p95  | Erro abs. médio (p.p.) |")
+    print("|-----------|---------|---------|----------|---------|------------------------|")
+    for nome in app.PERFIS:
+        perfil = app.PERFIS[nome]
+        tempos = np.array(resultados[nome]["tempos"]) * 1000
+        erros = [abs(sev - referencia[arq]) for arq, sev in resultados[nome]["severidades"].items() if arq in referencia]
+        erro = f"{np.mean(erros):.2f}" if erros else "-"
+        print(f"| {nome:<9} | {perfil['backend']:<7} | {perfil['target_size'][0]:7d} | "
+              f"{tempos.mean():8.1f} | {np.percentile(tempos, 95):7.1f} | {erro:>22} |")
+
+
+def _mascara_predict(modelo, img, conf: float):
+    import numpy as np
+
+    result = modelo.predict(img, conf=conf, imgsz=img.shape[0], verbose=False)[0]
+    if result.masks is None:
+        return np.zeros(img.shape[:2], dtype=bool)
+    return result.masks.data.cpu().numpy().any(axis=0)
+
+
+def bench_direto(args) -> None:
+    """Compara latência e saídas do caminho direto com model.predict()"""
+    import cv2
+    import numpy as np
+    import app
+
+    imagens = listar_imagens(args.imagens)
+    if not imagens:
+        print(f"❌ Nenhuma imagem em {args.imagens}")
+        sys.exit(1)
+
+    perfil = app.obter_perfil(args.perfil)
+    tamanho_seg = perfil["target_size"]
+    tamanho_det = perfil["detection_size"]
+    seg = app.obter_modelo_segmentacao(perfil)
+    seg_direto = app.obter_modelo_segmentacao(perfil, direto=True)
+    det = app.obter_modelo_deteccao(perfil)
+    det_direto = app.obter_modelo_deteccao(perfil, direto=True)
+
+    tempos = {"seg_predict": [], "seg_direto": [], "det_predict": [], "det_direto": []}
+    ious, dif_caixas, dif_conf, contagens_iguais = [], [], [], 0
+
+    for path in imagens:
+        original = cv2.imread(path)
+        img_seg = cv2.resize(original, tamanho_seg, interpolation=cv2.INTER_AREA)
+        img_det = cv2.resize(original, tamanho_det, interpolation=cv2.INTER_CUBIC)
+
+        for _ in range(args.repeticoes):
+            inicio = time.perf_counter()
+            mascara_ref = _mascara_predict(seg, img_seg, args.conf)
+            tempos["seg_predict"].append(time.perf_counter() - inicio)
+
+            inicio = time.perf_counter()
+            mascara = seg_direto(img_seg, conf=args.conf)[0]["masks"].any(axis=0)
+            tempos["seg_direto"].append(time.perf_counter() - inicio)
+
+        uniao = np.logical_or(mascara_ref, mascara).sum()
+        ious.append(np.logical_and(mascara_ref, mascara).sum() / uniao if uniao else 1.0)
+
+        if det is None:
+            continue
+        for _ in range(args.repeticoes):
+            inicio = time.perf_counter()
+            ref = det.predict(img_det, conf=args.conf, imgsz=tamanho_det[0], verbose=False)[0].boxes
+            tempos["det_predict"].append(time.perf_counter() - inicio)
+
+            inicio = time.perf_counter()
+            saida = det_direto(img_det, conf=args.conf)[0]
+            tempos["det_direto"].append(time.perf_counter() - inicio)
+
+        caixas_ref = ref.xyxy.cpu().numpy()
+        if len(caixas_ref) == len(saida["boxes"]):
+            contagens_iguais += 1
+            if len(caixas_ref):
+                # Pareia cada caixa de referência com a mais próxima (empates de confiança mudam a ordem)
+                distancias = np.abs(caixas_ref[:, None, :] - saida["boxes"][None, :, :]).max(axis=2)
+                par = distancias.argmin(axis=1)
+                dif_caixas.append(distancias.min(axis=1).max())
+                dif_conf.append(np.abs(ref.conf.cpu().numpy() - saida["scores"][par]).max())
+
+    print(f"\n{len(imagens)} imagens x {args.repeticoes} repetições, perfil {perfil['nome']} ({perfil['backend']})")
+    print("| Estágio              | predict() ms | direto ms | Aceleração |")
+    print("|----------------------|--------------|-----------|------------|")
+    for estagio, nome in (("seg", f"Segmentação {tamanho_seg[0]}"), ("det", f"Detecção {tamanho_det[0]}")):
+        if not tempos[f"{estagio}_predict"]:
+            continue
+        ref_ms = 1000 * np.median(tempos[f"{estagio}_predict"])
+        dir_ms = 1000 * np.median(tempos[f"{estagio}_direto"])
+        print(f"| {nome:<20} | {ref_ms:12.1f} | {dir_ms:9.1f} | {ref_ms / dir_ms:9.2f}x |")
+
+    print(f"\nParidade: IoU médio da máscara de lesões {np.mean(ious):.4f} (mín {np.min(ious):.4f})")
+    if det is not None:
+        print(f"Paridade: mesmo número de detecções em {contagens_iguais}/{len(imagens)} imagens")
+        if dif_caixas:
+            print(f"Paridade: maior diferença de caixa {max(dif_caixas):.3f}px, de confiança {max(dif_conf):.5f}")
+
+
+def bench_pipeline(args) -> None:
+    """Vazão (imagens/s) do lote sequencial vs pipeline em estágios, e ocupação de cada estágio"""
+    import base64
+    import app
+    from pipeline import parse_workers
+
+    imagens = listar_imagens(args.imagens)
+    if not imagens:
+        print(f"❌ Nenhuma imagem em {args.imagens}")
+        sys.exit(1)
+    lote = [imagens[i % len(imagens)] for i in range(args.n)]
+    perfil = app.obter_perfil(args.perfil)
+    workers = parse_workers(args.workers, app.PIPELINE_WORKERS)
+
+    caminhos = _caminhos_temporarios(app)
+    app.analisar_severidade(lote[0], perfil=perfil, **caminhos)  # Aquecimento
+    _limpar(caminhos)
+
+    inicio = time.perf_counter()
+    sequencial = []
+    for path in lote:
+        caminhos = _caminhos_temporarios(app)
+        sequencial.append(app.analisar_severidade(path, perfil=perfil, **caminhos)["severity"])
+        _limpar(caminhos)
+    t_sequencial = time.perf_counter() - inicio
+
+    entradas = []
+    for path in lote:
+        with open(path, "rb") as f:
+            entradas.append({"file": base64.b64encode(f.read()).decode("utf-8")})
+    pipeline = app.criar_pipeline_severidade(perfil=perfil, workers=workers, tamanho_fila=args.fila)
+    inicio = time.perf_counter()
+    itens = pipeline.executar(entradas)
+    t_pipeline = time.perf_counter() - inicio
+
+    erros = [item["erro"] for item in itens if item["erro"]]
+    diferenca = max((abs(item["dados"]["resposta"]["severity"] - round(sev, 2))
+                     for item, sev in zip(itens, sequencial) if not item["erro"]), default=0.0)
+
+    print(f"\n{len(lote)} imagens, perfil {perfil['nome']}, {os.cpu_count()} CPUs, fila {args.fila}")
+    print(f"Workers: {', '.join(f'{nome}={n}' for nome, n in workers.items())}")
+    print("| Modo       | Tempo total (s) | Imagens/s |")
+    print("|------------|-----------------|-----------|")
+    print(f"| Sequencial | {t_sequencial:15.2f} | {len(lote) / t_sequencial:9.2f} |")
+    print(f"| Pipeline   | {t_pipeline:15.2f} | {len(lote) / t_pipeline:9.2f} |")
+    print(f"Ganho de vazão: {t_sequencial / t_pipeline:.2f}x")
+    print("\nOcupação por estágio (tempo somado das threads / tempo total do pipeline):")
+    for nome, ocupado in pipeline.ocupacao().items():
+        print(f"  {nome:<13} {ocupado:7.2f}s  {ocupado / t_pipeline * 100:5.1f}%")
+    print(f"Maior diferença de severidade vs sequencial: {diferenca:.2f} p.p.")
+    if erros:
+        print(f"❌ {len(erros)} imagens com erro no pipeline: {erros[0]}")
+
+
+def bench_backends(args) -> None:
+    """Latência por backend e paridade de severidade/detecção contra o PyTorch"""
+    import cv2
+    import numpy as np
+    from PIL import Image
+    from rembg import remove
+    import app
+
+    imagens = listar_imagens(args.imagens)
+    if not imagens:
+        print(f"❌ Nenhuma imagem em {args.imagens}")
+        sys.exit(1)
+
+    resultados = {}
+    for backend in args.backends.split(","):
+        try:
+            perfil = app.obter_perfil(args.perfil, backend=backend)
+            caminhos = _caminhos_temporarios(app)
+            app.analisar_severidade(imagens[0], perfil=perfil, **caminhos)  # Aquecimento e conversão
+            _limpar(caminhos)
+        except Exception as e:
+            print(f"❌ Backend {backend} indisponível: {e}")
+            continue
+
+        t_sev, t_det, t_rembg, severidades, deteccoes = [], [], [], [], []
+        for path in imagens:
+            caminhos = _caminhos_temporarios(app)
+            inicio = time.perf_counter()
+            severidades.append(app.analisar_severidade(path, perfil=perfil, **caminhos)["severity"])
+            t_sev.append(time.perf_counter() - inicio)
+            _limpar(caminhos)
+
+            if app.deteccao_disponivel():
+                img = cv2.resize(cv2.imread(path), perfil["detection_size"], interpolation=cv2.INTER_AREA)
+                inicio = time.perf_counter()
+                deteccoes.append(app.detect_disease(img, conf=args.conf, perfil=perfil))
+                t_det.append(time.perf_counter() - inicio)
+
+            img_rgb = cv2.cvtColor(cv2.resize(cv2.imread(path), (perfil["intermediate_size"],) * 2), cv2.COLOR_BGR2RGB)
+            sessao = app.obter_sessao_rembg(perfil)
+            inicio = time.perf_counter()
+            remove(Image.fromarray(img_rgb), session=sessao)
+            t_rembg.append(time.perf_counter() - inicio)
+        resultados[backend] = {"sev": t_sev, "det": t_det, "rembg": t_rembg,
+                               "severidades": severidades, "deteccoes": deteccoes}
+
+    if not resultados:
+        sys.exit(1)
+    referencia = resultados.get("pytorch")
+    ms = lambda tempos: f"{np.median(tempos) * 1000:8.1f}" if tempos else "       -"
+
+    print(f"\n{len(imagens)} imagens, perfil {app.obter_perfil(args.perfil)['nome']}, mediana em ms; "
+          f"paridade contra o PyTorch")
+    print("| Backend  | Severidade | Detecção | rembg    | Δ sev. máx (p.p.) | Δ conf. máx | Detecções iguais |")
+    print("|----------|------------|----------|----------|-------------------|-------------|------------------|")
+    for backend, r in resultados.items():
+        d_sev = d_conf = "-"
+        iguais = "-"
+        if referencia is not None and backend != "pytorch":
+            d_sev = f"{max(abs(a - b) for a, b in zip(r['severidades'], referencia['severidades'])):.3f}"
+            if r["deteccoes"]:
+                d_conf = f"{max(abs(a['confidence'] - b['confidence']) for a, b in zip(r['deteccoes'], referencia['deteccoes'])):.4f}"
+                n_iguais = sum(len(a["detections"]) == len(b["detections"]) and a["disease"] == b["disease"]
+                               for a, b in zip(r["deteccoes"], referencia["deteccoes"]))
+                iguais = f"{n_iguais}/{len(imagens)}"
+        print(f"| {backend:<8} | {ms(r['sev']):>10} | {ms(r['det'])} | {ms(r['rembg'])} | "
+              f"{d_sev:>17} | {d_conf:>11} | {iguais:>16} |")
+
+
+# Bibliotecas pesadas que não deveriam ser importadas junto com o app
+MODULOS_PESADOS = ("torch", "torchvision", "ultralytics", "rembg", "matplotlib", "pandas", "seaborn",
+                   "scipy", "onnxruntime", "openvino", "pymatting", "numba")
+
+
+def _ler_importtime(saida: str) -> List[Dict]:
+    """Converte a saída de -X importtime em registros (módulo, nível, próprio e acumulado em ms)"""
+    import re
+
+    registros = []
+    for linha in saida.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$", linha)
+        if m:
+            registros.append({"modulo": m.group(4), "nivel": (len(m.group(3)) - 1) // 2,
+                              "proprio_ms": int(m.group(1)) / 1000, "acumulado_ms": int(m.group(2)) / 1000})
+    return registros
+
+
+def bench_boot(args) -> None:
+    """Orçamento de import do app (-X importtime) e tempo até os modelos ficarem prontos"""
+    import json
+    import subprocess
+
+    ambiente = {**os.environ, "AQUECER": "0"}
+    inicio = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                          capture_output=True, text=True, env=ambiente)
+    parede_ms = (time.perf_counter() - inicio) * 1000
+    if proc.returncode != 0:
+        print(f"❌ Falha ao importar o app:\n{proc.stderr[-2000:]}")
+        sys.exit(1)
+
+    registros = _ler_importtime(proc.stderr)
+    # O app aparece no nível 0 depois de todas as suas dependências (nível 1 em diante)
+    indice_app = max(i for i, r in enumerate(registros) if r["modulo"] == "app" and r["nivel"] == 0)
+    total_ms = registros[indice_app]["acumulado_ms"]
+    inicio_app = max((i for i, r in enumerate(registros[:indice_app]) if r["nivel"] == 0), default=-1) + 1
+    diretos = [r for r in registros[inicio_app:indice_app] if r["nivel"] == 1]
+    carregados = {r["modulo"].split(".")[0] for r in registros[inicio_app:indice_app]}
+
+    print(f"\nImport do app: {total_ms:.0f} ms (importtime), {parede_ms:.0f} ms de parede com o interpretador")
+    print(f"| {'Módulo':<28} | Acumulado ms | % do import |")
+    print(f"|{'-' * 30}|--------------|-------------|")
+    for r in sorted(diretos, key=lambda r: r["acumulado_ms"], reverse=True)[:args.top]:
+        print(f"| {r['modulo']:<28} | {r['acumulado_ms']:12.1f} | {r['acumulado_ms'] / total_ms * 100:10.1f}% |")
+    pesados = [m for m in MODULOS_PESADOS if m in carregados]
+    print(f"Bibliotecas pesadas importadas junto com o app: {', '.join(pesados) or 'nenhuma'}")
+
+    if args.aquecimento:
+        codigo = ("import json, sys, time; t = time.perf_counter(); import app; t_import = time.perf_counter() - t; "
+                  "app.aquecer(); print(json.dumps({'import_s': t_import, 'aquecimento_s': app.ESTADO_BOOT['aquecimento_s'], "
+                  "'erro': app.ESTADO_BOOT['erro'], 'modulos': sorted({m.split('.')[0] for m in sys.modules})}))")
+        proc = subprocess.run([sys.executable, "-c", codigo], capture_output=True, text=True, env=ambiente)
+        if proc.returncode != 0:
+            print(f"❌ Falha no aquecimento:\n{proc.stderr[-2000:]}")
+            sys.exit(1)
+        r = json.loads(proc.stdout.strip().splitlines()[-1])
+        pesados = [m for m in MODULOS_PESADOS if m in r["modulos"]]
+        print(f"\nAquecimento do perfil padrão: {r['aquecimento_s']:.2f}s "
+              f"(import {r['import_s']:.2f}s, total até pronto {r['import_s'] + r['aquecimento_s']:.2f}s)")
+        print(f"Bibliotecas carregadas depois do aquecimento: {', '.join(pesados) or 'nenhuma'}")
+        if r["erro"]:
+            print(f"❌ Aquecimento incompleto: {r['erro']}")
+
+    if args.orcamento_ms and total_ms > args.orcamento_ms:
+        print(f"❌ Import acima do orçamento: {total_ms:.0f} ms > {args.orcamento_ms:.0f} ms")
+        sys.exit(1)
+
+
+def _respostas_tipicas(imagens: List[str], n: int) -> Dict[str, object]:
+    """Respostas no formato dos endpoints, montadas a partir de imagens reais
+
+    O plot é a imagem em 640x640 (JPEG, como o cv2.imwrite do servidor) e a
+    máscara de lesões é um limiar da própria imagem, só para ter um RLE com
+    tamanho realista. A recomendação é a mesma de sempre (texto repetido).
+    """
+    import cv2
+    import numpy as np
+    import formato_vetorial
+
+    rng = np.random.default_rng(0)
+    recomendacao = {"tipo": "calda_bordalesa", "titulo": "Recomendação: Calda Bordalesa",
+                    "descricao": "x" * 140, "instrucoes": ["x" * 150] * 5, "fonte": "x" * 200}
+
+    def resultado(path: str, formato: str) -> Dict:
+        img = cv2.resize(cv2.imread(path), (640, 640))
+        cinza = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        mascara = ((cinza < np.percentile(cinza, 8)) * 255).astype(np.uint8)
+        # Abertura morfológica: manchas contínuas como as do YOLO, não pixels soltos
+        mascara = cv2.morphologyEx(mascara, cv2.MORPH_OPEN, np.ones((7, 7), np.uint8))
+        folha, _ = cv2.findContours((cinza < 200).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        r = {"severity": round(float(rng.uniform(0, 20)), 2), "gated": False}
+        if formato != "vetorial":
+            r["plot_image"] = cv2.imencode(".jpg", img)[1].tobytes()
+        if formato != "imagem":
+            r["vetor"] = formato_vetorial.vetorizar_severidade(
+                mascara, max(folha, key=cv2.contourArea) if folha else None)
+        return r
+
+    lote = [imagens[i % len(imagens)] for i in range(n)]
+    deteccoes = [{"bbox": rng.uniform(0, 256, 4).round(2).tolist(), "confidence": float(rng.uniform(0.3, 1)),
+                  "class_id": 0, "class_name": "cercosporiose"} for _ in range(6)]
+    # Quadros da câmera ao vivo / cascata em formato vetorial: dezenas de caixas por imagem
+    muitas = [{"bbox": sorted(rng.uniform(0, 256, 2).round(2).tolist()) * 2, "confidence": float(rng.uniform(0.05, 1)),
+               "class_id": int(rng.integers(0, 3)), "class_name": "cercosporiose"} for _ in range(50)]
+    img_det = cv2.resize(cv2.imread(lote[0]), (256, 256))
+    return {
+        "/predict": {**resultado(lote[0], "imagem"), "recomendacao": recomendacao, "perfil": "balanced"},
+        "/detect_disease": {"detected_disease": "cercosporiose", "detections": deteccoes, "confidence": 0.9,
+                            "plot_image": cv2.imencode(".jpg", img_det)[1].tobytes(), "perfil": "balanced",
+                            "success": True},
+        f"/predict_lote ({n}, imagem)": {"resultados": [resultado(p, "imagem") for p in lote],
+                                         "severidade_media": 7.5, "recomendacao": recomendacao},
+        f"/predict_lote ({n}, vetorial)": {"resultados": [resultado(p, "vetorial") for p in lote],
+                                           "severidade_media": 7.5, "recomendacao": recomendacao},
+        f"/predict_lote ({n}, vetorial, cascata)": {
+            "resultados": [{"severity": 0.0, "gated": True, "doenca": "cercosporiose",
+                            "vetor": {"largura": 256, "altura": 256,
+                                      "deteccoes": formato_vetorial.deteccoes_colunares(muitas, 256, 256)}}
+                           for _ in lote],
+            "severidade_media": 0.0, "recomendacao": recomendacao},
+    }
+
+
+def _decodificar(corpo: bytes, tipo: str):
+    """Lado do cliente: desserializa e, no JSON, decodifica o base64 das imagens"""
+    import base64
+    import json
+    import codificacao
+
+    if tipo != codificacao.JSON:
+        return codificacao.decodificar(corpo, tipo)  # Imagens já em bytes, arrays tipados em numpy
+
+    def imagens(valor):
+        if isinstance(valor, dict):
+            return {k: base64.b64decode(v) if k.endswith("_b64") else imagens(v) for k, v in valor.items()}
+        if isinstance(valor, list):
+            return [imagens(v) for v in valor]
+        return valor
+    return imagens(json.loads(corpo))
+
+
+def bench_codificacao(args) -> None:
+    """Tamanho da resposta e tempo de serialização/desserialização por formato"""
+    import gzip
+    import codificacao
+
+    imagens = listar_imagens(args.imagens)
+    if not imagens:
+        print(f"❌ Nenhuma imagem em {args.imagens}")
+        sys.exit(1)
+    tipos = [t for t in (codificacao.JSON, codificacao.MSGPACK, codificacao.CBOR)
+             if t in codificacao.tipos_disponiveis()]
+    faltando = {codificacao.MSGPACK: "msgpack", codificacao.CBOR: "cbor2"}
+    for tipo, pacote in faltando.items():
+        if tipo not in tipos:
+            print(f"AVISO: {pacote} não instalado, {tipo} fora da comparação")
+
+    for nome, dados in _respostas_tipicas(imagens, args.n).items():
+        print(f"\n{nome}")
+        print("| Formato             | Bytes      | gzip       | Serializar (ms) | Desserializar (ms) |")
+        print("|---------------------|------------|------------|-----------------|--------------------|")
+        base = None
+        for tipo in tipos:
+            corpo = codificacao.codificar(dados, tipo)
+            inicio = time.perf_counter()
+            for _ in range(args.repeticoes):
+                codificacao.codificar(dados, tipo)
+            t_codificar = (time.perf_counter() - inicio) / args.repeticoes
+            inicio = time.perf_counter()
+            for _ in range(args.repeticoes):
+                _decodificar(corpo, tipo)
+            t_decodificar = (time.perf_counter() - inicio) / args.repeticoes
+            base = base or len(corpo)
+            print(f"| {tipo:<19} | {len(corpo):10,d} | {len(gzip.compress(corpo, 6)):10,d} | "
+                  f"{t_codificar * 1000:15.2f} | {t_decodificar * 1000:18.2f} |"
+                  + ("" if tipo == codificacao.JSON else f" {len(corpo) / base:.0%} do JSON"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks do backend CultivaTrack")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_cascata = sub.add_parser("cascata", help="Economia da cascata detecção -> segmentação")
+    p_cascata.add_argument("--saudaveis", required=True, help="Pasta com folhas sem sintomas")
+    p_cascata.add_argument("--doentes", required=True, help="Pasta com folhas com lesões")
+    p_cascata.add_argument("--n", type=int, default=50, help="Tamanho da amostra")
+    p_cascata.add_argument("--fracao-saudaveis", type=float, default=0.7,
+                           help="Fração de folhas sadias na mistura (levantamento típico: 0.7)")
+    p_cascata.add_argument("--conf", type=float, default=0.4, help="Limiar de confiança da cascata")
+    p_cascata.add_argument("--seed", type=int, default=0)
+    p_cascata.set_defaults(func=bench_cascata)
+
+    p_roi = sub.add_parser("roi", help="Custo e área de lesão: imagem inteira vs recortes ROI")
+    p_roi.add_argument("--imagens", required=True, help="Pasta com folhas com lesões localizadas")
+    p_roi.set_defaults(func=bench_roi)
+
+    p_perfis = sub.add_parser("perfis", help="Latência e erro de severidade por perfil")
+    p_perfis.add_argument("--imagens", required=True, help="Pasta com as imagens de teste")
+    p_perfis.add_argument("--referencia", help="CSV (arquivo,severidade) com severidades de referência")
+    p_perfis.set_defaults(func=bench_perfis)
+
+    p_direto = sub.add_parser("direto", help="Inferência direta vs model.predict()")
+    p_direto.add_argument("--imagens", required=True, help="Pasta com as imagens de teste")
+    p_direto.add_argument("--perfil", help="Perfil (padrão: o do servidor)")
+    p_direto.add_argument("--conf", type=float, default=0.25, help="Confiança mínima nas duas saídas")
+    p_direto.add_argument("--repeticoes", type=int, default=5)
+    p_direto.set_defaults(func=bench_direto)
+
+    p_pipeline = sub.add_parser("pipeline", help="Vazão de lote: sequencial vs pipeline em estágios")
+    p_pipeline.add_argument("--imagens", required=True, help="Pasta com as imagens de teste")
+    p_pipeline.add_argument("--n", type=int, default=12, help="Tamanho do lote (repete imagens se preciso)")
+    p_pipeline.add_argument("--perfil", help="Perfil (padrão: o do servidor)")
+    p_pipeline.add_argument("--workers", help='Threads por estágio, ex.: "preprocessar=3,contornos=2"')
+    p_pipeline.add_argument("--fila", type=int, default=2, help="Tamanho das filas entre estágios")
+    p_pipeline.set_defaults(func=bench_pipeline)
+
+    p_backends = sub.add_parser("backends", help="Latência e paridade: PyTorch vs ONNX Runtime vs OpenVINO")
+    p_backends.add_argument("--imagens", required=True, help="Pasta com as imagens de teste")
+    p_backends.add_argument("--perfil", help="Perfil (padrão: o do servidor)")
+    p_backends.add_argument("--backends", default="pytorch,onnx,openvino", help="Backends separados por vírgula")
+    p_backends.add_argument("--conf", type=float, default=0.25, help="Confiança mínima da detecção")
+    p_backends.set_defaults(func=bench_backends)
+
+    p_boot = sub.add_parser("boot", help="Orçamento de import (-X importtime) e tempo de aquecimento")
+    p_boot.add_argument("--top", type=int, default=15, help="Quantos módulos listar")
+    p_boot.add_argument("--orcamento-ms", type=float, help="Falha (código 1) se o import passar disso")
+    p_boot.add_argument("--aquecimento", action="store_true", help="Mede também o carregamento dos modelos")
+    p_boot.set_defaults(func=bench_boot)
+
+    p_codificacao = sub.add_parser("codificacao", help="Respostas em JSON vs MessagePack vs CBOR")
+    p_codificacao.add_argument("--imagens", required=True, help="Pasta com imagens (viram os plots das respostas)")
+    p_codificacao.add_argument("--n", type=int, default=20, help="Imagens por resposta de lote")
+    p_codificacao.add_argument("--repeticoes", type=int, default=20)
+    p_codificacao.set_defaults(func=bench_codificacao)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
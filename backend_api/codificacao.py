@@ -0,0 +1,195 @@
+# backend_api/codificacao.py
+"""Codificação das respostas (e corpos de requisição) em JSON, MessagePack ou CBOR
+
+As respostas de análise são montadas com as imagens em bytes crus (chave
+"plot_image", por exemplo). No JSON, que continua sendo o padrão, cada campo
+em bytes vira base64 com o sufixo "_b64" (plot_image_b64), como sempre foi.
+Com "Accept: application/msgpack" ou "application/cbor" as imagens vão como
+campos binários e os números como inteiros/float32 binários, sem o custo do
+base64 (+33%) nem da formatação de texto.
+
+As colunas numéricas (caixas, confianças, classes, contornos) são montadas
+como arrays numpy (formato_vetorial). No JSON viram listas, como sempre. Nos formatos
+binários viram arrays tipados, com float64 reduzido a float32:
+- CBOR: tags de array tipado do RFC 8746 (85 = float32 little-endian,
+  78 = int32...), com a tag 40 (forma + array) quando há mais de uma dimensão.
+- MessagePack: extensão EXT_ARRAY com o mesmo número de tag (1 byte), o
+  número de dimensões (1 byte), a forma (uint32 cada) e os bytes little-endian.
+decodificar() faz o caminho inverso (é o que o cliente precisa replicar).
+
+Os corpos de requisição também podem vir em MessagePack/CBOR (Content-Type),
+com "file" em bytes no lugar de base64. msgpack e cbor2 são opcionais: sem o
+pacote, o servidor responde em JSON.
+"""
+import base64
+import json
+import struct
+from typing import Any, Dict, Optional
+
+import numpy as np
+from flask import Response, jsonify, request
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+_ALIASES = {"application/x-msgpack": MSGPACK, "application/vnd.msgpack": MSGPACK}
+
+# Tipos dos arrays -> tags do RFC 8746 (little-endian); a mesma numeração marca o tipo no MessagePack
+TAGS_ARRAY = {np.dtype("u1"): 64, np.dtype("<u2"): 69, np.dtype("<u4"): 70, np.dtype("<u8"): 71,
+              np.dtype("i1"): 72, np.dtype("<i2"): 77, np.dtype("<i4"): 78, np.dtype("<i8"): 79,
+              np.dtype("<f2"): 84, np.dtype("<f4"): 85, np.dtype("<f8"): 86}
+TIPOS_ARRAY = {tag: tipo for tipo, tag in TAGS_ARRAY.items()}
+TAG_MULTIDIMENSIONAL = 40  # RFC 8746: [forma, array tipado], em ordem de linhas
+EXT_ARRAY = 1  # Código da extensão do MessagePack para arrays tipados
+
+
+def _msgpack():
+    try:
+        import msgpack
+        return msgpack
+    except ImportError:
+        return None
+
+
+def _cbor2():
+    try:
+        import cbor2
+        return cbor2
+    except ImportError:
+        return None
+
+
+def tipos_disponiveis() -> list:
+    """Tipos de resposta suportados neste servidor, JSON primeiro (padrão para */*)"""
+    tipos = [JSON]
+    if _msgpack() is not None:
+        tipos += [MSGPACK, *_ALIASES]
+    if _cbor2() is not None:
+        tipos.append(CBOR)
+    return tipos
+
+
+def tipo_resposta() -> str:
+    """Melhor tipo para o Accept da requisição atual (JSON se nada binário for pedido)"""
+    melhor = request.accept_mimetypes.best_match(tipos_disponiveis(), default=JSON)
+    return _ALIASES.get(melhor, melhor)
+
+
+def para_json(dados: Any) -> Any:
+    """Troca campos em bytes por base64 com sufixo _b64 e arrays numpy por listas (formato JSON de sempre)"""
+    if isinstance(dados, np.ndarray):
+        return dados.tolist()
+    if isinstance(dados, dict):
+        saida = {}
+        for chave, valor in dados.items():
+            if isinstance(valor, (bytes, bytearray)):
+                saida[f"{chave}_b64"] = base64.b64encode(valor).decode("utf-8")
+            else:
+                saida[chave] = para_json(valor)
+        return saida
+    if isinstance(dados, (list, tuple)):
+        return [para_json(valor) for valor in dados]
+    return dados
+
+
+def _array_binario(valor: np.ndarray) -> np.ndarray:
+    """Array no tipo que vai para o fio, little-endian
+
+    float32 basta para 4 casas decimais. Inteiros vão no menor tipo que
+    comporta os valores (ids de classe: uint8).
+    """
+    if valor.dtype.kind == "f":
+        return np.ascontiguousarray(valor, dtype="<f4")
+    if valor.dtype.kind not in "iu":
+        raise TypeError(f"Array de tipo {valor.dtype} não tem codificação binária")
+    if valor.size:
+        tipo = np.promote_types(np.min_scalar_type(valor.min()), np.min_scalar_type(valor.max()))
+    else:
+        tipo = np.dtype("u1")
+    return np.ascontiguousarray(valor, dtype=tipo.newbyteorder("<"))
+
+
+def _ext_msgpack(valor: Any) -> Any:
+    if not isinstance(valor, np.ndarray):
+        raise TypeError(f"Tipo não serializável: {type(valor).__name__}")
+    valor = _array_binario(valor)
+    cabecalho = struct.pack(f"<BB{valor.ndim}I", TAGS_ARRAY[valor.dtype], valor.ndim, *valor.shape)
+    return _msgpack().ExtType(EXT_ARRAY, cabecalho + valor.tobytes())
+
+
+def _tag_cbor(codificador, valor: Any) -> None:
+    if not isinstance(valor, np.ndarray):
+        raise TypeError(f"Tipo não serializável: {type(valor).__name__}")
+    valor = _array_binario(valor)
+    tag = _cbor2().CBORTag(TAGS_ARRAY[valor.dtype], valor.tobytes())
+    if valor.ndim != 1:
+        tag = _cbor2().CBORTag(TAG_MULTIDIMENSIONAL, [list(valor.shape), tag])
+    codificador.encode(tag)
+
+
+def codificar(dados: Any, tipo: str) -> bytes:
+    """Serializa no tipo pedido (JSON, MessagePack ou CBOR)"""
+    if tipo == MSGPACK:
+        # float32 basta para confiança, caixas e coordenadas normalizadas (4 casas)
+        return _msgpack().packb(dados, use_bin_type=True, use_single_float=True, default=_ext_msgpack)
+    if tipo == CBOR:
+        return _cbor2().dumps(dados, default=_tag_cbor)
+    return json.dumps(para_json(dados), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _array_msgpack(codigo: int, dados: bytes) -> Any:
+    if codigo != EXT_ARRAY:
+        return _msgpack().ExtType(codigo, dados)
+    tag, ndim = struct.unpack_from("<BB", dados)
+    forma = struct.unpack_from(f"<{ndim}I", dados, 2)
+    return np.frombuffer(dados, dtype=TIPOS_ARRAY[tag], offset=2 + 4 * ndim).reshape(forma)
+
+
+def _array_cbor(*argumentos) -> Any:
+    # O cbor2 5.x chama tag_hook(decodificador, tag); o 6.x, tag_hook(tag, imutável)
+    tag = next(a for a in argumentos if isinstance(a, _cbor2().CBORTag))
+    if tag.tag in TIPOS_ARRAY:
+        return np.frombuffer(tag.value, dtype=TIPOS_ARRAY[tag.tag])
+    if tag.tag == TAG_MULTIDIMENSIONAL:
+        forma, valores = tag.value
+        return np.asarray(valores).reshape(forma)
+    return tag
+
+
+def decodificar(corpo: bytes, tipo: str) -> Any:
+    """Inverso de codificar: arrays tipados voltam como arrays numpy (só leitura)"""
+    if tipo == MSGPACK:
+        return _msgpack().unpackb(corpo, raw=False, ext_hook=_array_msgpack)
+    if tipo == CBOR:
+        return _cbor2().loads(corpo, tag_hook=_array_cbor)
+    return json.loads(corpo)
+
+
+def responder(dados: Dict, status: int = 200):
+    """Resposta no formato negociado pelo Accept; JSON segue pelo jsonify do Flask"""
+    tipo = tipo_resposta()
+    if tipo == JSON:
+        resposta = jsonify(para_json(dados))
+        resposta.status_code = status
+    else:
+        resposta = Response(codificar(dados, tipo), status=status, mimetype=tipo)
+    resposta.vary.add("Accept")
+    return resposta
+
+
+def corpo_requisicao() -> Optional[Dict]:
+    """Corpo da requisição em JSON, MessagePack ou CBOR (None se vazio ou inválido)"""
+    tipo = _ALIASES.get(request.mimetype, request.mimetype)
+    try:
+        if (tipo == MSGPACK and _msgpack() is not None) or (tipo == CBOR and _cbor2() is not None):
+            return decodificar(request.get_data(), tipo)
+    except Exception:
+        return None
+    return request.get_json(silent=True)
+
+
+def ler_imagem(valor: Any) -> bytes:
+    """Campo "file": bytes crus (MessagePack/CBOR) ou texto em base64 (JSON)"""
+    if isinstance(valor, (bytes, bytearray)):
+        return bytes(valor)
+    return base64.b64decode(valor)
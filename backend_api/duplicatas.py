@@ -0,0 +1,256 @@
+# backend_api/duplicatas.py
+"""Detecção de fotos quase iguais (hash perceptual) para não analisar a mesma folha de novo
+
+Fotos repetidas da mesma folha e imagens da galeria reenviadas em outra
+sessão chegam com bytes diferentes (recompressão, redimensionamento), então
+o hash exato da idempotência não as pega. Aqui cada imagem recebe um pHash
+de 64 bits (DCT de uma miniatura 32x32 em cinza, decodificada já reduzida)
+e as análises recentes ficam numa árvore BK, que acha os vizinhos dentro de
+um raio de Hamming sem comparar com todas.
+
+Dois níveis, no mesmo endpoint e com os mesmos parâmetros:
+- os mesmos bytes (sha256) reenviados: a análise anterior é devolvida sem
+  inferência;
+- até DUPLICATAS_RAIO bits: provavelmente a mesma folha fotografada de
+  novo; a imagem é analisada, mas a resposta aponta a análise anterior
+  ("duplicata") para o levantamento não contar a folha duas vezes.
+
+Reaproveitar também fotos só parecidas é opcional (DUPLICATAS_RAIO_REUSO >= 0,
+em bits): o contexto não separa talhões nem clientes, e duas folhas
+diferentes contra um fundo parecido podem ficar a poucos bits uma da outra.
+
+Toda análise guardada ganha um "analise_id"; reaproveitamentos devolvem o
+id da original. Memória limitada por DUPLICATAS_MAX análises (LRU) e
+DUPLICATAS_TTL_S.
+"""
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+DUPLICATAS_ATIVA = os.environ.get("DUPLICATAS_ATIVA", "1") == "1"
+DUPLICATAS_RAIO = int(os.environ.get("DUPLICATAS_RAIO", "10"))
+DUPLICATAS_RAIO_REUSO = int(os.environ.get("DUPLICATAS_RAIO_REUSO", "-1"))  # -1 = só bytes idênticos
+DUPLICATAS_MAX = int(os.environ.get("DUPLICATAS_MAX", "256"))
+DUPLICATAS_TTL_S = float(os.environ.get("DUPLICATAS_TTL_S", "86400"))
+
+
+def distancia_hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def dhash(cinza: np.ndarray) -> int:
+    """Hash de diferença de 64 bits: vizinhos horizontais numa miniatura 9x8"""
+    pequena = cv2.resize(cinza, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (pequena[:, 1:] > pequena[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def phash(cinza: np.ndarray) -> int:
+    """Hash perceptual de 64 bits: frequências baixas da DCT comparadas com a mediana"""
+    pequena = cv2.resize(cinza, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    baixas = cv2.dct(pequena)[:8, :8].ravel()
+    mediana = np.median(baixas[1:])  # Sem o termo DC, que só reflete o brilho médio
+    return int.from_bytes(np.packbits(baixas > mediana).tobytes(), "big")
+
+
+def digest_imagem(dados: bytes) -> str:
+    return hashlib.sha256(dados).hexdigest()
+
+
+def _reutilizar(distancia: int, exata: bool) -> bool:
+    """Devolver a análise anterior sem inferência: bytes idênticos ou, se ligado, pHash bem próximo"""
+    return exata or 0 <= distancia <= DUPLICATAS_RAIO_REUSO
+
+
+def phash_imagem(dados: bytes) -> Optional[int]:
+    """pHash dos bytes de uma imagem (JPEG decodificado a 1/4, bem mais rápido); None se inválida"""
+    cinza = cv2.imdecode(np.frombuffer(dados, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    return None if cinza is None else phash(cinza)
+
+
+class ArvoreBK:
+    """Árvore BK para hashes de 64 bits: busca por raio de Hamming
+
+    Cada nó é [hash, valores, filhos por distância ao nó]. Não há remoção:
+    quem usa ignora valores que já saíram e reconstrói a árvore de tempos
+    em tempos.
+    """
+
+    def __init__(self):
+        self._raiz: Optional[list] = None
+        self.tamanho = 0
+
+    def adicionar(self, h: int, valor: Any) -> None:
+        self.tamanho += 1
+        if self._raiz is None:
+            self._raiz = [h, [valor], {}]
+            return
+        no = self._raiz
+        while True:
+            d = distancia_hamming(h, no[0])
+            if d == 0:
+                no[1].append(valor)
+                return
+            filho = no[2].get(d)
+            if filho is None:
+                no[2][d] = [h, [valor], {}]
+                return
+            no = filho
+
+    def buscar(self, h: int, raio: int) -> List[Tuple[int, Any]]:
+        """(distância, valor) de todos os hashes a até "raio" bits, do mais próximo ao mais distante"""
+        encontrados = []
+        pilha = [self._raiz] if self._raiz is not None else []
+        while pilha:
+            no = pilha.pop()
+            d = distancia_hamming(h, no[0])
+            if d <= raio:
+                encontrados.extend((d, valor) for valor in no[1])
+            # Desigualdade triangular: só filhos com |k - d| <= raio podem ter vizinhos
+            for k, filho in no[2].items():
+                if d - raio <= k <= d + raio:
+                    pilha.append(filho)
+        return sorted(encontrados, key=lambda par: par[0])
+
+
+class _Analise:
+    __slots__ = ("hash", "digest", "contexto", "resposta", "criada_em")
+
+    def __init__(self, h: int, digest: Optional[str], contexto: str, resposta: Dict):
+        self.hash = h
+        self.digest = digest
+        self.contexto = contexto
+        self.resposta = resposta
+        self.criada_em = time.time()
+
+
+class IndiceDuplicatas:
+    """Análises recentes indexadas por pHash"""
+
+    def __init__(self, maximo: int = DUPLICATAS_MAX, ttl_s: float = DUPLICATAS_TTL_S):
+        self.maximo = maximo
+        self.ttl_s = ttl_s
+        self._analises: "collections.OrderedDict[str, _Analise]" = collections.OrderedDict()
+        self._arvore = ArvoreBK()
+        self._lock = threading.Lock()
+        self.contadores = {"reutilizadas": 0, "sinalizadas": 0, "novas": 0}
+
+    def _reconstruir(self) -> None:
+        self._arvore = ArvoreBK()
+        for id_analise, analise in self._analises.items():
+            self._arvore.adicionar(analise.hash, id_analise)
+
+    def consultar(self, h: int, contexto: str, digest: Optional[str] = None) -> Optional[Dict]:
+        """Análise mais parecida no mesmo contexto, dentro de DUPLICATAS_RAIO (ou None)
+
+        Uma análise com o mesmo digest (bytes idênticos) tem preferência.
+        Retorna {"id", "distancia", "idade_s", "reutilizar", "resposta"}.
+        """
+        agora = time.time()
+        with self._lock:
+            achado = None
+            for distancia, id_analise in self._arvore.buscar(h, DUPLICATAS_RAIO):
+                analise = self._analises.get(id_analise)
+                if analise is None or analise.contexto != contexto or agora - analise.criada_em > self.ttl_s:
+                    continue
+                exata = digest is not None and analise.digest == digest
+                if achado is None or exata:
+                    achado = (distancia, id_analise, analise, exata)
+                if exata:
+                    break
+            if achado is None:
+                return None
+            distancia, id_analise, analise, exata = achado
+            reutilizar = _reutilizar(distancia, exata)
+            if reutilizar:
+                self._analises.move_to_end(id_analise)
+            self.contadores["reutilizadas" if reutilizar else "sinalizadas"] += 1
+            return {"id": id_analise, "distancia": distancia, "idade_s": round(agora - analise.criada_em, 1),
+                    "reutilizar": reutilizar, "resposta": analise.resposta}
+
+    def adicionar(self, h: int, contexto: str, resposta: Dict, digest: Optional[str] = None) -> str:
+        """Guarda uma análise nova e retorna o id dela"""
+        id_analise = uuid.uuid4().hex
+        with self._lock:
+            self._analises[id_analise] = _Analise(h, digest, contexto, resposta)
+            self._arvore.adicionar(h, id_analise)
+            self.contadores["novas"] += 1
+            while len(self._analises) > self.maximo:
+                self._analises.popitem(last=False)
+            # Ids que saíram continuam na árvore até a reconstrução
+            if self._arvore.tamanho > 2 * self.maximo:
+                self._reconstruir()
+        return id_analise
+
+    def resumo(self) -> Dict:
+        with self._lock:
+            return {"analises": len(self._analises), "raio": DUPLICATAS_RAIO,
+                    "raio_reuso": DUPLICATAS_RAIO_REUSO, **self.contadores}
+
+
+indice = IndiceDuplicatas()
+
+
+def contexto(endpoint: str, parametros: Dict) -> str:
+    """Só fotos do mesmo endpoint e com os mesmos parâmetros reaproveitam análises"""
+    return json.dumps([endpoint, parametros], sort_keys=True, default=str)
+
+
+def marcar(resposta: Dict, achado: Dict) -> Dict:
+    """Cópia da resposta indicando a análise anterior parecida"""
+    return {**resposta, "duplicata": {"de": achado["id"], "distancia": achado["distancia"],
+                                      "idade_s": achado["idade_s"], "reutilizada": achado["reutilizar"]}}
+
+
+def planejar_lote(hashes: List[Optional[int]], ctx: str,
+                  digests: Optional[List[Optional[str]]] = None) -> List[Optional[Dict]]:
+    """Para cada imagem do lote: None (analisar) ou a análise parecida encontrada
+
+    A parecida pode vir do índice ({"id", "resposta", ...}, como consultar)
+    ou de uma imagem anterior do mesmo lote ({"lote": j, ...}). Só imagens que
+    serão analisadas servem de referência para as seguintes.
+    """
+    digests = digests or [None] * len(hashes)
+    planos: List[Optional[Dict]] = []
+    arvore = ArvoreBK()
+    for i, h in enumerate(hashes):
+        if h is None:
+            planos.append(None)
+            continue
+        no_lote = arvore.buscar(h, DUPLICATAS_RAIO)
+        if no_lote:
+            # Bytes idênticos primeiro, depois o mais próximo
+            distancia, j = min(no_lote, key=lambda par: (digests[i] is None or digests[par[1]] != digests[i], par))
+            exata = digests[i] is not None and digests[j] == digests[i]
+            planos.append({"lote": j, "distancia": distancia, "idade_s": 0.0,
+                           "reutilizar": _reutilizar(distancia, exata)})
+        else:
+            planos.append(indice.consultar(h, ctx, digests[i]))
+        if planos[-1] is None or not planos[-1]["reutilizar"]:
+            arvore.adicionar(h, i)
+    return planos
+
+
+def sem_repetir(imagem: bytes, ctx: str, funcao: Callable[[], Tuple[Dict, int]]) -> Tuple[Dict, int]:
+    """Roda funcao() (que devolve (resposta, status)) a menos que a foto já tenha sido analisada"""
+    h = phash_imagem(imagem) if DUPLICATAS_ATIVA else None
+    if h is None:
+        return funcao()
+    digest = digest_imagem(imagem)
+    achado = indice.consultar(h, ctx, digest)
+    if achado is not None and achado["reutilizar"]:
+        return marcar(achado["resposta"], achado), 200
+    resposta, status = funcao()
+    if status == 200:
+        resposta["analise_id"] = indice.adicionar(h, ctx, resposta, digest)
+        if achado is not None:
+            resposta = marcar(resposta, achado)
+    return resposta, status
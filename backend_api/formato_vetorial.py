@@ -0,0 +1,110 @@
+# backend_api/formato_vetorial.py
+"""Resultados em formato vetorial compacto
+
+Em vez da imagem de overlay, a resposta pode trazer a máscara das lesões
+como RLE (run-length encoding no formato não comprimido do COCO: contagens
+alternadas de 0 e 1, percorrendo a máscara coluna a coluna, começando por
+zeros) ou como polígonos simplificados. Contorno da folha e caixas de
+detecção vêm normalizados para [0, 1] (x pela largura, y pela altura), com
+as caixas em arrays por coluna. O cliente desenha o overlay na resolução que
+quiser e o resultado pode ser guardado e redesenhado depois.
+
+Pontos, caixas, confianças e classes saem como arrays numpy: listas no
+JSON, arrays tipados no MessagePack/CBOR (ver codificacao.py). As contagens
+do RLE continuam lista de inteiros: no MessagePack/CBOR cada contagem
+pequena ocupa um byte, menos do que num array tipado.
+"""
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+FORMATOS = ("imagem", "vetorial", "ambos")
+FORMATOS_MASCARA = ("rle", "poligonos")
+POLIGONO_TOLERANCIA = 1.0  # Distância máxima (px) entre o polígono simplificado e o contorno
+CASAS_DECIMAIS = 4  # 1/10000 da imagem: abaixo de um pixel até 4K
+
+
+def mascara_para_rle(mascara: np.ndarray) -> Dict:
+    """Máscara (H, W) binária -> {"size": [H, W], "counts": [...]} (RLE do COCO)"""
+    h, w = mascara.shape[:2]
+    plano = (mascara > 0).ravel(order="F").astype(np.int8)  # Coluna a coluna, como o COCO
+    if plano.size == 0:
+        return {"size": [h, w], "counts": []}
+    mudancas = np.flatnonzero(np.diff(plano)) + 1
+    limites = np.concatenate(([0], mudancas, [plano.size]))
+    counts = np.diff(limites).tolist()
+    if plano[0] == 1:
+        counts.insert(0, 0)  # A primeira contagem é sempre de zeros
+    return {"size": [h, w], "counts": counts}
+
+
+def rle_para_mascara(rle: Dict) -> np.ndarray:
+    """Inverso de mascara_para_rle: máscara uint8 (H, W) com 0/255"""
+    h, w = rle["size"]
+    valores = np.zeros(len(rle["counts"]), dtype=np.uint8)
+    valores[1::2] = 255
+    plano = np.repeat(valores, rle["counts"])
+    return plano.reshape((w, h)).T.copy() if plano.size == h * w else np.zeros((h, w), dtype=np.uint8)
+
+
+def _normalizar(pontos: np.ndarray, largura: int, altura: int) -> np.ndarray:
+    """Pontos (N, 2) em pixels -> [x0, y0, x1, y1, ...] em [0, 1]"""
+    normalizados = pontos.reshape(-1, 2).astype(np.float64) / (largura, altura)
+    return np.round(normalizados, CASAS_DECIMAIS).ravel()
+
+
+def mascara_para_poligonos(mascara: np.ndarray, tolerancia: float = POLIGONO_TOLERANCIA) -> List[np.ndarray]:
+    """Contornos externos da máscara simplificados (Douglas-Peucker) e normalizados
+
+    Buracos dentro das lesões não são representados.
+    """
+    h, w = mascara.shape[:2]
+    contornos, _ = cv2.findContours((mascara > 0).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    poligonos = []
+    for contorno in contornos:
+        simplificado = cv2.approxPolyDP(contorno, tolerancia, True)
+        if len(simplificado) >= 3:
+            poligonos.append(_normalizar(simplificado, w, h))
+    return poligonos
+
+
+def contorno_normalizado(contorno: Optional[np.ndarray], largura: int, altura: int,
+                         tolerancia: float = POLIGONO_TOLERANCIA) -> Optional[np.ndarray]:
+    """Contorno do OpenCV simplificado e normalizado (None se não houver)"""
+    if contorno is None:
+        return None
+    return _normalizar(cv2.approxPolyDP(contorno, tolerancia, True), largura, altura)
+
+
+def deteccoes_colunares(detections: List[Dict], largura: int, altura: int) -> Dict[str, Any]:
+    """Lista de detecções (bbox em pixels) -> arrays por campo, caixas normalizadas"""
+    caixas = np.array([d["bbox"] for d in detections], dtype=np.float64).reshape(-1, 4)
+    caixas = np.round(caixas / (largura, altura, largura, altura), CASAS_DECIMAIS)
+    return {
+        "x1": caixas[:, 0].copy(),
+        "y1": caixas[:, 1].copy(),
+        "x2": caixas[:, 2].copy(),
+        "y2": caixas[:, 3].copy(),
+        "confidence": np.round(np.array([d["confidence"] for d in detections], dtype=np.float64), 4),
+        "class_id": np.array([d["class_id"] for d in detections], dtype=np.int32),
+        "class_name": [d["class_name"] for d in detections],
+    }
+
+
+def vetorizar_severidade(mascara: np.ndarray, folha: Optional[np.ndarray], formato_mascara: str = "rle",
+                         folhas: Optional[List[np.ndarray]] = None) -> Dict:
+    """Máscara das lesões e contorno da folha da imagem processada, em formato vetorial
+
+    No modo de várias folhas, "folhas" traz o contorno de cada uma, na ordem
+    da lista de folhas da resposta.
+    """
+    h, w = mascara.shape[:2]
+    if formato_mascara == "poligonos":
+        lesoes = {"poligonos": mascara_para_poligonos(mascara)}
+    else:
+        lesoes = {"rle": mascara_para_rle(mascara)}
+    vetor = {"largura": w, "altura": h, "mascara": lesoes, "folha": contorno_normalizado(folha, w, h)}
+    if folhas is not None:
+        vetor["folhas"] = [contorno_normalizado(contorno, w, h) for contorno in folhas]
+    return vetor
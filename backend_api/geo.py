@@ -0,0 +1,166 @@
+# backend_api/geo.py
+"""Localização das fotos (EXIF GPS) e geohash para o mapa de severidade
+
+As fotos do celular trazem latitude, longitude e horário nos metadados EXIF,
+que se perdem quando a imagem é decodificada (cv2.imread/imdecode). Aqui o
+EXIF é lido direto do cabeçalho pelo Pillow (Image.open é preguiçoso: só o
+segmento APP1 é lido, sem decodificar os pixels), antes de a imagem seguir
+para a análise.
+
+Cada ponto vira um geohash (GEO_PRECISAO caracteres; 9 dá células de ~5 m):
+prefixos do geohash são células maiores, então o mapa agrega por
+substr(geohash, 1, p) e busca os pontos de uma área por intervalos do índice
+(geohash >= prefixo AND geohash < prefixo + "{").
+"""
+import datetime
+import io
+import math
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+GEO_PRECISAO = 9
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODIFICAR = {c: i for i, c in enumerate(BASE32)}
+FIM_PREFIXO = "{"  # Vem logo depois de "z" na tabela ASCII: prefixo + "{" limita o intervalo do prefixo
+
+_TAG_GPS = 0x8825
+_TAG_EXIF = 0x8769
+_DATA_ORIGINAL = 36867
+_FUSO_ORIGINAL = 36881
+
+
+def geohash(lat: float, lon: float, precisao: int = GEO_PRECISAO) -> str:
+    """Geohash base32 do ponto (bits alternados de longitude e latitude)"""
+    faixa_lat, faixa_lon = [-90.0, 90.0], [-180.0, 180.0]
+    caracteres, valor, bits, longitude = [], 0, 0, True
+    while len(caracteres) < precisao:
+        faixa, x = (faixa_lon, lon) if longitude else (faixa_lat, lat)
+        meio = (faixa[0] + faixa[1]) / 2
+        if x >= meio:
+            valor = valor * 2 + 1
+            faixa[0] = meio
+        else:
+            valor *= 2
+            faixa[1] = meio
+        longitude = not longitude
+        bits += 1
+        if bits == 5:
+            caracteres.append(BASE32[valor])
+            valor, bits = 0, 0
+    return "".join(caracteres)
+
+
+def caixa_geohash(codigo: str) -> Tuple[float, float, float, float]:
+    """Limites da célula: (lat_min, lon_min, lat_max, lon_max)"""
+    faixa_lat, faixa_lon = [-90.0, 90.0], [-180.0, 180.0]
+    longitude = True
+    for c in codigo:
+        valor = _DECODIFICAR[c]
+        for deslocamento in range(4, -1, -1):
+            faixa = faixa_lon if longitude else faixa_lat
+            meio = (faixa[0] + faixa[1]) / 2
+            if (valor >> deslocamento) & 1:
+                faixa[0] = meio
+            else:
+                faixa[1] = meio
+            longitude = not longitude
+    return faixa_lat[0], faixa_lon[0], faixa_lat[1], faixa_lon[1]
+
+
+def tamanho_celula(precisao: int) -> Tuple[float, float]:
+    """(altura em graus de latitude, largura em graus de longitude) das células de um geohash"""
+    bits = 5 * precisao
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** math.ceil(bits / 2)
+
+
+def celulas_na_caixa(lat_min: float, lon_min: float, lat_max: float, lon_max: float, precisao: int) -> int:
+    altura, largura = tamanho_celula(precisao)
+    return (math.floor(lat_max / altura) - math.floor(lat_min / altura) + 1) * \
+        (math.floor(lon_max / largura) - math.floor(lon_min / largura) + 1)
+
+
+def cobertura(lat_min: float, lon_min: float, lat_max: float, lon_max: float, precisao: int) -> Iterator[str]:
+    """Geohashes de uma precisão que cobrem a caixa"""
+    altura, largura = tamanho_celula(precisao)
+    for i in range(math.floor(lat_min / altura), math.floor(lat_max / altura) + 1):
+        for j in range(math.floor(lon_min / largura), math.floor(lon_max / largura) + 1):
+            # Centro da célula: não cai na fronteira entre duas
+            lat = min(90.0, max(-90.0, (i + 0.5) * altura))
+            lon = min(180.0, max(-180.0, (j + 0.5) * largura))
+            yield geohash(lat, lon, precisao)
+
+
+def precisao_para_caixa(lat_min: float, lon_min: float, lat_max: float, lon_max: float,
+                        max_celulas: int, maxima: int = GEO_PRECISAO) -> int:
+    """Maior precisão com até max_celulas células na caixa (pelo menos 1)"""
+    precisao = 1
+    while precisao < maxima and celulas_na_caixa(lat_min, lon_min, lat_max, lon_max, precisao + 1) <= max_celulas:
+        precisao += 1
+    return precisao
+
+
+def _graus(valor, referencia: Optional[str]) -> float:
+    """Coordenada EXIF (graus, minutos, segundos como racionais) em graus decimais"""
+    graus, minutos, segundos = (float(x) for x in valor)
+    decimal = graus + minutos / 60 + segundos / 3600
+    return -decimal if referencia in ("S", "W") else decimal
+
+
+def metadados_foto(dados: bytes) -> Dict:
+    """Latitude, longitude e horário da foto a partir do EXIF (campos ausentes ficam de fora)
+
+    "tirada_em" é o DateTimeOriginal em ISO, com o fuso se a câmera gravou
+    OffsetTimeOriginal. Fotos sem EXIF (ou com EXIF inválido) dão {}.
+    """
+    try:
+        with Image.open(io.BytesIO(dados)) as img:
+            exif = img.getexif()
+            gps = exif.get_ifd(_TAG_GPS)
+            detalhes = exif.get_ifd(_TAG_EXIF)
+    except Exception:
+        return {}
+    resultado = {}
+    try:
+        # 1/2: referência e latitude; 3/4: referência e longitude
+        if 2 in gps and 4 in gps:
+            lat, lon = _graus(gps[2], gps.get(1)), _graus(gps[4], gps.get(3))
+            if -90 <= lat <= 90 and -180 <= lon <= 180 and (lat, lon) != (0.0, 0.0):
+                resultado["lat"], resultado["lon"] = round(lat, 7), round(lon, 7)
+    except (TypeError, ValueError, ZeroDivisionError):
+        pass
+    data = detalhes.get(_DATA_ORIGINAL)
+    if isinstance(data, str):
+        try:
+            instante = datetime.datetime.strptime(data.strip("\x00 "), "%Y:%m:%d %H:%M:%S")
+            fuso = detalhes.get(_FUSO_ORIGINAL)
+            resultado["tirada_em"] = instante.isoformat() + (fuso.strip("\x00 ") if isinstance(fuso, str) else "")
+        except ValueError:
+            pass
+    return resultado
+
+
+def ponto_da_requisicao(dados: Dict) -> Dict:
+    """"lat"/"lon" enviados pelo cliente (GPS do navegador), para fotos sem EXIF"""
+    try:
+        lat, lon = float(dados["lat"]), float(dados["lon"])
+    except (KeyError, TypeError, ValueError):
+        return {}
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return {}
+    return {"lat": lat, "lon": lon}
+
+
+def agregar_celulas(linhas: List[Tuple]) -> Dict[str, List]:
+    """Linhas (geohash da célula, n, média, máximo, acima) em arrays por coluna, com o centro de cada célula"""
+    colunas = {"geohash": [], "lat": [], "lon": [], "n": [], "media": [], "maximo": [], "fracao_acima_limiar": []}
+    for celula, n, media, maximo, acima in linhas:
+        lat_min, lon_min, lat_max, lon_max = caixa_geohash(celula)
+        colunas["geohash"].append(celula)
+        colunas["lat"].append(round((lat_min + lat_max) / 2, 6))
+        colunas["lon"].append(round((lon_min + lon_max) / 2, 6))
+        colunas["n"].append(n)
+        colunas["media"].append(round(media, 2))
+        colunas["maximo"].append(round(maximo, 2))
+        colunas["fracao_acima_limiar"].append(round(acima / n, 4))
+    return colunas
@@ -0,0 +1,149 @@
+# backend_api/idempotencia.py
+"""Idempotência e deduplicação de requisições de análise
+
+Toque duplo em "Detectar"/"Calcular" e reenvios depois do timeout do cliente
+mandam a mesma foto várias vezes. Cada requisição ganha uma chave:
+
+- a do cabeçalho Idempotency-Key, se o cliente mandar (vale por
+  IDEMPOTENCIA_TTL_S e só pode ser reusada com o mesmo corpo);
+- senão, o hash (SHA-256) do endpoint, dos parâmetros e da imagem.
+
+Se já houver uma requisição com a mesma chave em andamento, as seguintes
+esperam pelo mesmo Future em vez de rodar o pipeline de novo (single-flight).
+Resultados com sucesso ficam guardados até o TTL e são devolvidos direto;
+erros não ficam: a próxima tentativa roda de novo. Quem espera mais de
+IDEMPOTENCIA_ESPERA_S desiste com EmAndamento (a original continua rodando);
+o app responde 409 com Retry-After.
+"""
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as TempoEsgotado
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+IDEMPOTENCIA_ATIVA = os.environ.get("IDEMPOTENCIA_ATIVA", "1") == "1"
+IDEMPOTENCIA_TTL_S = float(os.environ.get("IDEMPOTENCIA_TTL_S", "300"))
+IDEMPOTENCIA_MAX = int(os.environ.get("IDEMPOTENCIA_MAX", "128"))  # Resultados guardados (LRU)
+IDEMPOTENCIA_ESPERA_S = float(os.environ.get("IDEMPOTENCIA_ESPERA_S", "300"))  # Limite de espera por outra requisição
+IDEMPOTENCIA_RETRY_AFTER_S = int(os.environ.get("IDEMPOTENCIA_RETRY_AFTER_S", "5"))  # Sugestão ao cliente depois da espera
+
+
+class ChaveReutilizada(Exception):
+    """Idempotency-Key já usada com outro corpo de requisição"""
+
+
+class EmAndamento(Exception):
+    """A requisição original com a mesma chave passou do limite de espera e ainda está rodando"""
+
+
+def impressao(endpoint: str, parametros: Dict, imagens: Iterable[bytes]) -> str:
+    """Hash do que define o resultado: endpoint, parâmetros e bytes das imagens"""
+    h = hashlib.sha256()
+    h.update(endpoint.encode())
+    h.update(json.dumps(parametros, sort_keys=True, default=str).encode())
+    for imagem in imagens:
+        h.update(len(imagem).to_bytes(8, "little"))
+        h.update(imagem)
+    return h.hexdigest()
+
+
+class _Entrada:
+    __slots__ = ("futuro", "impressao", "expira_em")
+
+    def __init__(self, impressao: str):
+        self.futuro: Future = Future()
+        self.impressao = impressao
+        self.expira_em: Optional[float] = None  # Definido quando termina com sucesso
+
+
+class CacheIdempotente:
+    """Requisições em andamento e resultados recentes, por chave"""
+
+    def __init__(self, ttl_s: float = IDEMPOTENCIA_TTL_S, maximo: int = IDEMPOTENCIA_MAX):
+        self.ttl_s = ttl_s
+        self.maximo = maximo
+        self._entradas: "collections.OrderedDict[str, _Entrada]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.contadores = {"nova": 0, "anexada": 0, "repetida": 0, "espera_esgotada": 0}
+
+    def _limpar_expirados(self, agora: float) -> None:
+        expirados = [chave for chave, e in self._entradas.items() if e.expira_em is not None and e.expira_em <= agora]
+        for chave in expirados:
+            del self._entradas[chave]
+        # Além do limite, saem os resultados prontos mais antigos (nunca os em andamento)
+        prontos = [chave for chave, e in self._entradas.items() if e.expira_em is not None]
+        for chave in prontos[:max(0, len(self._entradas) - self.maximo)]:
+            del self._entradas[chave]
+
+    def executar(self, chave: str, impressao_corpo: str, funcao: Callable[[], Tuple[Dict, int]],
+                 guardar: Callable[[Dict, int], bool] = lambda resposta, status: status == 200
+                 ) -> Tuple[Dict, int, str]:
+        """Roda funcao() uma única vez por chave; retorna (resposta, status, origem)
+
+        origem: "nova" (rodou agora), "anexada" (esperou outra requisição
+        idêntica em andamento) ou "repetida" (resultado guardado). Só ficam
+        guardadas as respostas aprovadas por guardar(resposta, status).
+        """
+        with self._lock:
+            agora = time.monotonic()
+            self._limpar_expirados(agora)
+            entrada = self._entradas.get(chave)
+            if entrada is not None and entrada.impressao != impressao_corpo:
+                raise ChaveReutilizada(chave)
+            if entrada is None:
+                entrada = self._entradas[chave] = _Entrada(impressao_corpo)
+                dono = True
+            else:
+                self._entradas.move_to_end(chave)
+                dono = False
+                origem = "repetida" if entrada.futuro.done() else "anexada"
+            self.contadores["nova" if dono else origem] += 1
+
+        if not dono:
+            try:
+                resposta, status = entrada.futuro.result(timeout=IDEMPOTENCIA_ESPERA_S)
+            except TempoEsgotado:
+                with self._lock:
+                    self.contadores["espera_esgotada"] += 1
+                raise EmAndamento(chave) from None
+            return resposta, status, origem
+
+        try:
+            resposta, status = funcao()
+        except BaseException as e:
+            with self._lock:
+                self._entradas.pop(chave, None)
+            entrada.futuro.set_exception(e)
+            raise
+        with self._lock:
+            if guardar(resposta, status):
+                entrada.expira_em = time.monotonic() + self.ttl_s
+            else:
+                # Erro: quem estava esperando recebe o mesmo erro, mas ele não fica guardado
+                self._entradas.pop(chave, None)
+        entrada.futuro.set_result((resposta, status))
+        return resposta, status, "nova"
+
+    def resumo(self) -> Dict:
+        with self._lock:
+            em_andamento = sum(1 for e in self._entradas.values() if e.expira_em is None)
+            return {"em_andamento": em_andamento, "guardados": len(self._entradas) - em_andamento,
+                    "ttl_s": self.ttl_s, **self.contadores}
+
+
+cache = CacheIdempotente()
+
+
+def executar_uma_vez(endpoint: str, chave_cliente: Optional[str], parametros: Dict, imagens: Iterable[bytes],
+                     funcao: Callable[[], Tuple[Dict, int]], **kwargs) -> Tuple[Dict, int, str]:
+    """Aplica a idempotência a uma análise (funcao devolve (resposta, status))"""
+    if not IDEMPOTENCIA_ATIVA:
+        resposta, status = funcao()
+        return resposta, status, "nova"
+    corpo = impressao(endpoint, parametros, imagens)
+    # Chaves do cliente ficam separadas por endpoint; sem chave, o próprio hash é a chave
+    chave = f"{endpoint}|{chave_cliente}" if chave_cliente else corpo
+    return cache.executar(chave, corpo, funcao, **kwargs)
@@ -0,0 +1,171 @@
+# backend_api/inferencia_direta.py
+"""Caminho de inferência enxuto para os modelos YOLOv8
+
+Evita o predictor do Ultralytics (detecção do tipo de fonte, dataloader,
+setup por chamada e objetos Results): recebe um lote NumPy já no tamanho da
+rede, roda a rede diretamente e faz NMS e decodificação das máscaras de forma
+vetorizada. Só funciona para entradas quadradas no tamanho de inferência
+(múltiplo de 32), que é o caso das imagens de 640x640 e 256x256 do pipeline.
+"""
+import copy
+import json
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+import torchvision
+
+
+class ModeloDireto:
+    """Executa um modelo YOLOv8 (PyTorch, TorchScript ou ONNX) sem o predictor"""
+
+    def __init__(self, rede, tarefa: str, names: Dict[int, str], imgsz: int, max_lote: int = 8):
+        self.tarefa = tarefa
+        self.names = names
+        self.imgsz = imgsz
+        self._ort = None
+        if hasattr(rede, "run") and hasattr(rede, "get_inputs"):
+            # Sessão do ONNX Runtime
+            self._ort = rede
+            self._entrada_ort = rede.get_inputs()[0].name
+            self._ort_fp16 = rede.get_inputs()[0].type == "tensor(float16)"
+            self.rede = None
+        else:
+            self.rede = rede
+        # Buffer de entrada reaproveitado entre chamadas, um por thread (criado no primeiro uso):
+        # o mesmo modelo em cache atende requisições simultâneas e um buffer único misturaria os pixels.
+        # Lotes maiores que max_lote usam um tensor temporário, sem ficar guardado.
+        self._max_lote = max_lote
+        self._local = threading.local()
+
+    @classmethod
+    def de_yolo(cls, yolo, imgsz: int, max_lote: int = 8) -> "ModeloDireto":
+        """Cria a partir de um objeto ultralytics.YOLO já carregado (backend PyTorch)
+
+        A rede é preparada pelo AutoBackend (fusão Conv+BN, float, sem gradiente),
+        igual ao que o predictor usa, mas chamada diretamente.
+        """
+        from ultralytics.nn.autobackend import AutoBackend
+
+        rede = AutoBackend(copy.deepcopy(yolo.model), device=torch.device("cpu"), fuse=True, verbose=False)
+        rede.eval()
+        return cls(rede, yolo.task, yolo.names, imgsz, max_lote)
+
+    @classmethod
+    def de_torchscript(cls, caminho: str, tarefa: str, imgsz: int, max_lote: int = 8) -> "ModeloDireto":
+        """Carrega um .torchscript exportado pelo Ultralytics, sem importar o Ultralytics
+
+        As classes vêm do config.txt que o exportador grava junto do modelo.
+        """
+        extra = {"config.txt": ""}
+        rede = torch.jit.load(caminho, map_location="cpu", _extra_files=extra)
+        rede.eval()
+        names = {int(k): v for k, v in json.loads(extra["config.txt"])["names"].items()}
+        return cls(rede, tarefa, names, imgsz, max_lote)
+
+    def _preparar(self, lote: np.ndarray) -> torch.Tensor:
+        """BGR uint8 (B, H, W, 3) -> RGB float (B, 3, H, W) em [0, 1] no buffer"""
+        b, h, w, _ = lote.shape
+        if h != self.imgsz or w != self.imgsz:
+            raise ValueError(f"Entrada {w}x{h} diferente do tamanho da rede {self.imgsz}x{self.imgsz}")
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None or b > buffer.shape[0]:
+            buffer = torch.empty((b, 3, h, w), dtype=torch.float32)
+            if b <= self._max_lote:
+                self._local.buffer = buffer
+        entrada = buffer[:b]
+        entrada.copy_(torch.from_numpy(lote[..., ::-1].transpose(0, 3, 1, 2).copy()))
+        entrada.div_(255.0)
+        return entrada
+
+    def _executar(self, entrada: torch.Tensor):
+        """Roda a rede e devolve (predições, protótipos ou None)"""
+        if self._ort is not None:
+            x = entrada.numpy().astype(np.float16) if self._ort_fp16 else entrada.numpy()
+            saidas = self._ort.run(None, {self._entrada_ort: x})
+            preds = torch.from_numpy(saidas[0]).float()
+            protos = torch.from_numpy(saidas[1]).float() if self.tarefa == "segment" and len(saidas) > 1 else None
+            return preds, protos
+
+        with torch.inference_mode():
+            saida = self.rede(entrada)
+        if isinstance(saida, (list, tuple)):
+            preds = saida[0]
+            protos = None
+            if isinstance(preds, (list, tuple)):
+                # Ultralytics mais recente: ((preds, protos), extras)
+                preds, protos = preds[0], (preds[1] if self.tarefa == "segment" else None)
+            elif self.tarefa == "segment":
+                # 8.0.x em eval: (preds, (feats, coefs, protos)); TorchScript exportado: (preds, protos)
+                extra = saida[1]
+                protos = extra[-1] if isinstance(extra, (list, tuple)) else extra
+            return preds, protos
+        return saida, None
+
+    def __call__(self, lote: np.ndarray, conf: float = 0.25, iou: float = 0.7,
+                 max_det: int = 300) -> List[Dict[str, np.ndarray]]:
+        """Inferência num lote BGR uint8 (B, H, W, 3)
+
+        Retorna, para cada imagem, arrays compactos: boxes (n, 4) xyxy em
+        pixels, scores (n,), classes (n,) e, para segmentação, masks (n, H, W) bool.
+        """
+        if lote.ndim == 3:
+            lote = lote[None]
+        entrada = self._preparar(lote)
+        preds, protos = self._executar(entrada)
+        return [
+            self._pos_processar(preds[i], None if protos is None else protos[i], conf, iou, max_det)
+            for i in range(preds.shape[0])
+        ]
+
+    def _pos_processar(self, pred: torch.Tensor, protos: Optional[torch.Tensor], conf: float,
+                       iou: float, max_det: int) -> Dict[str, np.ndarray]:
+        """NMS por classe e decodificação das máscaras de uma imagem"""
+        nc = len(self.names)
+        pred = pred.T  # (N, 4 + nc + nm)
+        scores_cls = pred[:, 4:4 + nc]
+        scores, classes = scores_cls.max(dim=1)
+        manter = scores > conf
+        pred, scores, classes = pred[manter], scores[manter], classes[manter]
+
+        # xywh (centro) -> xyxy
+        xy, wh = pred[:, :2], pred[:, 2:4]
+        boxes = torch.cat((xy - wh / 2, xy + wh / 2), dim=1)
+
+        indices = torchvision.ops.batched_nms(boxes, scores, classes, iou)[:max_det]
+        boxes, scores, classes = boxes[indices], scores[indices], classes[indices]
+
+        # Como no predictor: máscaras usam as caixas cruas, a saída usa caixas limitadas à imagem
+        resultado = {
+            "boxes": boxes.clamp(0, self.imgsz).numpy().astype(np.float32),
+            "scores": scores.numpy().astype(np.float32),
+            "classes": classes.numpy().astype(np.int32),
+        }
+        if protos is not None:
+            coefs = pred[indices, 4 + nc:]
+            resultado["masks"] = decodificar_mascaras(protos, coefs, boxes, (self.imgsz, self.imgsz)).numpy()
+        return resultado
+
+
+def decodificar_mascaras(protos: torch.Tensor, coefs: torch.Tensor, boxes: torch.Tensor,
+                         shape: tuple) -> torch.Tensor:
+    """Combina protótipos e coeficientes, recorta nas caixas e sobe para o tamanho da imagem
+
+    Mesma sequência do Ultralytics 8.0.x (process_mask com upsample): sigmoid na
+    resolução dos protótipos, recorte pela caixa, interpolação bilinear e limiar 0.5.
+    """
+    c, mh, mw = protos.shape
+    if coefs.shape[0] == 0:
+        return torch.zeros((0, *shape), dtype=torch.bool)
+    masks = (coefs @ protos.float().view(c, -1)).sigmoid().view(-1, mh, mw)
+
+    escala = torch.tensor([mw / shape[1], mh / shape[0], mw / shape[1], mh / shape[0]])
+    x1, y1, x2, y2 = torch.chunk((boxes * escala)[:, :, None], 4, 1)
+    colunas = torch.arange(mw, dtype=x1.dtype)[None, None, :]
+    linhas = torch.arange(mh, dtype=x1.dtype)[None, :, None]
+    masks = masks * ((colunas >= x1) * (colunas < x2) * (linhas >= y1) * (linhas < y2))
+
+    masks = F.interpolate(masks[None], shape, mode="bilinear", align_corners=False)[0]
+    return masks.gt_(0.5).bool()
@@ -0,0 +1,267 @@
+# backend_api/memoria.py
+"""Diagnóstico de memória do servidor
+
+Mede o RSS do processo antes e depois de cada requisição e mantém
+estatísticas por endpoint (variação média, máxima e acumulada numa janela
+das últimas MEMORIA_JANELA requisições). Com 2 threads no gunicorn, duas
+requisições simultâneas dividem o mesmo RSS: essas medições são contadas
+como "sobrepostas" e ficam fora da janela.
+
+As rotas /admin/memoria exigem o cabeçalho X-Admin-Token igual a ADMIN_TOKEN
+e permitem ligar o tracemalloc e comparar snapshots para achar os pontos de
+alocação que mais crescem. O tracemalloc só enxerga alocações feitas pelo
+Python (incluindo os arrays do NumPy); memória do PyTorch, ONNX Runtime e
+OpenCV aparece só no RSS. Para rastrear desde o boot: PYTHONTRACEMALLOC=10.
+"""
+import collections
+import ctypes
+import ctypes.util
+import hmac
+import os
+import statistics
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from flask import abort, g, jsonify, request
+
+MEMORIA_MONITORAR = os.environ.get("MEMORIA_MONITORAR", "1") == "1"
+MEMORIA_JANELA = int(os.environ.get("MEMORIA_JANELA", "100"))  # Requisições por endpoint nas estatísticas
+# Devolve ao sistema a memória livre do malloc depois de cada requisição POST
+MEMORIA_MALLOC_TRIM = os.environ.get("MEMORIA_MALLOC_TRIM", "1") == "1"
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN") or None
+
+try:
+    import psutil
+    _processo = psutil.Process()
+except ImportError:
+    _processo = None
+
+_libc = None
+if MEMORIA_MALLOC_TRIM:
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+        _libc.malloc_trim  # Só existe na glibc
+    except (OSError, AttributeError):
+        _libc = None
+
+
+def rss_mb() -> float:
+    """Memória residente do processo em MB"""
+    if _processo is not None:
+        return _processo.memory_info().rss / 2**20
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def malloc_trim() -> bool:
+    """Devolve ao sistema as páginas livres do heap (glibc); False se indisponível"""
+    if _libc is None:
+        return False
+    _libc.malloc_trim(0)
+    return True
+
+
+def tamanho_pastas_mb(pastas: List[str]) -> Dict[str, float]:
+    """Espaço ocupado pelos arquivos de cada pasta (no Cloud Run, /tmp fica na memória)"""
+    tamanhos = {}
+    for pasta in pastas:
+        total = 0
+        if os.path.isdir(pasta):
+            for nome in os.listdir(pasta):
+                try:
+                    total += os.path.getsize(os.path.join(pasta, nome))
+                except OSError:
+                    continue
+        tamanhos[pasta] = round(total / 2**20, 2)
+    return tamanhos
+
+
+class EstatisticasMemoria:
+    """Variação de RSS por endpoint, com janela das últimas requisições"""
+
+    def __init__(self, janela: int = MEMORIA_JANELA):
+        self._lock = threading.Lock()
+        self._janela = janela
+        self._endpoints: Dict[str, Dict] = {}
+        self.em_andamento = 0
+        self.rss_inicial = rss_mb()
+        self.rss_pico = self.rss_inicial
+        self.iniciado_em = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    def entrar(self) -> bool:
+        """Marca o início de uma requisição; retorna se já havia outra em andamento"""
+        with self._lock:
+            self.em_andamento += 1
+            return self.em_andamento > 1
+
+    def sair(self, endpoint: str, antes: float, depois: float, sobreposta: bool) -> None:
+        delta = depois - antes
+        with self._lock:
+            self.em_andamento -= 1
+            self.rss_pico = max(self.rss_pico, depois)
+            e = self._endpoints.setdefault(endpoint, {
+                "requisicoes": 0, "sobrepostas": 0, "delta_total_mb": 0.0, "delta_max_mb": 0.0,
+                "deltas": collections.deque(maxlen=self._janela),
+            })
+            e["requisicoes"] += 1
+            e["delta_total_mb"] += delta
+            e["delta_max_mb"] = max(e["delta_max_mb"], delta)
+            e["rss_ultimo_mb"] = depois
+            if sobreposta or self.em_andamento > 0:
+                e["sobrepostas"] += 1
+            else:
+                e["deltas"].append(delta)
+
+    def resumo(self) -> Dict:
+        with self._lock:
+            endpoints = {}
+            for nome, e in self._endpoints.items():
+                deltas = list(e["deltas"])
+                endpoints[nome] = {
+                    "requisicoes": e["requisicoes"],
+                    "sobrepostas": e["sobrepostas"],
+                    "delta_total_mb": round(e["delta_total_mb"], 2),
+                    "delta_max_mb": round(e["delta_max_mb"], 2),
+                    "rss_ultimo_mb": round(e["rss_ultimo_mb"], 1),
+                    # Janela: um vazamento aparece como mediana positiva e soma crescente
+                    "janela": len(deltas),
+                    "delta_medio_mb": round(statistics.fmean(deltas), 3) if deltas else None,
+                    "delta_mediano_mb": round(statistics.median(deltas), 3) if deltas else None,
+                    "delta_janela_mb": round(sum(deltas), 2),
+                }
+            return {
+                "rss_atual_mb": round(rss_mb(), 1),
+                "rss_inicial_mb": round(self.rss_inicial, 1),
+                "rss_pico_mb": round(self.rss_pico, 1),
+                "iniciado_em": self.iniciado_em,
+                "endpoints": endpoints,
+            }
+
+
+estatisticas = EstatisticasMemoria()
+
+# Snapshots do tracemalloc: o primeiro (base) e o da última comparação
+_snapshots: Dict[str, Optional[tracemalloc.Snapshot]] = {"base": None, "anterior": None}
+_lock_snapshots = threading.Lock()
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+
+
+def comparar_snapshots(top: int = 20, agrupar: str = "lineno", base: str = "anterior") -> Dict:
+    """Tira um snapshot e compara com o anterior (ou com o primeiro, base="base")
+
+    Retorna os pontos de alocação que mais cresceram no intervalo.
+    """
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc não está ativo")
+    with _lock_snapshots:
+        atual = _snapshot()
+        referencia = _snapshots[base] or _snapshots["base"]
+        _snapshots["anterior"] = atual
+        if _snapshots["base"] is None:
+            _snapshots["base"] = atual
+    if referencia is None:
+        return {"comparado_com": None, "crescimento": [],
+                "total_mb": round(sum(s.size for s in atual.statistics("filename")) / 2**20, 2)}
+
+    diferencas = atual.compare_to(referencia, agrupar)
+    crescimento = []
+    for diff in diferencas[:top]:
+        crescimento.append({
+            "local": [f"{quadro.filename}:{quadro.lineno}" for quadro in diff.traceback],
+            "delta_kb": round(diff.size_diff / 1024, 1),
+            "total_kb": round(diff.size / 1024, 1),
+            "delta_blocos": diff.count_diff,
+        })
+    return {
+        "comparado_com": base,
+        "crescimento": crescimento,
+        "delta_total_kb": round(sum(d.size_diff for d in diferencas) / 1024, 1),
+        "total_mb": round(sum(d.size for d in diferencas) / 2**20, 2),
+    }
+
+
+def _autorizado() -> bool:
+    valor = request.headers.get("X-Admin-Token")
+    return bool(ADMIN_TOKEN) and valor is not None and hmac.compare_digest(valor, ADMIN_TOKEN)
+
+
+def registrar(app, pastas_temporarias: Optional[List[str]] = None) -> None:
+    """Liga a medição por requisição e as rotas /admin/memoria ao app Flask"""
+    pastas_temporarias = pastas_temporarias or []
+
+    if MEMORIA_MONITORAR:
+        @app.before_request
+        def _memoria_antes():
+            g.memoria_sobreposta = estatisticas.entrar()
+            g.memoria_antes = rss_mb()
+
+        @app.teardown_request
+        def _memoria_depois(_erro=None):
+            antes = g.pop("memoria_antes", None)
+            if antes is None:
+                return
+            if request.method == "POST":
+                malloc_trim()
+            endpoint = request.url_rule.rule if request.url_rule else request.path
+            estatisticas.sair(endpoint, antes, rss_mb(), g.pop("memoria_sobreposta", False))
+
+    @app.route("/admin/memoria", methods=["GET"])
+    def memoria_endpoint():
+        """RSS atual e variação por endpoint"""
+        if not _autorizado():
+            abort(404)
+        return jsonify({
+            **estatisticas.resumo(),
+            "pastas_temporarias_mb": tamanho_pastas_mb(pastas_temporarias),
+            "malloc_trim": _libc is not None,
+            "tracemalloc": {"ativo": tracemalloc.is_tracing(),
+                            "quadros": tracemalloc.get_traceback_limit() if tracemalloc.is_tracing() else None},
+        })
+
+    @app.route("/admin/memoria/tracemalloc", methods=["POST"])
+    def tracemalloc_endpoint():
+        """{"acao": "iniciar" | "parar", "quadros": 10}"""
+        if not _autorizado():
+            abort(404)
+        dados = request.get_json(silent=True) or {}
+        acao = dados.get("acao")
+        if acao == "iniciar":
+            try:
+                quadros = int(dados.get("quadros", 10))
+            except (TypeError, ValueError):
+                return jsonify({"error": "quadros inválido"}), 400
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(quadros)
+            with _lock_snapshots:
+                _snapshots["base"] = _snapshots["anterior"] = _snapshot()
+            return jsonify({"ativo": True, "quadros": tracemalloc.get_traceback_limit()})
+        if acao == "parar":
+            tracemalloc.stop()
+            with _lock_snapshots:
+                _snapshots["base"] = _snapshots["anterior"] = None
+            return jsonify({"ativo": False})
+        return jsonify({"error": "acao deve ser 'iniciar' ou 'parar'"}), 400
+
+    @app.route("/admin/memoria/snapshot", methods=["GET"])
+    def snapshot_endpoint():
+        """Maiores crescimentos desde o snapshot anterior (?base=base compara com o primeiro)"""
+        if not _autorizado():
+            abort(404)
+        agrupar = request.args.get("agrupar", "lineno")
+        base = request.args.get("base", "anterior")
+        if agrupar not in ("lineno", "filename", "traceback") or base not in ("anterior", "base"):
+            return jsonify({"error": "agrupar deve ser lineno, filename ou traceback; base, anterior ou base"}), 400
+        try:
+            return jsonify(comparar_snapshots(request.args.get("top", 20, type=int), agrupar, base))
+        except RuntimeError as e:
+            return jsonify({"error": str(e)}), 409
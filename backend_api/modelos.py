@@ -0,0 +1,352 @@
+# backend_api/modelos.py
+"""Registro de modelos versionados por cultura e tarefa, com troca a quente
+
+Modelos treinados de novo não exigem uma imagem nova do container: ficam em
+MODELOS_DIR, descritos em manifesto.json (um id por cultura e tarefa):
+
+    {"modelos": [{"id": "tomate-lesoes", "cultura": "tomate", "tarefa": "segment",
+                  "versao": "2026.10", "arquivo": "tomate-lesoes/2026.10.pt",
+                  "sha256": "..."}],
+     "ativos": {"tomate-lesoes": "2026.10"}}
+
+- Cada requisição resolve as versões ativas uma vez (obter_perfil guarda os
+  caminhos no perfil), então todas as etapas dela usam o mesmo modelo. Uma
+  troca vale para as requisições seguintes; as que estão em andamento
+  terminam na versão antiga.
+- POST /admin/modelos/<id>/ativar regrava o manifesto de forma atômica
+  (arquivo temporário + os.replace); os outros workers percebem a troca pela
+  data de modificação do manifesto.
+- O checksum é conferido no primeiro uso de cada arquivo e ao ativar. Versão
+  com arquivo ausente ou corrompido não é servida: vale o modelo embutido na
+  imagem (MODEL_PATH/DETECTION_MODEL_PATH em app.py).
+- Os modelos carregados ficam num cache LRU limitado por MODELOS_MAX e
+  MODELOS_MEMORIA_MB (o tamanho dos arquivos de pesos serve de estimativa).
+- Cada modelo carregado roda uma chamada por vez (lock_de_uso), seja qual for
+  o endpoint: /predict, /predict_lote, /ao_vivo etc. dividem os mesmos objetos.
+"""
+import collections
+import concurrent.futures
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import weakref
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from flask import abort, jsonify, request
+
+from memoria import ADMIN_TOKEN
+
+MODELOS_DIR = os.environ.get("MODELOS_DIR", "modelos")
+MODELOS_MAX = int(os.environ.get("MODELOS_MAX", "8"))  # Modelos carregados ao mesmo tempo
+MODELOS_MEMORIA_MB = float(os.environ.get("MODELOS_MEMORIA_MB", "0"))  # 0 = sem limite
+CULTURA_PADRAO = os.environ.get("CULTURA_PADRAO", "pimenta")
+TAREFAS = ("segment", "detect")
+TAMANHO_BLOCO = 1 << 20
+
+log = logging.getLogger(__name__)
+
+
+def sha256_arquivo(caminho: str) -> str:
+    h = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(TAMANHO_BLOCO), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def tamanho_mb(caminho: str) -> float:
+    try:
+        return os.path.getsize(caminho) / 2**20
+    except OSError:
+        return 0.0
+
+
+def ler_cultura(valor: Any) -> str:
+    """Cultura da requisição (padrão CULTURA_PADRAO), em minúsculas"""
+    if valor is None or valor == "":
+        return CULTURA_PADRAO
+    if not isinstance(valor, str) or len(valor) > 50:
+        raise ValueError("cultura deve ser um texto de até 50 caracteres")
+    return valor.strip().lower()
+
+
+class Registro:
+    """Manifesto de MODELOS_DIR: versões de cada modelo e a ativa de cada um"""
+
+    def __init__(self, pasta: str = MODELOS_DIR):
+        self.pasta = pasta
+        self.manifesto = os.path.join(pasta, "manifesto.json")
+        self._lock = threading.Lock()
+        self._lido_em: Optional[int] = None  # st_mtime_ns do manifesto lido
+        self._versoes: Dict[str, Dict[str, Dict]] = {}  # id -> versão -> entrada
+        self._ativos: Dict[str, str] = {}
+        self._conferidos: Dict[str, tuple] = {}  # caminho -> (mtime, tamanho, sha256 calculado)
+        self.erros: Dict[str, str] = {}  # "id@versão" -> motivo de não servir
+
+    def _ler_manifesto(self) -> Dict:
+        with open(self.manifesto, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _atualizar(self) -> None:
+        """Relê o manifesto se ele mudou desde a última leitura (um stat por chamada)"""
+        try:
+            lido_em = os.stat(self.manifesto).st_mtime_ns
+        except OSError:
+            lido_em = None
+        if lido_em == self._lido_em:
+            return
+        versoes, ativos = {}, {}
+        if lido_em is not None:
+            try:
+                dados = self._ler_manifesto()
+                for entrada in dados.get("modelos", []):
+                    if entrada.get("tarefa") not in TAREFAS or not entrada.get("sha256"):
+                        log.warning("Entrada do manifesto ignorada (tarefa inválida ou sem sha256): %s", entrada)
+                        continue
+                    entrada = {**entrada, "cultura": ler_cultura(entrada["cultura"]),
+                               "caminho": os.path.join(self.pasta, entrada["arquivo"])}
+                    versoes.setdefault(entrada["id"], {})[entrada["versao"]] = entrada
+                ativos = dict(dados.get("ativos", {}))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                log.error("Manifesto de modelos inválido (%s), mantendo o anterior: %s", self.manifesto, e)
+                return
+        with self._lock:
+            self._versoes, self._ativos, self._lido_em = versoes, ativos, lido_em
+        log.info("Manifesto de modelos lido: %d modelos, ativos %s", len(versoes), ativos)
+
+    def _conferir(self, entrada: Dict) -> Optional[str]:
+        """None se o arquivo existe e bate com o sha256; senão o motivo
+
+        O hash é calculado uma vez por arquivo (e de novo se ele mudar no disco),
+        fora do lock: só a leitura e a gravação de _conferidos passam por ele.
+        """
+        caminho = entrada["caminho"]
+        try:
+            st = os.stat(caminho)
+        except OSError:
+            return f"arquivo ausente: {caminho}"
+        with self._lock:
+            conferido = self._conferidos.get(caminho)
+        if conferido is None or conferido[:2] != (st.st_mtime_ns, st.st_size):
+            conferido = (st.st_mtime_ns, st.st_size, sha256_arquivo(caminho))
+            with self._lock:
+                self._conferidos[caminho] = conferido
+        if not hmac.compare_digest(conferido[2], entrada["sha256"].lower()):
+            return f"sha256 não confere: {caminho}"
+        return None
+
+    def _entrada(self, id_modelo: str, versao: str) -> Dict:
+        with self._lock:
+            try:
+                return self._versoes[id_modelo][versao]
+            except KeyError:
+                raise KeyError(f"Modelo {id_modelo}@{versao} não está no manifesto") from None
+
+    def ativo(self, cultura: str, tarefa: str) -> Optional[Dict]:
+        """Entrada da versão ativa para a cultura e tarefa (None: usar o modelo embutido)"""
+        self._atualizar()
+        entrada = None
+        with self._lock:
+            for id_modelo, versoes in self._versoes.items():
+                exemplo = next(iter(versoes.values()))
+                if exemplo["cultura"] == cultura and exemplo["tarefa"] == tarefa:
+                    entrada = versoes.get(self._ativos.get(id_modelo))
+                    break
+        if entrada is None:
+            return None
+        rotulo = f"{entrada['id']}@{entrada['versao']}"
+        erro = self._conferir(entrada)
+        with self._lock:
+            novo = erro is not None and self.erros.get(rotulo) != erro
+            if erro is None:
+                self.erros.pop(rotulo, None)
+            else:
+                self.erros[rotulo] = erro
+        if novo:
+            log.error("Modelo %s não será usado: %s", rotulo, erro)
+        return None if erro is not None else entrada
+
+    def ativo_do_modelo(self, id_modelo: str) -> Optional[Dict]:
+        """Entrada da versão ativa de um id do manifesto (sem conferir o arquivo)"""
+        self._atualizar()
+        with self._lock:
+            return self._versoes.get(id_modelo, {}).get(self._ativos.get(id_modelo))
+
+    def ativar(self, id_modelo: str, versao: str, aquecer: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Torna a versão a ativa do modelo; retorna a entrada ativada
+
+        KeyError se não estiver no manifesto, ValueError se o arquivo não
+        conferir. aquecer(entrada) carrega o modelo antes da troca, para a
+        primeira requisição na versão nova não pagar o carregamento.
+        """
+        self._atualizar()
+        entrada = self._entrada(id_modelo, versao)
+        erro = self._conferir(entrada)
+        if erro is not None:
+            raise ValueError(erro)
+        if aquecer is not None:
+            aquecer(entrada)
+        with self._lock:
+            dados = self._ler_manifesto()
+            dados.setdefault("ativos", {})[id_modelo] = versao
+            temporario = f"{self.manifesto}.{os.getpid()}.tmp"
+            with open(temporario, "w", encoding="utf-8") as f:
+                json.dump(dados, f, ensure_ascii=False, indent=2)
+            os.replace(temporario, self.manifesto)
+            self._ativos[id_modelo] = versao
+            self._lido_em = os.stat(self.manifesto).st_mtime_ns
+        log.info("Modelo %s: versão ativa agora é %s", id_modelo, versao)
+        return entrada
+
+    def resumo(self) -> Dict:
+        self._atualizar()
+        with self._lock:
+            modelos = []
+            for id_modelo, versoes in self._versoes.items():
+                exemplo = next(iter(versoes.values()))
+                modelos.append({"id": id_modelo, "cultura": exemplo["cultura"], "tarefa": exemplo["tarefa"],
+                                "ativa": self._ativos.get(id_modelo), "versoes": sorted(versoes)})
+            erros = dict(self.erros)
+        return {"pasta": self.pasta, "cultura_padrao": CULTURA_PADRAO, "modelos": modelos, "erros": erros}
+
+
+_locks_uso: "weakref.WeakKeyDictionary[Any, threading.Lock]" = weakref.WeakKeyDictionary()
+_lock_locks_uso = threading.Lock()
+
+
+def lock_de_uso(modelo: Any) -> threading.Lock:
+    """Lock que serializa as chamadas a um modelo carregado
+
+    O predictor do Ultralytics guarda estado no objeto YOLO e não aceita
+    chamadas simultâneas. O lock acompanha o objeto: some quando o modelo sai
+    do cache e a última requisição que o usava termina.
+    """
+    with _lock_locks_uso:
+        lock = _locks_uso.get(modelo)
+        if lock is None:
+            lock = _locks_uso[modelo] = threading.Lock()
+        return lock
+
+
+class CacheModelos:
+    """Modelos carregados, do menos para o mais usado recentemente
+
+    Passando de MODELOS_MAX modelos ou de MODELOS_MEMORIA_MB, os menos usados
+    saem do cache. Tirar do cache só solta a referência: uma requisição que
+    já pegou o modelo termina com ele.
+    """
+
+    def __init__(self, maximo: int = MODELOS_MAX, memoria_mb: float = MODELOS_MEMORIA_MB):
+        self.maximo = maximo
+        self.memoria_mb = memoria_mb
+        self._itens: "collections.OrderedDict[Hashable, tuple]" = collections.OrderedDict()  # chave -> (modelo, MB)
+        self._carregando: Dict[Hashable, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self.contadores = {"carregados": 0, "despejados": 0}
+
+    def obter(self, chave: Hashable, criar: Callable[[], Any], caminho: str) -> Any:
+        """Modelo em cache ou criar()
+
+        criar() roda fora do lock: só quem pede a mesma chave espera por ela
+        (no Future do carregamento em andamento); as outras chaves seguem.
+        """
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None:
+                self._itens.move_to_end(chave)
+                return item[0]
+            futuro = self._carregando.get(chave)
+            dono = futuro is None
+            if dono:
+                futuro = self._carregando[chave] = concurrent.futures.Future()
+        if not dono:
+            return futuro.result()
+        try:
+            modelo = criar()
+        except BaseException as e:
+            with self._lock:
+                del self._carregando[chave]
+            futuro.set_exception(e)
+            raise
+        with self._lock:
+            self._itens[chave] = (modelo, tamanho_mb(caminho))
+            del self._carregando[chave]
+            self.contadores["carregados"] += 1
+            self._despejar()
+        futuro.set_result(modelo)
+        return modelo
+
+    def _memoria(self) -> float:
+        return sum(mb for _, mb in self._itens.values())
+
+    def _despejar(self) -> None:
+        # O recém-carregado (último) nunca sai, mesmo sozinho acima do limite
+        while len(self._itens) > 1 and (len(self._itens) > self.maximo or
+                                        (self.memoria_mb and self._memoria() > self.memoria_mb)):
+            chave, _ = self._itens.popitem(last=False)
+            self.contadores["despejados"] += 1
+            log.info("Modelo %s saiu do cache (menos usado)", chave)
+
+    def rebaixar(self, filtro: Callable[[Hashable], bool]) -> None:
+        """Passa as chaves do filtro para o fim da fila (são as primeiras a sair)"""
+        with self._lock:
+            for chave in [c for c in self._itens if filtro(c)]:
+                self._itens.move_to_end(chave, last=False)
+
+    def descartar(self, filtro: Callable[[Hashable], bool]) -> None:
+        with self._lock:
+            for chave in [c for c in self._itens if filtro(c)]:
+                del self._itens[chave]
+
+    def resumo(self) -> Dict:
+        with self._lock:
+            return {"modelos": [str(c) for c in self._itens], "memoria_mb": round(self._memoria(), 1),
+                    "maximo": self.maximo, "memoria_max_mb": self.memoria_mb or None, **self.contadores}
+
+
+registro = Registro()
+
+
+def _autorizado() -> bool:
+    valor = request.headers.get("X-Admin-Token")
+    return bool(ADMIN_TOKEN) and valor is not None and hmac.compare_digest(valor, ADMIN_TOKEN)
+
+
+def registrar_rotas(app, cache: CacheModelos, aquecer: Callable[[Dict], None]) -> None:
+    """GET /admin/modelos e POST /admin/modelos/<id>/ativar (cabeçalho X-Admin-Token)"""
+
+    @app.route("/admin/modelos", methods=["GET"])
+    def modelos_endpoint():
+        """Modelos do manifesto, versões ativas e o cache de modelos carregados"""
+        if not _autorizado():
+            abort(404)
+        return jsonify({**registro.resumo(), "cache": cache.resumo()})
+
+    @app.route("/admin/modelos/<id_modelo>/ativar", methods=["POST"])
+    def ativar_endpoint(id_modelo: str):
+        """{"versao": "2026.10", "aquecer": true}: troca a versão ativa do modelo"""
+        if not _autorizado():
+            abort(404)
+        dados = request.get_json(silent=True) or {}
+        versao = dados.get("versao")
+        if not isinstance(versao, str) or not versao:
+            return jsonify({"error": "versao é obrigatória"}), 400
+        anterior = registro.ativo_do_modelo(id_modelo)
+        try:
+            entrada = registro.ativar(id_modelo, versao, aquecer if dados.get("aquecer", True) else None)
+        except KeyError as e:
+            return jsonify({"error": str(e.args[0])}), 404
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 409
+        except Exception as e:
+            log.exception("Falha ao aquecer %s@%s: %s", id_modelo, versao, e)
+            return jsonify({"error": f"Falha ao carregar o modelo: {e}"}), 500
+        # A versão anterior fica no cache só enquanto não faltar espaço
+        if anterior is not None and anterior["caminho"] != entrada["caminho"]:
+            cache.rebaixar(lambda chave: anterior["caminho"] in chave)
+        return jsonify({"id": id_modelo, "versao": versao,
+                        "anterior": anterior["versao"] if anterior else None, "cultura": entrada["cultura"],
+                        "tarefa": entrada["tarefa"]})
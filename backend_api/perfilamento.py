@@ -0,0 +1,196 @@
+# backend_api/perfilamento.py
+"""Perfilamento sob demanda de requisições individuais
+
+Liga-se com PROFILING_TOKEN (requisições com o cabeçalho X-Profile igual ao
+token são perfiladas) e/ou PROFILING_AMOSTRAGEM (fração de requisições
+perfiladas ao acaso, ex.: 0.01). Sem nenhum dos dois, o decorador devolve a
+própria função e o custo é zero.
+
+Cada perfil é gravado em PROFILING_PASTA com o id da requisição: HTML e
+speedscope (pyinstrument, amostragem) ou .prof/.txt (cProfile, se o
+pyinstrument não estiver instalado). GET /profiles lista os mais recentes.
+"""
+import functools
+import hmac
+import json
+import logging
+import os
+import random
+import time
+from typing import Callable, Dict, List, Optional
+
+from flask import abort, g, jsonify, make_response, request, send_from_directory
+
+from registro import novo_id_requisicao
+
+log = logging.getLogger(__name__)
+
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN") or None
+PROFILING_AMOSTRAGEM = float(os.environ.get("PROFILING_AMOSTRAGEM", "0"))
+PROFILING_PASTA = os.environ.get("PROFILING_PASTA", "/tmp/profiles")
+PROFILING_MAX = int(os.environ.get("PROFILING_MAX", "50"))  # Perfis guardados (os mais antigos saem)
+PROFILING_INTERVALO = float(os.environ.get("PROFILING_INTERVALO", "0.001"))  # Amostragem do pyinstrument (s)
+
+PERFILAMENTO_ATIVO = bool(PROFILING_TOKEN) or PROFILING_AMOSTRAGEM > 0
+
+
+def _token_valido(valor: Optional[str]) -> bool:
+    return bool(PROFILING_TOKEN) and valor is not None and hmac.compare_digest(valor, PROFILING_TOKEN)
+
+
+def _deve_perfilar() -> Optional[str]:
+    """Motivo para perfilar esta requisição ("cabecalho" ou "amostragem"), ou None"""
+    if _token_valido(request.headers.get("X-Profile")):
+        return "cabecalho"
+    if PROFILING_AMOSTRAGEM > 0 and random.random() < PROFILING_AMOSTRAGEM:
+        return "amostragem"
+    return None
+
+
+class _Captura:
+    """Perfilador da requisição: pyinstrument (amostragem) ou cProfile como alternativa"""
+
+    def __init__(self):
+        try:
+            from pyinstrument import Profiler
+            self.tipo = "pyinstrument"
+            self._perfilador = Profiler(interval=PROFILING_INTERVALO, async_mode="disabled")
+        except ImportError:
+            import cProfile
+            self.tipo = "cprofile"
+            self._perfilador = cProfile.Profile()
+
+    def iniciar(self) -> None:
+        if self.tipo == "pyinstrument":
+            self._perfilador.start()
+        else:
+            self._perfilador.enable()
+
+    def parar(self) -> None:
+        if self.tipo == "pyinstrument":
+            self._perfilador.stop()
+        else:
+            self._perfilador.disable()
+
+    def salvar(self, base: str) -> List[str]:
+        """Grava os arquivos do perfil com o prefixo base; retorna os nomes gravados"""
+        if self.tipo == "pyinstrument":
+            from pyinstrument.renderers import SpeedscopeRenderer
+            arquivos = {f"{base}.html": self._perfilador.output_html(),
+                        f"{base}.speedscope.json": self._perfilador.output(SpeedscopeRenderer())}
+            for nome, conteudo in arquivos.items():
+                with open(os.path.join(PROFILING_PASTA, nome), "w") as f:
+                    f.write(conteudo)
+            return list(arquivos)
+
+        import io
+        import pstats
+        self._perfilador.dump_stats(os.path.join(PROFILING_PASTA, f"{base}.prof"))
+        texto = io.StringIO()
+        pstats.Stats(self._perfilador, stream=texto).sort_stats("cumulative").print_stats(60)
+        with open(os.path.join(PROFILING_PASTA, f"{base}.txt"), "w") as f:
+            f.write(texto.getvalue())
+        return [f"{base}.prof", f"{base}.txt"]
+
+
+def _limpar_antigos() -> None:
+    """Mantém só os PROFILING_MAX perfis mais recentes"""
+    indices = sorted((nome for nome in os.listdir(PROFILING_PASTA) if nome.endswith(".meta.json")), reverse=True)
+    for nome in indices[PROFILING_MAX:]:
+        base = nome[:-len(".meta.json")]
+        for arquivo in os.listdir(PROFILING_PASTA):
+            if arquivo.startswith(base):
+                os.remove(os.path.join(PROFILING_PASTA, arquivo))
+
+
+def _salvar_perfil(captura: _Captura, id_requisicao: str, motivo: str, duracao: float, status: int) -> None:
+    os.makedirs(PROFILING_PASTA, exist_ok=True)
+    # Prefixo com data: a ordem alfabética dos arquivos é a ordem cronológica
+    base = f"{time.strftime('%Y%m%dT%H%M%S')}_{id_requisicao}"
+    meta = {
+        "id": id_requisicao,
+        "endpoint": request.path,
+        "motivo": motivo,
+        "status": status,
+        "duracao_s": round(duracao, 3),
+        "criado_em": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "perfilador": captura.tipo,
+        "arquivos": captura.salvar(base),
+    }
+    with open(os.path.join(PROFILING_PASTA, f"{base}.meta.json"), "w") as f:
+        json.dump(meta, f)
+    _limpar_antigos()
+    log.info("Perfil de %s salvo em %s/%s.*", request.path, PROFILING_PASTA, base,
+             extra={"campos": {"perfil": base, "duracao_ms": round(duracao * 1000, 1)}})
+
+
+def perfilar(funcao: Callable) -> Callable:
+    """Decorador de endpoint: perfila a requisição quando pedido pelo cabeçalho ou sorteada"""
+    if not PERFILAMENTO_ATIVO:
+        return funcao
+
+    @functools.wraps(funcao)
+    def envolvida(*args, **kwargs):
+        motivo = _deve_perfilar()
+        if motivo is None:
+            return funcao(*args, **kwargs)
+
+        g.id_requisicao = getattr(g, "id_requisicao", None) or novo_id_requisicao(request.headers.get("X-Request-ID"))
+        captura = _Captura()
+        inicio = time.perf_counter()
+        captura.iniciar()
+        try:
+            resposta = funcao(*args, **kwargs)
+        finally:
+            captura.parar()
+        duracao = time.perf_counter() - inicio
+
+        resposta = make_response(resposta)
+        try:
+            _salvar_perfil(captura, g.id_requisicao, motivo, duracao, resposta.status_code)
+            resposta.headers["X-Profile-Id"] = g.id_requisicao
+        except Exception as e:
+            # Falha ao gravar o perfil nunca derruba a requisição
+            log.warning("Não foi possível salvar o perfil %s: %s", g.id_requisicao, e)
+        return resposta
+
+    return envolvida
+
+
+def _autorizado() -> bool:
+    """As rotas de perfis exigem o token (os perfis mostram detalhes internos do servidor)"""
+    return _token_valido(request.headers.get("X-Profile") or request.args.get("token"))
+
+
+def _listar(limite: int) -> List[Dict]:
+    if not os.path.isdir(PROFILING_PASTA):
+        return []
+    indices = sorted((nome for nome in os.listdir(PROFILING_PASTA) if nome.endswith(".meta.json")), reverse=True)
+    perfis = []
+    for nome in indices[:limite]:
+        try:
+            with open(os.path.join(PROFILING_PASTA, nome)) as f:
+                perfis.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return perfis
+
+
+def registrar_rotas(app) -> None:
+    """Adiciona GET /profiles (índice) e GET /profiles/<arquivo> ao app Flask"""
+
+    @app.route("/profiles", methods=["GET"])
+    def listar_perfis():
+        """Perfis capturados mais recentes"""
+        if not _autorizado():
+            abort(404)
+        limite = request.args.get("limite", 20, type=int)
+        return jsonify({"perfis": _listar(limite), "pasta": PROFILING_PASTA,
+                        "amostragem": PROFILING_AMOSTRAGEM})
+
+    @app.route("/profiles/<path:arquivo>", methods=["GET"])
+    def baixar_perfil(arquivo):
+        """Arquivo de um perfil (HTML abre direto no navegador; speedscope em speedscope.app)"""
+        if not _autorizado():
+            abort(404)
+        return send_from_directory(PROFILING_PASTA, arquivo)
@@ -0,0 +1,175 @@
+# backend_api/pipeline.py
+"""Pipeline em estágios para processar várias imagens de uma vez
+
+Cada estágio roda em suas próprias threads e os estágios são ligados por filas
+limitadas: enquanto uma imagem está no rembg, a anterior está no YOLO e a
+anterior a ela está sendo codificada. As filas cheias bloqueiam o estágio
+anterior (backpressure), então a memória fica limitada a poucas imagens em voo.
+OpenCV, ONNX Runtime e PyTorch liberam o GIL nas partes pesadas, o que permite
+sobreposição real em instâncias com mais de uma vCPU sem criar processos.
+"""
+import contextvars
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Marca de fim de fluxo passada de um estágio para o seguinte
+_FIM = object()
+
+
+class Estagio:
+    """Um estágio do pipeline: função aplicada a cada item por N threads
+
+    Com lote informado, a função recebe uma lista com até "lote" itens que já
+    estejam esperando na fila (sem aguardar a fila encher).
+    """
+
+    def __init__(self, nome: str, funcao: Callable, workers: int = 1, lote: Optional[int] = None):
+        if workers < 1 or (lote is not None and lote < 1):
+            raise ValueError(f"Estágio {nome}: workers e lote devem ser >= 1")
+        self.nome = nome
+        self.funcao = funcao
+        self.workers = workers
+        self.em_lote = lote is not None
+        self.lote = lote or 1
+        self.ocupado = 0.0  # Tempo total gasto na função, somado entre as threads
+        self._lock = threading.Lock()
+        self._ativos = workers
+
+
+class Pipeline:
+    """Encadeia estágios com filas limitadas entre eles
+
+    Cada item é um dicionário com "indice", "dados" (entrada e resultados
+    intermediários, modificados no lugar pelas funções dos estágios), "erro"
+    e "tempos". Se um estágio falhar, o erro fica registrado no item e os
+    estágios seguintes são pulados para ele, sem parar os demais itens.
+    """
+
+    def __init__(self, estagios: List[Tuple], tamanho_fila: int = 2):
+        """estagios: tuplas (nome, função, workers) ou (nome, função, workers, lote)"""
+        if not estagios:
+            raise ValueError("Pipeline precisa de pelo menos um estágio")
+        self.estagios = [Estagio(*estagio) for estagio in estagios]
+        self.tamanho_fila = tamanho_fila
+
+    def _coletar(self, estagio: Estagio, entrada: queue.Queue) -> Tuple[List[Dict], bool]:
+        """Pega um item (bloqueando) e, se o estágio trabalha em lote, os que já estão na fila"""
+        itens, fim = [], False
+        item = entrada.get()
+        while True:
+            if item is _FIM:
+                fim = True
+                break
+            itens.append(item)
+            if len(itens) >= estagio.lote:
+                break
+            try:
+                item = entrada.get_nowait()
+            except queue.Empty:
+                break
+        return itens, fim
+
+    def _worker(self, indice: int, entrada: queue.Queue, saida: queue.Queue) -> None:
+        estagio = self.estagios[indice]
+        while True:
+            itens, fim = self._coletar(estagio, entrada)
+            validos = [item for item in itens if item["erro"] is None]
+            if validos:
+                inicio = time.perf_counter()
+                try:
+                    if estagio.em_lote:
+                        estagio.funcao([item["dados"] for item in validos])
+                    else:
+                        estagio.funcao(validos[0]["dados"])
+                except Exception as e:
+                    for item in validos:
+                        item["erro"] = f"{estagio.nome}: {e}"
+                duracao = time.perf_counter() - inicio
+                for item in validos:
+                    item["tempos"][estagio.nome] = duracao / len(validos)
+                with estagio._lock:
+                    estagio.ocupado += duracao
+            for item in itens:
+                saida.put(item)
+            if fim:
+                with estagio._lock:
+                    estagio._ativos -= 1
+                    ultimo = estagio._ativos == 0
+                # O último worker a terminar avisa todas as threads do próximo estágio
+                if ultimo:
+                    proximos = self.estagios[indice + 1].workers if indice + 1 < len(self.estagios) else 1
+                    for _ in range(proximos):
+                        saida.put(_FIM)
+                return
+
+    def executar(self, entradas: Iterable[Any]) -> List[Dict]:
+        """Passa todas as entradas pelo pipeline e devolve os itens na ordem original
+
+        Se o iterável de entradas falhar, os itens já enviados terminam e a
+        exceção é relançada aqui.
+        """
+        for estagio in self.estagios:
+            estagio.ocupado = 0.0
+            estagio._ativos = estagio.workers
+
+        filas = [queue.Queue(maxsize=self.tamanho_fila) for _ in range(len(self.estagios) + 1)]
+        threads = []
+        for i, estagio in enumerate(self.estagios):
+            for n in range(estagio.workers):
+                # Cada thread roda numa cópia do contexto de quem chamou (id da requisição nos logs)
+                t = threading.Thread(target=contextvars.copy_context().run,
+                                     args=(self._worker, i, filas[i], filas[i + 1]),
+                                     name=f"pipeline-{estagio.nome}-{n}", daemon=True)
+                t.start()
+                threads.append(t)
+
+        falha = []
+
+        def alimentar():
+            # Bloqueia quando a primeira fila enche: só entra imagem nova quando há vaga
+            try:
+                for indice, dados in enumerate(entradas):
+                    filas[0].put({"indice": indice, "dados": dados, "erro": None, "tempos": {}})
+            except BaseException as e:
+                falha.append(e)
+            finally:
+                # Sempre encerra os workers, senão executar fica esperando o _FIM para sempre
+                for _ in range(self.estagios[0].workers):
+                    filas[0].put(_FIM)
+
+        alimentador = threading.Thread(target=alimentar, name="pipeline-entrada", daemon=True)
+        alimentador.start()
+
+        resultados = []
+        while True:
+            item = filas[-1].get()
+            if item is _FIM:
+                break
+            resultados.append(item)
+
+        alimentador.join()
+        for t in threads:
+            t.join()
+        if falha:
+            raise falha[0]
+        return sorted(resultados, key=lambda item: item["indice"])
+
+    def ocupacao(self) -> Dict[str, float]:
+        """Tempo gasto em cada estágio na última execução (segundos)"""
+        return {estagio.nome: estagio.ocupado for estagio in self.estagios}
+
+
+def parse_workers(texto: Optional[str], padrao: Dict[str, int]) -> Dict[str, int]:
+    """Lê "estagio=n,estagio=n" (ex.: variável de ambiente) sobre os valores padrão"""
+    workers = dict(padrao)
+    for parte in (texto or "").split(","):
+        if not parte.strip():
+            continue
+        nome, _, valor = parte.partition("=")
+        nome = nome.strip()
+        if nome not in workers:
+            raise ValueError(f"Estágio desconhecido: {nome}")
+        workers[nome] = int(valor)
+    return workers
@@ -0,0 +1,169 @@
+# backend_api/registro.py
+"""Logs estruturados do servidor
+
+Substitui os print() do caminho quente por logging com níveis. Em produção
+(LOG_FORMATO=json) cada linha é um objeto JSON com "severity" e "message",
+que o Cloud Logging lê diretamente, mais o id da requisição e os campos
+extras de cada registro. Ao fim de cada requisição sai uma linha
+"requisicao" com status, duração e o tempo de cada etapa (etapa("rembg")...).
+
+Níveis: LOG_NIVEL (INFO por padrão). Com LOG_DEBUG_AMOSTRAGEM=0.01, 1% das
+requisições registram também o nível DEBUG: as demais descartam as mensagens
+de depuração antes de formatá-las. Mensagens de DEBUG usam argumentos no
+estilo log.debug("x = %s", x), formatados só quando o registro é emitido, e
+os cálculos mais caros ficam atrás de debug_ativo().
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+LOG_NIVEL = os.environ.get("LOG_NIVEL", "INFO").upper()
+LOG_FORMATO = os.environ.get("LOG_FORMATO", "json")  # "json" ou "texto"
+LOG_DEBUG_AMOSTRAGEM = float(os.environ.get("LOG_DEBUG_AMOSTRAGEM", "0"))
+
+# Estado da requisição atual; o pipeline copia o contexto para as threads dos estágios
+_id_requisicao: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("id_requisicao", default=None)
+_debug_requisicao: contextvars.ContextVar[bool] = contextvars.ContextVar("debug_requisicao", default=False)
+_tempos: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("tempos", default=None)
+_lock_tempos = threading.Lock()
+
+_DEBUG_GLOBAL = LOG_NIVEL == "DEBUG"
+
+
+def debug_ativo() -> bool:
+    """Se mensagens DEBUG serão emitidas agora (nível global ou requisição sorteada)"""
+    return _DEBUG_GLOBAL or _debug_requisicao.get()
+
+
+def id_requisicao() -> Optional[str]:
+    return _id_requisicao.get()
+
+
+@contextlib.contextmanager
+def etapa(nome: str):
+    """Soma o tempo do bloco na etapa "nome" da requisição atual (nada fora de requisições)"""
+    tempos = _tempos.get()
+    if tempos is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracao = time.perf_counter() - inicio
+        with _lock_tempos:
+            tempos[nome] = tempos.get(nome, 0.0) + duracao
+
+
+class _FiltroDebug(logging.Filter):
+    """Descarta DEBUG fora das requisições sorteadas, antes de qualquer formatação"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or debug_ativo()
+
+
+class FormatadorJSON(logging.Formatter):
+    """Uma linha JSON por registro; extra={"campos": {...}} vira campos de primeiro nível"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        linha = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "severity": record.levelname,
+            "message": record.getMessage(),
+            "logger": record.name,
+        }
+        requisicao = _id_requisicao.get()
+        if requisicao:
+            linha["request_id"] = requisicao
+        linha.update(getattr(record, "campos", None) or {})
+        if record.exc_info:
+            linha["exception"] = self.formatException(record.exc_info)
+        return json.dumps(linha, ensure_ascii=False, default=str)
+
+
+class FormatadorTexto(logging.Formatter):
+    """Formato legível para desenvolvimento local"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        texto = f"{record.levelname:<7} {record.getMessage()}"
+        requisicao = _id_requisicao.get()
+        if requisicao:
+            texto = f"[{requisicao[:8]}] {texto}"
+        campos = getattr(record, "campos", None)
+        if campos:
+            texto += " " + " ".join(f"{k}={v}" for k, v in campos.items())
+        if record.exc_info:
+            texto += "\n" + self.formatException(record.exc_info)
+        return texto
+
+
+def configurar() -> None:
+    """Configura o logger raiz uma única vez (stdout, formato e nível do ambiente)"""
+    raiz = logging.getLogger()
+    if any(getattr(h, "_registro", False) for h in raiz.handlers):
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler._registro = True
+    handler.setFormatter(FormatadorJSON() if LOG_FORMATO == "json" else FormatadorTexto())
+    handler.addFilter(_FiltroDebug())
+    raiz.addHandler(handler)
+    # Com amostragem o logger deixa passar DEBUG e o filtro decide por requisição
+    raiz.setLevel(logging.DEBUG if _DEBUG_GLOBAL or LOG_DEBUG_AMOSTRAGEM > 0 else LOG_NIVEL)
+    # Bibliotecas ruidosas ficam no nível configurado, mesmo com DEBUG amostrado
+    for nome in ("werkzeug", "PIL", "matplotlib", "urllib3"):
+        logging.getLogger(nome).setLevel(max(logging.INFO, logging.getLevelName(LOG_NIVEL)))
+
+
+def novo_id_requisicao(recebido: Optional[str]) -> str:
+    """Id do cabeçalho X-Request-ID (só caracteres seguros) ou um novo"""
+    if recebido and len(recebido) <= 64 and all(c.isalnum() or c in "-_" for c in recebido):
+        return recebido
+    return uuid.uuid4().hex
+
+
+def registrar(app) -> None:
+    """Id por requisição (devolvido em X-Request-ID) e uma linha de resumo ao fim de cada uma"""
+    from flask import g, request
+
+    log = logging.getLogger("requisicao")
+
+    @app.before_request
+    def _registro_inicio():
+        g.id_requisicao = novo_id_requisicao(request.headers.get("X-Request-ID"))
+        g.registro_tokens = (
+            _id_requisicao.set(g.id_requisicao),
+            _debug_requisicao.set(LOG_DEBUG_AMOSTRAGEM > 0 and random.random() < LOG_DEBUG_AMOSTRAGEM),
+            _tempos.set({}),
+        )
+        g.registro_inicio = time.perf_counter()
+
+    @app.after_request
+    def _registro_cabecalho(resposta):
+        resposta.headers["X-Request-ID"] = g.id_requisicao
+        g.registro_status = resposta.status_code
+        return resposta
+
+    @app.teardown_request
+    def _registro_fim(erro=None):
+        tokens = g.pop("registro_tokens", None)
+        if tokens is None:
+            return
+        # /pronto e outras consultas rápidas só entram nos logs em DEBUG
+        nivel = logging.INFO if request.method == "POST" else logging.DEBUG
+        tempos = _tempos.get() or {}
+        log.log(nivel, "%s %s", request.method, request.path, extra={"campos": {
+            "status": g.pop("registro_status", 500),
+            "duracao_ms": round((time.perf_counter() - g.pop("registro_inicio")) * 1000, 1),
+            "etapas_ms": {nome: round(t * 1000, 1) for nome, t in tempos.items()},
+            **({"erro": str(erro)} if erro is not None else {}),
+        }})
+        for var, token in zip((_id_requisicao, _debug_requisicao, _tempos), tokens):
+            var.reset(token)
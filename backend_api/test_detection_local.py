@@ -2,21 +2,38 @@
 """
 Script para testar localmente a detecção de doenças
 Uso: python test_detection_local.py caminho_da_imagem
+
+Em lote (ensaios de campo com milhares de fotos), para uma pasta ou glob:
+    python test_detection_local.py fotos/ --saida resultados.csv [--overlays pasta]
+    python test_detection_local.py "ensaio/**/*.jpg" --saida resultados.parquet --processos 4 --lote 16
+
+Cada processo do pool carrega o modelo uma vez e roda lotes de imagens
+direto da memória (sem o arquivo temporário). Os resultados são gravados
+conforme ficam prontos; rodar o mesmo comando de novo retoma de onde parou,
+pulando as imagens que já estão na saída.
 """
 
+import argparse
+import csv
+import json
 import sys
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 import cv2
 import numpy as np
 from ultralytics import YOLO
 import glob
-from typing import Dict, List
+from typing import Dict, Iterable, List, Optional, Set
+
+EXTENSOES = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+TAMANHO_DETECCAO = 256
+CAMPOS = ["arquivo", "largura", "altura", "doenca", "confianca", "n_deteccoes", "deteccoes", "tempo_ms", "erro"]
 
-def test_detection_local(image_path: str):
+def test_detection_local(image_path: str, model_path: str = "modelo-deteccao.pt", conf: float = 0.3):
     """Testa a detecção localmente usando a mesma lógica do servidor"""
     
     # Carregar modelo
-    model_path = "modelo-deteccao.pt"
     if not os.path.exists(model_path):
         print(f"❌ Modelo não encontrado: {model_path}")
         return
@@ -47,16 +64,12 @@ def test_detection_local(image_path: str):
         return
     
     print(f"📐 Dimensões originais: {img.shape}")
-    img_resized = cv2.resize(img, (256, 256), interpolation=cv2.INTER_CUBIC)
+    img_resized = cv2.resize(img, (TAMANHO_DETECCAO, TAMANHO_DETECCAO), interpolation=cv2.INTER_CUBIC)
+    print(f"✅ Imagem redimensionada para {TAMANHO_DETECCAO}x{TAMANHO_DETECCAO}")
     
-    # Salvar imagem redimensionada temporariamente
-    temp_path = "temp_resized_256.jpg"
-    cv2.imwrite(temp_path, img_resized)
-    print(f"✅ Imagem redimensionada para 256x256")
-    
-    # Fazer inferência
+    # Fazer inferência (direto da memória, como no modo em lote)
     print("🔍 Executando inferência...")
-    results = model.predict(temp_path, conf=0.3, save=False)
+    results = model.predict(img_resized, conf=conf, imgsz=TAMANHO_DETECCAO, save=False)
     
     print(f"📊 Número de resultados: {len(results)}")
     
@@ -101,24 +114,12 @@ def test_detection_local(image_path: str):
     
     # Plotar detecções (igual ao servidor)
     plot_path = "test_detection_result.jpg"
-    plot_detections_local(temp_path, detections, plot_path)
-    
-    # Limpar arquivo temporário
-    if os.path.exists(temp_path):
-        os.remove(temp_path)
-    
+    cv2.imwrite(plot_path, desenhar_deteccoes(img_resized, detections))
     print(f"🖼️  Resultado salvo em: {plot_path}")
     print("✅ Teste concluído!")
 
-def plot_detections_local(image_path: str, detections: List[Dict], output_path: str) -> None:
-    """Plota bounding boxes com confidence na imagem"""
-    
-    # Carregar imagem
-    img = cv2.imread(image_path)
-    if img is None:
-        print(f"Erro ao carregar imagem para plotagem: {image_path}")
-        return
-    
+def desenhar_deteccoes(img: np.ndarray, detections: List[Dict]) -> np.ndarray:
+    """Desenha as caixas (classe e confiança) sobre a imagem, que é alterada e devolvida"""
     # Cores para diferentes classes (BGR format)
     colors = {
         'cercosporiose': (0, 255, 0),     # Verde
@@ -150,16 +151,231 @@ def plot_detections_local(image_path: str, detections: List[Dict], output_path:
         
         # Texto
         cv2.putText(img, label, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-    
-    # Salvar imagem com detecções
-    cv2.imwrite(output_path, img)
-    print(f"[DEBUG] Imagem com detecções salva: {output_path}")
+
+    return img
+
+# --- Processamento em lote ---
+
+def listar_imagens(entrada: str) -> List[str]:
+    """Imagens de uma pasta (recursivo) ou de um glob, em ordem"""
+    if os.path.isdir(entrada):
+        caminhos = [os.path.join(raiz, nome) for raiz, _, nomes in os.walk(entrada) for nome in nomes]
+    else:
+        caminhos = glob.glob(entrada, recursive=True)
+    return sorted(c for c in caminhos if c.lower().endswith(EXTENSOES) and os.path.isfile(c))
+
+class EscritorCSV:
+    """Resultados num CSV, uma linha por imagem, gravado a cada lote"""
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        novo = not os.path.exists(caminho) or os.path.getsize(caminho) == 0
+        if not novo:
+            self._descartar_linha_incompleta()
+        self._arquivo = open(caminho, "a", newline="", encoding="utf-8")
+        self._csv = csv.DictWriter(self._arquivo, fieldnames=CAMPOS)
+        if novo:
+            self._csv.writeheader()
+            self._arquivo.flush()
+
+    def _descartar_linha_incompleta(self) -> None:
+        # Uma interrupção no meio da escrita deixa a última linha pela metade
+        with open(self.caminho, "rb+") as f:
+            conteudo = f.read()
+            if not conteudo.endswith(b"\n"):
+                f.truncate(conteudo.rfind(b"\n") + 1)
+
+    def processados(self) -> Set[str]:
+        with open(self.caminho, newline="", encoding="utf-8") as f:
+            return {linha["arquivo"] for linha in csv.DictReader(f) if linha.get("arquivo")}
+
+    def gravar(self, linhas: List[Dict]) -> None:
+        self._csv.writerows(linhas)
+        self._arquivo.flush()
+
+    def fechar(self) -> None:
+        self._arquivo.close()
+
+class EscritorParquet:
+    """Resultados numa pasta de partes Parquet (lidas juntas com pd.read_parquet(pasta))
+
+    Parquet não aceita acrescentar linhas a um arquivo: a cada linhas_por_parte
+    resultados sai uma parte nova, escrita num temporário e renomeada. Uma
+    interrupção perde só as linhas ainda não gravadas, que são refeitas ao
+    retomar.
+    """
+
+    def __init__(self, pasta: str, linhas_por_parte: int = 500):
+        try:
+            import pandas as pd  # Parquet é opcional
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise ImportError("Saída .parquet precisa de pandas e pyarrow (pip install pandas pyarrow)") from e
+        self.pd = pd
+        self.pasta = pasta
+        self.linhas_por_parte = linhas_por_parte
+        self._pendentes: List[Dict] = []
+        os.makedirs(pasta, exist_ok=True)
+        self._partes = len(glob.glob(os.path.join(pasta, "parte-*.parquet")))
+
+    def processados(self) -> Set[str]:
+        if self._partes == 0:
+            return set()
+        return set(self.pd.read_parquet(self.pasta, columns=["arquivo"])["arquivo"])
+
+    def gravar(self, linhas: List[Dict], forcar: bool = False) -> None:
+        self._pendentes.extend(linhas)
+        if not self._pendentes or (len(self._pendentes) < self.linhas_por_parte and not forcar):
+            return
+        destino = os.path.join(self.pasta, f"parte-{self._partes:05d}.parquet")
+        temporario = os.path.join(self.pasta, f".parte-{self._partes:05d}.tmp")  # Ocultos não entram na leitura
+        self.pd.DataFrame(self._pendentes, columns=CAMPOS).to_parquet(temporario, index=False)
+        os.replace(temporario, destino)
+        self._partes += 1
+        self._pendentes = []
+
+    def fechar(self) -> None:
+        self.gravar([], forcar=True)
+
+# Estado de cada processo do pool: o modelo é carregado uma vez, no inicializador
+_modelo = None
+_config: Dict = {}
+
+def _iniciar_processo(model_path: str, conf: float, overlays: Optional[str], base: str, threads: int) -> None:
+    global _modelo
+    import torch
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(1)
+    _modelo = YOLO(model_path)
+    _config.update(conf=conf, overlays=overlays, base=base)
+
+def _caminho_overlay(caminho: str) -> str:
+    """Mesma estrutura de pastas da entrada dentro da pasta de overlays"""
+    relativo = os.path.splitext(os.path.relpath(caminho, _config["base"]))[0]
+    destino = os.path.join(_config["overlays"], relativo + "_deteccao.jpg")
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    return destino
+
+def processar_lote(caminhos: List[str]) -> List[Dict]:
+    """Detecta doença num lote de imagens (roda no processo do pool); uma linha por imagem"""
+    inicio = time.perf_counter()
+    linhas, imagens, validas = [], [], []
+    for caminho in caminhos:
+        img = cv2.imread(caminho)
+        if img is None:
+            linhas.append({"arquivo": caminho, "erro": "imagem ilegível"})
+            continue
+        linhas.append({"arquivo": caminho, "largura": img.shape[1], "altura": img.shape[0]})
+        # Redimensionar para 256x256 (igual ao servidor)
+        imagens.append(cv2.resize(img, (TAMANHO_DETECCAO, TAMANHO_DETECCAO), interpolation=cv2.INTER_CUBIC))
+        validas.append(linhas[-1])
+    try:
+        resultados = _modelo.predict(imagens, conf=_config["conf"], imgsz=TAMANHO_DETECCAO, verbose=False) \
+            if imagens else []
+    except Exception as e:
+        for linha in validas:
+            linha["erro"] = str(e)
+        return linhas
+    tempo_ms = round((time.perf_counter() - inicio) * 1000 / len(caminhos), 1)
+    for linha, img, result in zip(validas, imagens, resultados):
+        detections = []
+        if result.boxes is not None:
+            for box, conf, cls in zip(result.boxes.xyxy.tolist(), result.boxes.conf.tolist(),
+                                      result.boxes.cls.tolist()):
+                detections.append({"bbox": [round(v, 1) for v in box], "confidence": round(conf, 4),
+                                   "class_id": int(cls), "class_name": result.names[int(cls)]})
+        detections.sort(key=lambda x: x["confidence"], reverse=True)
+        principal = detections[0] if detections else None
+        linha.update(doenca=principal["class_name"] if principal else "",
+                     confianca=principal["confidence"] if principal else 0.0,
+                     n_deteccoes=len(detections), deteccoes=json.dumps(detections), tempo_ms=tempo_ms)
+        if _config["overlays"] and detections:
+            cv2.imwrite(_caminho_overlay(linha["arquivo"]), desenhar_deteccoes(img, detections))
+    return linhas
+
+def _lotes(caminhos: List[str], tamanho: int) -> Iterable[List[str]]:
+    for i in range(0, len(caminhos), tamanho):
+        yield caminhos[i:i + tamanho]
+
+def processar_em_lote(entrada: str, saida: str, model_path: str = "modelo-deteccao.pt", conf: float = 0.3,
+                      lote: int = 16, processos: Optional[int] = None, overlays: Optional[str] = None) -> Dict:
+    """Processa as imagens da entrada gravando em saida (.csv ou .parquet); retoma se a saída já existir"""
+    caminhos = listar_imagens(entrada)
+    escritor = EscritorParquet(saida) if saida.endswith(".parquet") else EscritorCSV(saida)
+    feitos = escritor.processados()
+    pendentes = [c for c in caminhos if c not in feitos]
+    print(f"📁 {len(caminhos)} imagens em {entrada}: {len(caminhos) - len(pendentes)} já processadas, "
+          f"{len(pendentes)} pendentes")
+    processos = processos or max(1, (os.cpu_count() or 2) // 2)
+    threads = max(1, (os.cpu_count() or 1) // processos)
+    base = entrada if os.path.isdir(entrada) else (os.path.commonpath(pendentes) if pendentes else ".")
+    if os.path.isfile(base):
+        base = os.path.dirname(base)
+
+    estatisticas = {"processadas": 0, "erros": 0, "com_doenca": 0, "classes": {}}
+    inicio = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(processos, initializer=_iniciar_processo,
+                                 initargs=(model_path, conf, overlays, base, threads)) as pool:
+            lotes = _lotes(pendentes, lote)
+            em_voo = set()
+            while True:
+                # Até 2 lotes por processo em voo: a memória não cresce com o tamanho da pasta
+                while len(em_voo) < 2 * processos:
+                    proximo = next(lotes, None)
+                    if proximo is None:
+                        break
+                    em_voo.add(pool.submit(processar_lote, proximo))
+                if not em_voo:
+                    break
+                prontos, em_voo = wait(em_voo, return_when=FIRST_COMPLETED)
+                for futuro in prontos:
+                    linhas = futuro.result()
+                    escritor.gravar(linhas)
+                    for linha in linhas:
+                        estatisticas["processadas"] += 1
+                        if linha.get("erro"):
+                            estatisticas["erros"] += 1
+                        elif linha["doenca"]:
+                            estatisticas["com_doenca"] += 1
+                            estatisticas["classes"][linha["doenca"]] = estatisticas["classes"].get(linha["doenca"], 0) + 1
+                decorrido = time.perf_counter() - inicio
+                print(f"\r⏳ {estatisticas['processadas']}/{len(pendentes)} "
+                      f"({estatisticas['processadas'] / decorrido:.1f} img/s)", end="", flush=True)
+    finally:
+        escritor.fechar()
+
+    decorrido = time.perf_counter() - inicio
+    estatisticas.update(pendentes=len(pendentes), segundos=round(decorrido, 1),
+                        imagens_por_s=round(estatisticas["processadas"] / decorrido, 2) if decorrido else 0.0)
+    print(f"\n\n📊 RESUMO: {estatisticas['processadas']} imagens em {decorrido:.1f}s "
+          f"({estatisticas['imagens_por_s']:.2f} img/s; {processos} processos x {threads} threads, lote {lote})")
+    print(f"   🎯 Com doença: {estatisticas['com_doenca']}   ❌ Erros: {estatisticas['erros']}")
+    for classe, n in sorted(estatisticas["classes"].items(), key=lambda item: -item[1]):
+        print(f"   🏷️  {classe}: {n}")
+    print(f"💾 Resultados em: {saida}")
+    return estatisticas
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("❌ Uso: python test_detection_local.py <caminho_da_imagem>")
-        print("📝 Exemplo: python test_detection_local.py ../frontend_flet/assets/mosaico.jpg")
+    parser = argparse.ArgumentParser(description="Detecção de doenças local: uma imagem, ou uma pasta/glob em lote")
+    parser.add_argument("entrada", help="Imagem, pasta ou glob (entre aspas, ex.: 'ensaio/**/*.jpg')")
+    parser.add_argument("--saida", help="CSV ou .parquet com os resultados (ativa o modo em lote)")
+    parser.add_argument("--modelo", default="modelo-deteccao.pt")
+    parser.add_argument("--conf", type=float, default=0.3)
+    parser.add_argument("--lote", type=int, default=16, help="Imagens por chamada ao modelo")
+    parser.add_argument("--processos", type=int, help="Processos do pool (padrão: metade das CPUs)")
+    parser.add_argument("--overlays", help="Pasta para as imagens com as detecções desenhadas")
+    args = parser.parse_args()
+
+    if os.path.isfile(args.entrada) and not args.saida:
+        test_detection_local(args.entrada, args.modelo, args.conf)
+    elif not os.path.exists(args.modelo):
+        print(f"❌ Modelo não encontrado: {args.modelo}")
         sys.exit(1)
-    
-    image_path = sys.argv[1]
-    test_detection_local(image_path)
+    else:
+        try:
+            processar_em_lote(args.entrada, args.saida or "resultados_deteccao.csv", args.modelo, args.conf,
+                              args.lote, args.processos, args.overlays)
+        except ImportError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
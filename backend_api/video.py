@@ -0,0 +1,183 @@
+# backend_api/video.py
+"""Amostragem de quadros de vídeos curtos para a análise de severidade
+
+Um vídeo curto percorrendo a diagonal da lavoura substitui dezenas de fotos.
+O vídeo é lido quadro a quadro (cv2.VideoCapture), sem carregar o arquivo
+todo na memória, e os quadros são escolhidos assim:
+
+- só VIDEO_ANALISE_FPS quadros por segundo são examinados (os demais são
+  apenas avançados com grab());
+- quadros com movimento grande em relação ao anterior (câmera passando
+  rápido) são ignorados;
+- a cada VIDEO_INTERVALO_S de vídeo fica o quadro mais nítido (variância do
+  laplaciano numa versão reduzida em cinza);
+- o escolhido é descartado se for quase igual ao último selecionado (dHash
+  com distância de Hamming até VIDEO_DUPLICADO_BITS).
+
+Em memória ficam só o quadro candidato da janela atual e a miniatura do
+último selecionado; os selecionados seguem direto para o pipeline (que tem
+filas limitadas), então o consumo não depende da duração do vídeo. O arquivo
+em si fica em /tmp, limitado por VIDEO_MAX_MB.
+"""
+import hashlib
+import logging
+import os
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from duplicatas import dhash, distancia_hamming
+
+VIDEO_MAX_MB = float(os.environ.get("VIDEO_MAX_MB", "50"))
+VIDEO_ANALISE_FPS = float(os.environ.get("VIDEO_ANALISE_FPS", "10"))
+VIDEO_INTERVALO_S = float(os.environ.get("VIDEO_INTERVALO_S", "0.5"))
+VIDEO_MAX_QUADROS = int(os.environ.get("VIDEO_MAX_QUADROS", "30"))
+VIDEO_NITIDEZ_MIN = float(os.environ.get("VIDEO_NITIDEZ_MIN", "20"))  # Variância do laplaciano na miniatura
+VIDEO_MOVIMENTO_MAX = float(os.environ.get("VIDEO_MOVIMENTO_MAX", "0.25"))  # Diferença média entre quadros (0-1)
+VIDEO_DUPLICADO_BITS = int(os.environ.get("VIDEO_DUPLICADO_BITS", "6"))  # De 64 bits do dHash
+MINIATURA_LARGURA = 160
+TAMANHO_BLOCO = 1 << 20  # Cópia do upload para o disco em blocos de 1 MB
+
+log = logging.getLogger(__name__)
+
+
+class VideoGrande(Exception):
+    """Upload acima de VIDEO_MAX_MB"""
+
+
+def salvar_upload(origem: BinaryIO, destino: str, limite_mb: float = VIDEO_MAX_MB) -> str:
+    """Copia o upload para o disco em blocos; retorna o SHA-256 do conteúdo"""
+    limite = int(limite_mb * 2**20)
+    h = hashlib.sha256()
+    total = 0
+    with open(destino, "wb") as f:
+        while True:
+            bloco = origem.read(TAMANHO_BLOCO)
+            if not bloco:
+                break
+            total += len(bloco)
+            if total > limite:
+                raise VideoGrande(f"Vídeo maior que {limite_mb:.0f} MB")
+            h.update(bloco)
+            f.write(bloco)
+    return h.hexdigest()
+
+
+def _miniatura(quadro: np.ndarray) -> np.ndarray:
+    h, w = quadro.shape[:2]
+    cinza = cv2.cvtColor(quadro, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(cinza, (MINIATURA_LARGURA, max(1, round(h * MINIATURA_LARGURA / w))),
+                      interpolation=cv2.INTER_AREA)
+
+
+def abrir(caminho: str) -> Tuple[cv2.VideoCapture, Dict]:
+    """Abre o vídeo e lê as propriedades; ValueError se não for um vídeo legível"""
+    captura = cv2.VideoCapture(caminho)
+    if not captura.isOpened():
+        captura.release()
+        raise ValueError("Arquivo não é um vídeo suportado")
+    fps = captura.get(cv2.CAP_PROP_FPS)
+    info = {
+        "fps": round(fps, 2) if fps and fps > 0 else None,
+        "quadros": int(captura.get(cv2.CAP_PROP_FRAME_COUNT)) or None,
+        "largura": int(captura.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "altura": int(captura.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+    }
+    return captura, info
+
+
+class AmostradorVideo:
+    """Iterador dos quadros selecionados: (índice no vídeo, tempo em s, quadro BGR, nitidez)
+
+    As contagens da amostragem ficam em .estatisticas; erros de leitura no
+    meio do vídeo encerram a iteração (registrados em estatisticas["erro"]),
+    para não travar quem consome o iterador em outra thread. O VideoCapture é
+    solto ao fim da iteração e em close(); use com "with" para soltá-lo
+    também quando a iteração nem começa ou é abandonada no meio.
+    """
+
+    def __init__(self, caminho: str, max_quadros: int = VIDEO_MAX_QUADROS):
+        self.captura, self.info = abrir(caminho)
+        self.max_quadros = max_quadros
+        self.estatisticas = {"lidos": 0, "examinados": 0, "movimento": 0, "borrados": 0,
+                             "duplicados": 0, "selecionados": 0, "erro": None}
+        self._hash_selecionado: Optional[int] = None
+
+    def __iter__(self) -> Iterator[Tuple[int, float, np.ndarray, float]]:
+        try:
+            yield from self._amostrar()
+        except Exception as e:
+            log.exception("Erro lendo o vídeo: %s", e)
+            self.estatisticas["erro"] = str(e)
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self.captura.release()  # Chamar de novo não faz nada
+
+    def __enter__(self) -> "AmostradorVideo":
+        return self
+
+    def __exit__(self, *excecao) -> None:
+        self.close()
+
+    def _aceitar(self, hash_quadro: int) -> bool:
+        """Fechamento de janela: o candidato só segue se não repetir o último selecionado"""
+        if self._hash_selecionado is not None and \
+                distancia_hamming(hash_quadro, self._hash_selecionado) <= VIDEO_DUPLICADO_BITS:
+            self.estatisticas["duplicados"] += 1
+            return False
+        self._hash_selecionado = hash_quadro
+        self.estatisticas["selecionados"] += 1
+        return True
+
+    def _amostrar(self) -> Iterator[Tuple[int, float, np.ndarray, float]]:
+        e = self.estatisticas
+        fps = self.info["fps"] or 30.0
+        passo = max(1, round(fps / VIDEO_ANALISE_FPS))
+        anterior: Optional[np.ndarray] = None  # Miniatura do último quadro examinado
+        candidato = None  # (índice, tempo, quadro, nitidez, hash) mais nítido da janela atual
+        fim_janela = VIDEO_INTERVALO_S
+        indice = -1
+
+        while e["selecionados"] < self.max_quadros:
+            indice += 1
+            if indice % passo:
+                if not self.captura.grab():
+                    break
+                e["lidos"] += 1
+                continue
+            ok, quadro = self.captura.read()
+            if not ok:
+                break
+            e["lidos"] += 1
+            e["examinados"] += 1
+            tempo = indice / fps
+
+            if tempo >= fim_janela:
+                # Fecha a janela: segue o quadro mais nítido dela
+                if candidato is not None and self._aceitar(candidato[4]):
+                    yield candidato[:4]
+                    if e["selecionados"] >= self.max_quadros:
+                        return
+                candidato = None
+                fim_janela = (tempo // VIDEO_INTERVALO_S + 1) * VIDEO_INTERVALO_S
+
+            miniatura = _miniatura(quadro)
+            movimento = 0.0 if anterior is None or anterior.shape != miniatura.shape else \
+                float(cv2.absdiff(miniatura, anterior).mean()) / 255
+            anterior = miniatura
+            if movimento > VIDEO_MOVIMENTO_MAX:
+                e["movimento"] += 1
+                continue
+            nitidez = float(cv2.Laplacian(miniatura, cv2.CV_64F).var())
+            if nitidez < VIDEO_NITIDEZ_MIN:
+                e["borrados"] += 1
+                continue
+            if candidato is None or nitidez > candidato[3]:
+                candidato = (indice, round(tempo, 2), quadro, round(nitidez, 1), dhash(miniatura))
+
+        # Última janela do vídeo
+        if candidato is not None and e["selecionados"] < self.max_quadros and self._aceitar(candidato[4]):
+            yield candidato[:4]
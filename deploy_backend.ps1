@@ -35,7 +35,23 @@ try {
     Write-Host "🏗️ Fazendo build da imagem Docker..." -ForegroundColor Yellow
     gcloud builds submit --tag $IMAGE_NAME .
 
-    # 6. Deploy no Cloud Run
+    # 6. Histórico dos talhões (SQLite, banco.py): sem volume, o arquivo fica em /tmp e some com a instância.
+    # Com $env:BANCO_NFS = "IP_DO_FILESTORE:/compartilhamento" o volume NFS é montado em /dados (rede VPC em
+    # VPC_REDE/VPC_SUBREDE). Em NFS o SQLite usa o journal DELETE (o WAL não funciona em rede): as instâncias,
+    # inclusive as da revisão anterior durante o rollout, gravam uma de cada vez pelos locks do NFS.
+    $OPCOES_BANCO = @()
+    if ($env:BANCO_NFS) {
+        $REDE = if ($env:VPC_REDE) { $env:VPC_REDE } else { "default" }
+        $SUBREDE = if ($env:VPC_SUBREDE) { $env:VPC_SUBREDE } else { "default" }
+        $OPCOES_BANCO = @("--execution-environment", "gen2", "--network", $REDE, "--subnet", $SUBREDE,
+            "--add-volume", "name=dados,type=nfs,location=$($env:BANCO_NFS)",
+            "--add-volume-mount", "volume=dados,mount-path=/dados",
+            "--update-env-vars", "BANCO_ARQUIVO=/dados/cultivatrack.db,BANCO_JOURNAL=DELETE")
+    } else {
+        Write-Host "⚠️ BANCO_NFS não definido: o histórico dos talhões fica em /tmp e se perde quando a instância para" -ForegroundColor Yellow
+    }
+
+    # 7. Deploy no Cloud Run
     Write-Host "🚀 Fazendo deploy no Cloud Run..." -ForegroundColor Yellow
     gcloud run deploy $SERVICE_NAME `
         --image $IMAGE_NAME `
@@ -46,15 +62,16 @@ try {
         --cpu 1 `
         --timeout 300 `
         --max-instances 10 `
-        --port 8080
+        --port 8080 `
+        @OPCOES_BANCO
 
-    # 7. Obter URL do serviço
+    # 8. Obter URL do serviço
     Write-Host "🌐 Obtendo URL do serviço..." -ForegroundColor Yellow
     $SERVICE_URL = gcloud run services describe $SERVICE_NAME --platform managed --region $REGION --format="value(status.url)"
     Write-Host "✅ Backend deployado com sucesso!" -ForegroundColor Green
     Write-Host "🌍 URL: $SERVICE_URL" -ForegroundColor Cyan
 
-    # 8. Testar o serviço
+    # 9. Testar o serviço
     Write-Host "🧪 Testando o serviço..." -ForegroundColor Yellow
     try {
         Invoke-WebRequest -Uri $SERVICE_URL -Method GET -TimeoutSec 30 | Out-Null
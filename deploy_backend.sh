@@ -36,7 +36,22 @@ cd backend_api
 echo "🏗️ Fazendo build da imagem Docker..."
 gcloud builds submit --tag $IMAGE_NAME .
 
-# 6. Deploy no Cloud Run
+# 6. Histórico dos talhões (SQLite, banco.py): sem volume, o arquivo fica em /tmp e some com a instância.
+# Com BANCO_NFS="IP_DO_FILESTORE:/compartilhamento" o volume NFS é montado em /dados (rede VPC em
+# VPC_REDE/VPC_SUBREDE). Em NFS o SQLite usa o journal DELETE (o WAL não funciona em rede): as instâncias,
+# inclusive as da revisão anterior durante o rollout, gravam uma de cada vez pelos locks do NFS.
+OPCOES_BANCO=()
+if [ -n "$BANCO_NFS" ]; then
+    OPCOES_BANCO=(--execution-environment gen2
+        --network "${VPC_REDE:-default}" --subnet "${VPC_SUBREDE:-default}"
+        --add-volume "name=dados,type=nfs,location=$BANCO_NFS"
+        --add-volume-mount "volume=dados,mount-path=/dados"
+        --update-env-vars "BANCO_ARQUIVO=/dados/cultivatrack.db,BANCO_JOURNAL=DELETE")
+else
+    echo "⚠️ BANCO_NFS não definido: o histórico dos talhões fica em /tmp e se perde quando a instância para"
+fi
+
+# 7. Deploy no Cloud Run
 echo "🚀 Fazendo deploy no Cloud Run..."
 gcloud run deploy $SERVICE_NAME \
     --image $IMAGE_NAME \
@@ -47,15 +62,16 @@ gcloud run deploy $SERVICE_NAME \
     --cpu 1 \
     --timeout 300 \
     --max-instances 10 \
-    --port 8080
+    --port 8080 \
+    "${OPCOES_BANCO[@]}"
 
-# 7. Obter URL do serviço
+# 8. Obter URL do serviço
 echo "🌐 Obtendo URL do serviço..."
 SERVICE_URL=$(gcloud run services describe $SERVICE_NAME --platform managed --region $REGION --format="value(status.url)")
 echo "✅ Backend deployado com sucesso!"
 echo "🌍 URL: $SERVICE_URL"
 
-# 8. Testar o serviço
+# 9. Testar o serviço
 echo "🧪 Testando o serviço..."
 if curl -f "$SERVICE_URL/" > /dev/null 2>&1; then
     echo "✅ Serviço está respondendo!"
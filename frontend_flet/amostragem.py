@@ -0,0 +1,98 @@
+# frontend_flet/amostragem.py
+"""Amostragem sequencial do levantamento de severidade
+
+A recomendação de amostragem (26 plantas por 0,5 ha, 3 folhas por planta)
+passa de mil folhas em áreas grandes, mas a decisão que importa é só uma:
+a severidade média do campo está abaixo ou acima do limiar de tratamento
+(5%, ver gerar_recomendacao na API). O estimador acompanha a média e o
+intervalo de confiança conforme os resultados chegam e diz quando dá para
+parar:
+
+- o intervalo inteiro ficou abaixo ou acima do limiar (campo claramente
+  sadio ou claramente doente); ou
+- a meia-largura do intervalo caiu para até AMOSTRAGEM_PRECISAO do limiar
+  (campo perto do limiar, mas com a média já bem estimada).
+
+Como a regra é conferida a cada folha, o intervalo usa 99% de confiança
+(e não 95%) para compensar as várias olhadas, e nada é decidido antes de
+AMOSTRAGEM_MIN_FOLHAS: a severidade tem muitos zeros e poucas folhas muito
+atacadas, e amostras pequenas subestimam a variância.
+"""
+import math
+import os
+from typing import Dict, Optional, Tuple
+
+LIMIAR_TRATAMENTO = float(os.environ.get("LIMIAR_TRATAMENTO", "5.0"))  # Severidade média (%) que muda a recomendação
+AMOSTRAGEM_MIN_FOLHAS = int(os.environ.get("AMOSTRAGEM_MIN_FOLHAS", "20"))
+AMOSTRAGEM_PRECISAO = float(os.environ.get("AMOSTRAGEM_PRECISAO", "0.2"))  # Meia-largura máxima, como fração do limiar
+Z_99 = 2.5758
+
+
+def quantil_t(graus: int, z: float = Z_99) -> float:
+    """Quantil aproximado da t de Student (expansão de Cornish-Fisher a partir da normal)"""
+    if graus <= 0:
+        return math.inf
+    return z + (z ** 3 + z) / (4 * graus) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * graus ** 2)
+
+
+class EstimadorSequencial:
+    """Média e intervalo de confiança da severidade, atualizados a cada folha (Welford)"""
+
+    def __init__(self, limiar: float = LIMIAR_TRATAMENTO, min_folhas: int = AMOSTRAGEM_MIN_FOLHAS,
+                 precisao: float = AMOSTRAGEM_PRECISAO):
+        self.limiar = limiar
+        self.min_folhas = min_folhas
+        self.precisao = precisao
+        self.n = 0
+        self.media = 0.0
+        self._m2 = 0.0
+
+    def adicionar(self, severidade: float) -> None:
+        x = min(100.0, max(0.0, float(severidade)))
+        self.n += 1
+        delta = x - self.media
+        self.media += delta / self.n
+        self._m2 += delta * (x - self.media)
+
+    @property
+    def desvio(self) -> float:
+        return math.sqrt(self._m2 / (self.n - 1)) if self.n > 1 else 0.0
+
+    def intervalo(self) -> Tuple[float, float]:
+        """Intervalo de 99% para a severidade média (limitado a 0-100%)"""
+        if self.n < 2:
+            return 0.0, 100.0
+        meia = quantil_t(self.n - 1) * self.desvio / math.sqrt(self.n)
+        return max(0.0, self.media - meia), min(100.0, self.media + meia)
+
+    def decisao(self) -> Optional[str]:
+        """None enquanto for preciso continuar; senão a decisão (abaixo, acima ou precisa)"""
+        if self.n < self.min_folhas:
+            return None
+        inferior, superior = self.intervalo()
+        if superior < self.limiar:
+            return "abaixo"
+        if inferior > self.limiar:
+            return "acima"
+        if (superior - inferior) / 2 <= self.precisao * self.limiar:
+            return "precisa"
+        return None
+
+    def resumo(self) -> Dict:
+        inferior, superior = self.intervalo()
+        return {"n": self.n, "media": round(self.media, 2), "ic99": [round(inferior, 2), round(superior, 2)],
+                "decisao": self.decisao()}
+
+    def mensagem(self) -> str:
+        """Texto curto para a tela de progresso"""
+        inferior, superior = self.intervalo()
+        decisao = self.decisao()
+        if decisao == "abaixo":
+            return f"Severidade média abaixo de {self.limiar:g}% com 99% de confiança ({self.n} folhas)"
+        if decisao == "acima":
+            return f"Severidade média acima de {self.limiar:g}% com 99% de confiança ({self.n} folhas)"
+        if decisao == "precisa":
+            return f"Média estimada com precisão: {self.media:.2f}% ± {(superior - inferior) / 2:.2f} ({self.n} folhas)"
+        if self.n < self.min_folhas:
+            return f"Estimativa: {self.media:.2f}% (mínimo de {self.min_folhas} folhas para decidir)"
+        return f"Estimativa: {self.media:.2f}% (IC 99%: {inferior:.2f}–{superior:.2f}%)"
@@ -0,0 +1,53 @@
+# frontend_flet/codificacao.py
+"""Respostas da API em MessagePack, com JSON de reserva
+
+Com "Accept: application/msgpack" a API (backend_api/codificacao.py) manda
+as imagens em bytes crus, sem o base64, e as colunas numéricas (caixas,
+confianças, classes, contornos) como arrays tipados. Cada array é uma
+extensão EXT_ARRAY do MessagePack com:
+- o tipo, na numeração das tags do RFC 8746 (85 = float32, 64 = uint8...);
+- o número de dimensões e a forma (uint32 cada);
+- os bytes, little-endian.
+
+Aqui eles voltam como arrays numpy. Sem o pacote msgpack o cliente pede
+JSON, como antes; a API também responde em JSON se não tiver o msgpack.
+"""
+import base64
+import struct
+from typing import Any, Dict
+
+import numpy as np
+import requests
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK = "application/msgpack"
+ACCEPT = f"{MSGPACK}, application/json;q=0.5" if msgpack is not None else "application/json"
+EXT_ARRAY = 1
+TIPOS_ARRAY = {64: "u1", 69: "<u2", 70: "<u4", 71: "<u8", 72: "i1", 77: "<i2", 78: "<i4", 79: "<i8",
+               84: "<f2", 85: "<f4", 86: "<f8"}
+
+
+def _array(codigo: int, dados: bytes) -> Any:
+    if codigo != EXT_ARRAY:
+        return msgpack.ExtType(codigo, dados)
+    tag, ndim = struct.unpack_from("<BB", dados)
+    forma = struct.unpack_from(f"<{ndim}I", dados, 2)
+    return np.frombuffer(dados, dtype=TIPOS_ARRAY[tag], offset=2 + 4 * ndim).reshape(forma)
+
+
+def ler_resposta(response: requests.Response) -> Dict:
+    """Corpo da resposta em MessagePack ou JSON, conforme o Content-Type"""
+    if msgpack is not None and response.headers.get("Content-Type", "").startswith(MSGPACK):
+        return msgpack.unpackb(response.content, raw=False, ext_hook=_array)
+    return response.json()
+
+
+def imagem_b64(resultado: Dict, campo: str) -> str:
+    """Imagem da resposta em base64 para o ft.Image (bytes no MessagePack, campo _b64 no JSON)"""
+    if isinstance(resultado.get(campo), (bytes, bytearray)):
+        return base64.b64encode(resultado[campo]).decode("utf-8")
+    return resultado.get(f"{campo}_b64", "")
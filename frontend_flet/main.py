@@ -7,6 +7,9 @@ import requests
 import base64
 import time
 import threading
+import uuid
+import collections
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 import json
 import matplotlib
@@ -21,11 +24,17 @@ import requests_cache
 import openmeteo_requests
 from retry_requests import retry
 import os
+import urllib.parse
+
+from amostragem import EstimadorSequencial, AMOSTRAGEM_MIN_FOLHAS
+import codificacao
 
 
 # --- URL DA SUA API (Preenchida com a URL do seu serviço Cloud Run) ---
 # Substitua pela URL real da sua API quando implantada
 API_URL = "https://revisao-deteccao-v6---cultivatrack-api-5f6w6oqomq-rj.a.run.app"
+# Requisições de severidade simultâneas no levantamento (a API tem 4 threads por instância)
+SEVERIDADE_EM_VOO = int(os.environ.get("SEVERIDADE_EM_VOO", "2"))
 
 # --- Constantes e Funções Leves (Clima, Gráficos, etc.) ---
 WEATHER_CODES = {
@@ -149,6 +158,16 @@ def criar_botao_pdf_simple():
         ft.Text("Baixar PDF com instruções")
     ], alignment=ft.MainAxisAlignment.CENTER)
 
+# POST de análise com Idempotency-Key: 409 + Retry-After quer dizer que a requisição
+# original ainda está rodando no servidor; reenviar com a mesma chave pega o resultado dela
+def post_idempotente(url: str, tentativas: int = 3, **kwargs) -> requests.Response:
+    for _ in range(tentativas):
+        response = requests.post(url, **kwargs)
+        if response.status_code != 409 or "Retry-After" not in response.headers:
+            break
+        time.sleep(min(30, int(response.headers["Retry-After"])))
+    return response
+
 # Função para carregar imagem como base64 (fallback)
 def load_image_as_base64(image_path: str) -> Optional[str]:
     """Carrega uma imagem como base64 para uso em caso de falha dos assets estáticos"""
@@ -470,6 +489,10 @@ def main(page: ft.Page):
             ft.Dropdown(label="Unidade", options=[ft.dropdown.Option("ha"), ft.dropdown.Option("tarefas")], value="ha", width=150, bgcolor="#F1F8E9", border_color="#81C784")
         ], alignment=ft.MainAxisAlignment.CENTER, spacing=15)
 
+        # Com o talhão preenchido, a API guarda as análises e o histórico fica disponível
+        campo_talhao = ft.TextField(label="Talhão", hint_text="Nome do talhão (opcional, para o histórico)",
+                                    value=APP_STATE.get("talhao", ""), width=310, bgcolor="#F1F8E9", border_color="#81C784")
+
         def calcular_amostragem(e):
             try:
                 value = float(row_cult_unit.controls[0].value)
@@ -488,6 +511,12 @@ def main(page: ft.Page):
                     ft.Text(f"Para {value} {unit}:\n\n• Total de plantas a amostrar: {num_plantas}\n• Total de folhas a coletar: {num_folhas}",
                         size=16, color="#424242", weight=ft.FontWeight.BOLD)
                 )
+                resultado_container.content.controls.append(
+                    ft.Text(f"A análise com IA para sozinha quando a severidade média já estiver definida "
+                            f"(mínimo de {AMOSTRAGEM_MIN_FOLHAS} folhas): em campos claramente sadios ou doentes, "
+                            f"bem menos folhas são analisadas.",
+                        size=14, color="#616161", italic=True)
+                )
 
                 # Adicionar instruções de coleta com imagens (igual ao código original)
                 resultado_container.content.controls.append(
@@ -536,7 +565,7 @@ def main(page: ft.Page):
         )
 
         container_amostragem = ft.Container(
-            content=ft.Column([row_cult_unit, btn_calcular], alignment=ft.MainAxisAlignment.CENTER, horizontal_alignment=ft.CrossAxisAlignment.CENTER, spacing=20),
+            content=ft.Column([campo_talhao, row_cult_unit, btn_calcular], alignment=ft.MainAxisAlignment.CENTER, horizontal_alignment=ft.CrossAxisAlignment.CENTER, spacing=20),
             padding=25, bgcolor="#F1F8E9", border_radius=20, width=380
         )
 
@@ -690,51 +719,91 @@ def main(page: ft.Page):
                     progress_bar.value = 0.0
                     page.update()
                     
-                    # Processar cada imagem
+                    # Processar as imagens
                     severidades = []
                     plot_images = []
-                    total_images = len(APP_STATE.get("uploaded_files_data", []))
-                    
-                    for i, file_data in enumerate(APP_STATE.get("uploaded_files_data", [])):
-                        # Atualizar progresso
-                        current_step = i + 1
-                        progress_percentage = (current_step - 1) / total_images
-                        progress_bar.value = progress_percentage
-                        progress_text.value = f"Processando imagem {current_step} de {total_images}"
-                        progress_detail.value = f"Analisando lesões com inteligência artificial..."
-                        page.update()
-                        
-                        # Converter bytes para base64 antes de enviar
-                        import base64
+                    analises_vistas = set()  # analise_id das fotos já contadas neste levantamento
+                    repetidas = 0
+                    recomendacao = None
+                    arquivos = list(APP_STATE.get("uploaded_files_data", []))
+                    total_images = len(arquivos)
+                    # Amostragem sequencial: para de enviar imagens quando a média já decide o manejo
+                    estimador = EstimadorSequencial()
+                    em_voo = collections.deque()  # (número da imagem, Future), na ordem de envio
+                    enviadas = 0
+                    # Talhão e levantamento: a API grava cada análise no histórico do talhão
+                    APP_STATE["talhao"] = (campo_talhao.value or "").strip()
+                    extras = {"talhao": APP_STATE["talhao"], "levantamento": str(uuid.uuid4())} if APP_STATE["talhao"] else {}
+                    # Cultura escolhida: a API usa o modelo treinado para ela, se houver
+                    extras["cultura"] = APP_STATE.get("cultura_selecionada")
+
+                    def enviar(file_data):
+                        # Chamar API de IA (a mesma Idempotency-Key em reenvios da mesma foto
+                        # faz o servidor devolver o resultado já calculado)
                         file_b64 = base64.b64encode(file_data["bytes"]).decode('utf-8')
-                        
-                        # Chamar API de IA
-                        response = requests.post(
+                        return post_idempotente(
                             f"{API_URL}/predict",
-                            json={"file": file_b64},
-                            headers={"Content-Type": "application/json"},
+                            json={"file": file_b64, **extras},
+                            headers={"Content-Type": "application/json", "Accept": codificacao.ACCEPT,
+                                     "Idempotency-Key": file_data.setdefault("idempotency_key", str(uuid.uuid4()))},
                             timeout=120
                         )
-                        
-                        if response.status_code == 200:
-                            result = response.json()
-                            severidades.append(result.get("severity", 0))
-                            plot_images.append(result.get("plot_image_b64", ""))
-                            recomendacao = result.get("recomendacao", {})
-                            
-                            # Atualizar progresso com mais detalhes
-                            severity = result.get("severity", 0)
-                            progress_detail.value = f"Imagem {current_step}: {severity:.2f}% de severidade detectada"
-                            page.update()
-                        else:
-                            print(f"Erro na API: {response.status_code} - {response.text}")
-                            progress_text.value = f"Erro na API: {response.status_code}"
-                            progress_detail.value = f"Falha no processamento da imagem {current_step}"
-                            progress_ring.visible = False
-                            progress_bar.visible = False
+
+                    executor = ThreadPoolExecutor(max_workers=SEVERIDADE_EM_VOO)
+                    try:
+                        while em_voo or (enviadas < total_images and estimador.decisao() is None):
+                            # Novas imagens só enquanto a estimativa não basta; as que já estão em voo são aproveitadas
+                            while enviadas < total_images and len(em_voo) < SEVERIDADE_EM_VOO and estimador.decisao() is None:
+                                em_voo.append((enviadas + 1, executor.submit(enviar, arquivos[enviadas])))
+                                enviadas += 1
+                            current_step, futuro = em_voo.popleft()
+
+                            # Atualizar progresso
+                            progress_bar.value = (current_step - 1) / total_images
+                            progress_text.value = f"Processando imagem {current_step} de {total_images}"
+                            progress_detail.value = f"Analisando lesões com inteligência artificial..."
                             page.update()
-                            return
-                    
+
+                            try:
+                                response = futuro.result()
+                            except requests.RequestException as ex:
+                                response, erro_conexao = None, ex
+                            if response is not None and response.status_code == 200:
+                                # MessagePack (imagem em bytes crus) ou JSON, conforme a API respondeu
+                                result = codificacao.ler_resposta(response)
+                                severity = result.get("severity", 0)
+                                duplicata = result.get("duplicata")
+                                if duplicata and duplicata.get("de") in analises_vistas:
+                                    # Mesma folha de uma foto anterior deste levantamento: não entra na média
+                                    repetidas += 1
+                                    progress_detail.value = f"Imagem {current_step}: mesma folha de uma foto anterior, ignorada na média"
+                                    page.update()
+                                    continue
+                                analises_vistas.add(result.get("analise_id"))
+                                severidades.append(severity)
+                                estimador.adicionar(severity)
+                                plot_images.append(codificacao.imagem_b64(result, "plot_image"))
+                                recomendacao = result.get("recomendacao", {})
+
+                                # Atualizar progresso com mais detalhes
+                                progress_detail.value = f"Imagem {current_step}: {severity:.2f}% de severidade detectada\n{estimador.mensagem()}"
+                                page.update()
+                            else:
+                                if response is None:
+                                    print(f"Erro de conexão com a API: {erro_conexao}")
+                                    progress_text.value = "Erro de conexão com a API"
+                                else:
+                                    print(f"Erro na API: {response.status_code} - {response.text}")
+                                    progress_text.value = f"Erro na API: {response.status_code}"
+                                progress_detail.value = f"Falha no processamento da imagem {current_step}"
+                                progress_ring.visible = False
+                                progress_bar.visible = False
+                                page.update()
+                                return
+                    finally:
+                        # Num erro, não espera as outras imagens em voo (até 120s cada) para liberar a tela
+                        executor.shutdown(wait=False, cancel_futures=True)
+
                     # Finalizar processamento
                     progress_bar.value = 1.0
                     progress_text.value = "Finalizando análise..."
@@ -746,6 +815,13 @@ def main(page: ft.Page):
                     
                     progress_text.value = f"Severidade média: {severidade_media:.2f}%"
                     progress_detail.value = "Processamento concluído com sucesso!"
+                    if enviadas < total_images:
+                        progress_detail.value = (f"{estimador.mensagem()}. Estimativa suficiente após {enviadas} de "
+                                                 f"{total_images} imagens: as demais não precisaram ser analisadas.")
+                    elif severidades:
+                        progress_detail.value += f" {estimador.mensagem()}."
+                    if repetidas:
+                        progress_detail.value += f" ({repetidas} foto(s) repetida(s) da mesma folha ignorada(s))"
                     progress_ring.visible = False
                     progress_bar.visible = False
                     
@@ -872,6 +948,8 @@ def main(page: ft.Page):
                 alignment=ft.alignment.center
             ),
             results_container,
+            ft.ElevatedButton("Histórico do Talhão", on_click=lambda e: abrir_tela_historico((campo_talhao.value or "").strip()),
+                bgcolor="#1976D2", color=ft.Colors.WHITE, style=button_style),
             ft.ElevatedButton("Voltar", on_click=lambda e: mostrar_nova_tela(APP_STATE.get("lat"), APP_STATE.get("lon"), APP_STATE.get("cultura_selecionada"), APP_STATE.get("location_display")), bgcolor="#4CAF50", color=ft.Colors.WHITE, style=button_style)
         ], alignment=ft.MainAxisAlignment.CENTER, horizontal_alignment=ft.CrossAxisAlignment.CENTER, scroll=ft.ScrollMode.AUTO, expand=True, spacing=25))
         
@@ -1009,6 +1087,59 @@ def main(page: ft.Page):
         page.update()
     
     # --- Telas Adicionais ---
+    def abrir_tela_historico(talhao):
+        """Levantamentos anteriores do talhão, lidos dos resumos guardados na API"""
+        if not talhao:
+            page.snack_bar = ft.SnackBar(ft.Text("Digite o nome do talhão para ver o histórico"))
+            page.snack_bar.open = True
+            page.update()
+            return
+        page.clean()
+        conteudo = ft.Column(horizontal_alignment=ft.CrossAxisAlignment.CENTER, spacing=15)
+        try:
+            nome = urllib.parse.quote(talhao, safe="")
+            resumo = requests.get(f"{API_URL}/talhoes/{nome}/resumo", timeout=15).json()
+            lista = requests.get(f"{API_URL}/talhoes/{nome}/levantamentos", params={"limite": 20}, timeout=15).json()
+            progresso = requests.get(f"{API_URL}/talhoes/{nome}/progresso", params={"dias": 1}, timeout=15).json()
+        except Exception as ex:
+            print(f"Erro ao buscar histórico: {ex}")
+            resumo, lista, progresso = None, None, {}
+
+        if resumo is None or lista is None:
+            conteudo.controls.append(ft.Text("Não foi possível carregar o histórico.", size=16, color="#D32F2F"))
+        elif not resumo.get("n"):
+            conteudo.controls.append(ft.Text("Nenhuma análise registrada para este talhão.", size=16, color="#424242"))
+        else:
+            tendencia = resumo.get("tendencia_pp_dia")
+            texto_tendencia = "—" if tendencia is None else f"{tendencia:+.2f} p.p./dia"
+            conteudo.controls.append(ft.Container(
+                content=ft.Text(
+                    f"Folhas analisadas: {resumo['n']}\n"
+                    f"Severidade média: {resumo['media']:.2f}% (mediana {resumo['p50']:.2f}%, p90 {resumo['p90']:.2f}%)\n"
+                    f"Folhas acima de {resumo['limiar']:g}%: {resumo['fracao_acima_limiar'] * 100:.0f}%\n"
+                    f"Tendência: {texto_tendencia}"
+                    + (f"\nAUDPC: {progresso['audpc']:.1f} %·dia em {progresso['dias']} dias avaliados"
+                       if progresso.get("dias") else ""),
+                    size=15, color="#424242"),
+                padding=20, bgcolor="#F1F8E9", border_radius=20, width=380))
+            for lev in lista.get("levantamentos", []):
+                data = datetime.fromtimestamp(lev["fim"]).strftime("%d/%m/%Y %H:%M")
+                cor = "#D32F2F" if lev["media"] >= resumo["limiar"] else "#2E7D32"
+                conteudo.controls.append(ft.Container(
+                    content=ft.Row([
+                        ft.Text(data, size=14, color="#424242", width=130),
+                        ft.Text(f"{lev['n']} folhas", size=14, color="#424242", width=80),
+                        ft.Text(f"{lev['media']:.2f}%", size=16, weight=ft.FontWeight.BOLD, color=cor),
+                    ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
+                    padding=10, bgcolor="#F5F5F5", border_radius=10, width=360))
+
+        page.add(ft.Column([
+            ft.Text(f"Histórico: {talhao}", size=24, weight=ft.FontWeight.BOLD, color="#1976D2"),
+            conteudo,
+            ft.ElevatedButton("Voltar", on_click=mostrar_tela_avaliar_severidade, style=button_style)
+        ], horizontal_alignment=ft.CrossAxisAlignment.CENTER, spacing=20, scroll=ft.ScrollMode.AUTO, expand=True))
+        page.update()
+
     def abrir_tela_grafico(e):
         page.clean()
         graph_image = ft.Image(src_base64=generate_risk_graph(APP_STATE.get("classificacao_list", [])), width=380, fit=ft.ImageFit.CONTAIN) if APP_STATE.get("classificacao_list") else ft.Text("Dados de risco não disponíveis.")
@@ -1571,21 +1702,22 @@ def main(page: ft.Page):
                     file_b64 = base64.b64encode(file_data["bytes"]).decode('utf-8')
                     
                     # Chamar API de detecção
-                    response = requests.post(
+                    response = post_idempotente(
                         f"{API_URL}/detect_disease",
-                        json={"file": file_b64},
-                        headers={"Content-Type": "application/json"},
+                        json={"file": file_b64, "cultura": APP_STATE.get("cultura_selecionada")},
+                        headers={"Content-Type": "application/json", "Accept": codificacao.ACCEPT,
+                                 "Idempotency-Key": file_data.setdefault("idempotency_key", str(uuid.uuid4()))},
                         timeout=60
                     )
                     
                     progress_ring.visible = False
                     
                     if response.status_code == 200:
-                        result = response.json()
+                        result = codificacao.ler_resposta(response)
                         detected_disease = result.get("detected_disease", "indefinido")
                         detections = result.get("detections", [])
                         confidence = result.get("confidence", 0.0)
-                        plot_image_b64 = result.get("plot_image_b64", "")
+                        plot_image_b64 = codificacao.imagem_b64(result, "plot_image")
                         
                         # Mapear resultado para nome amigável
                         disease_names = {
@@ -1914,6 +2046,8 @@ async def get_upload_page():
         const uploadButton = document.getElementById("uploadButton");
         const okButton = document.getElementById("okButton");
         const statusDiv = document.getElementById("status");
+        const API_WS_URL = "__API_WS_URL__";  // WebSocket da API para a detecção ao vivo
+        const LIVE_MAX_SIDE = 320;  // Lado maior dos quadros enviados ao vivo
         let uploadedCount = 0;
         let selectedFiles = [];
 
@@ -2015,6 +2149,17 @@ async def get_upload_page():
                         object-fit: cover;
                     "></video>
                     
+                    <!-- Caixas da detecção ao vivo -->
+                    <canvas id="liveOverlay" style="
+                        position: absolute;
+                        top: 0;
+                        left: 0;
+                        width: 100%;
+                        height: 100%;
+                        pointer-events: none;
+                        z-index: 1;
+                    "></canvas>
+                    
                     <!-- Sobreposição com guias visuais -->
                     <div style="
                         position: absolute;
@@ -2026,7 +2171,7 @@ async def get_upload_page():
                         z-index: 1;
                     ">
                         <!-- Retângulo guia central (50% do tamanho da tela) -->
-                        <div style="
+                        <div id="guideRect" style="
                             position: absolute;
                             top: 25%;
                             left: 25%;
@@ -2061,8 +2206,8 @@ async def get_upload_page():
                             transform: translateX(-50%);
                         "></div>
                         
-                        <!-- Instruções -->
-                        <div style="
+                        <!-- Instruções (trocadas pelas dicas da detecção ao vivo) -->
+                        <div id="guideTips" style="
                             position: absolute;
                             top: 10%;
                             left: 50%;
@@ -2124,6 +2269,95 @@ async def get_upload_page():
             const closeCameraBtn = document.getElementById('closeCameraBtn');
             let stream = null;
 
+            // === DETECÇÃO AO VIVO (WebSocket /ao_vivo da API) ===
+            // Manda quadros reduzidos da área visível; o servidor analisa só o mais recente
+            // e devolve as caixas e uma nota de qualidade do enquadramento
+            const overlay = document.getElementById('liveOverlay');
+            const guideRect = document.getElementById('guideRect');
+            const guideTips = document.getElementById('guideTips');
+            const guideTipsDefault = guideTips.innerHTML;
+            const frameCanvas = document.createElement('canvas');
+            let liveSocket = null;
+            let liveTimer = null;
+
+            function visibleRegion() {
+                // object-fit: cover corta o vídeo; este é o trecho que aparece na tela
+                const vw = video.videoWidth, vh = video.videoHeight;
+                const scale = Math.max(video.clientWidth / vw, video.clientHeight / vh);
+                const sw = video.clientWidth / scale, sh = video.clientHeight / scale;
+                return { sx: (vw - sw) / 2, sy: (vh - sh) / 2, sw: sw, sh: sh };
+            }
+
+            function sendFrame() {
+                // Só manda outro quadro quando o anterior já saiu do navegador
+                if (!liveSocket || liveSocket.readyState !== WebSocket.OPEN || liveSocket.bufferedAmount > 0 || !video.videoWidth) return;
+                const r = visibleRegion();
+                const scale = Math.min(1, LIVE_MAX_SIDE / Math.max(r.sw, r.sh));
+                frameCanvas.width = Math.round(r.sw * scale);
+                frameCanvas.height = Math.round(r.sh * scale);
+                frameCanvas.getContext('2d').drawImage(video, r.sx, r.sy, r.sw, r.sh, 0, 0, frameCanvas.width, frameCanvas.height);
+                frameCanvas.toBlob(function(blob) {
+                    if (blob && liveSocket && liveSocket.readyState === WebSocket.OPEN) liveSocket.send(blob);
+                }, 'image/jpeg', 0.7);
+            }
+
+            function drawLive(result) {
+                overlay.width = overlay.clientWidth;
+                overlay.height = overlay.clientHeight;
+                const ctx = overlay.getContext('2d');
+                const d = result.deteccoes;
+                ctx.lineWidth = 3;
+                ctx.font = '16px Arial';
+                for (let i = 0; i < d.x1.length; i++) {
+                    const x = d.x1[i] * overlay.width, y = d.y1[i] * overlay.height;
+                    ctx.strokeStyle = ctx.fillStyle = '#FF5722';
+                    ctx.strokeRect(x, y, (d.x2[i] - d.x1[i]) * overlay.width, (d.y2[i] - d.y1[i]) * overlay.height);
+                    ctx.fillText(`${d.class_name[i]} ${Math.round(d.confidence[i] * 100)}%`, x + 4, Math.max(16, y - 6));
+                }
+                const q = result.qualidade;
+                guideRect.style.borderColor = q.pronto ? '#4CAF50' : '#FF9800';
+                if (q.pronto) {
+                    guideTips.innerHTML = `✅ Boa imagem (${Math.round(q.nota * 100)}%), pode capturar`;
+                } else {
+                    guideTips.innerHTML = q.dicas.length ? q.dicas.join('<br>') : `Qualidade ${Math.round(q.nota * 100)}%`;
+                }
+            }
+
+            function startLive() {
+                if (!('WebSocket' in window) || liveSocket) return;
+                try {
+                    liveSocket = new WebSocket(API_WS_URL + '/ao_vivo?perfil=fast');
+                } catch (err) {
+                    return;  // Sem ao vivo, a câmera continua funcionando como antes
+                }
+                liveSocket.onmessage = function(event) {
+                    const msg = JSON.parse(event.data);
+                    if (msg.error) {
+                        console.warn('Detecção ao vivo:', msg.error);
+                        if (msg.fim) stopLive();
+                    } else if (msg.fps) {
+                        // Conexão aceita: envia no ritmo que o servidor analisa
+                        liveTimer = setInterval(sendFrame, 1000 / msg.fps);
+                    } else {
+                        drawLive(msg);
+                    }
+                };
+                liveSocket.onclose = stopLive;
+            }
+
+            function stopLive() {
+                if (liveTimer) clearInterval(liveTimer);
+                liveTimer = null;
+                const socket = liveSocket;
+                liveSocket = null;
+                if (socket && socket.readyState <= WebSocket.OPEN) socket.close();
+                guideTips.innerHTML = guideTipsDefault;
+                guideRect.style.borderColor = '#4CAF50';
+                overlay.getContext('2d').clearRect(0, 0, overlay.width, overlay.height);
+            }
+
+            video.addEventListener('loadedmetadata', startLive);
+
             navigator.mediaDevices.getUserMedia({ 
                 video: { 
                     facingMode: 'environment',  // Câmera traseira
@@ -2155,6 +2389,7 @@ async def get_upload_page():
                     statusDiv.innerText = `${selectedFiles.length} imagem(ns) capturada(s)`;
                     
                     // Fechar câmera
+                    stopLive();
                     if (stream) {
                         stream.getTracks().forEach(track => track.stop());
                     }
@@ -2164,6 +2399,7 @@ async def get_upload_page():
 
             // Função para fechar câmera
             closeCameraBtn.addEventListener('click', function() {
+                stopLive();
                 if (stream) {
                     stream.getTracks().forEach(track => track.stop());
                 }
@@ -2173,7 +2409,8 @@ async def get_upload_page():
     </script>
 </body>
 </html>"""
-        return HTMLResponse(content=upload_html)
+        api_ws_url = API_URL.replace("https://", "wss://", 1).replace("http://", "ws://", 1)
+        return HTMLResponse(content=upload_html.replace("__API_WS_URL__", api_ws_url))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao servir página de upload: {str(e)}")
 